@@ -0,0 +1,101 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Micro-benchmark for building the V/X/Y waveform in ClassicCommunicator.send, using desktop Python.
+# Compares the previous approach (new array built for each packet) with the precomputed template.
+# Run from the repository root: python benchmarks/classic_send.py
+
+import array
+import os
+import sys
+import time
+import tracemalloc
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "lib"))
+
+# The hardware modules are imported by the communicator modules but not used by `send`.
+for name in ["digitalio", "pulseio", "rp2pio", "supervisor"]:
+	sys.modules.setdefault(name, types.ModuleType(name))
+
+from dmcomm.hardware.comms.classic import ClassicCommunicator, ClassicParams
+from dmcomm.hardware.pins import ProngOutput, ProngInput
+
+PACKETS = 20000
+
+class ArraySink:
+	def __init__(self):
+		self.last = None
+	def write(self, buf):
+		self.last = buf
+
+def send_previous(params, bits):
+	"Copy of ClassicCommunicator.send from before the template was added."
+	if params.idle_state == True:
+		DRIVE_ACTIVE = 0
+		DRIVE_IDLE = 1
+	else:
+		DRIVE_ACTIVE = 1
+		DRIVE_IDLE = 0
+	RELEASE = 2
+	array_to_send = array.array("L", [
+		DRIVE_IDLE, params.pre_idle_send,
+		DRIVE_ACTIVE, params.pre_active_send,
+		DRIVE_IDLE, params.start_idle_send,
+		DRIVE_ACTIVE, params.start_active_send,
+	])
+	for i in range(16):
+		array_to_send.append(DRIVE_IDLE)
+		if bits & 1:
+			array_to_send.append(params.bit1_idle_send)
+			array_to_send.append(DRIVE_ACTIVE)
+			array_to_send.append(params.bit1_active_send)
+		else:
+			array_to_send.append(params.bit0_idle_send)
+			array_to_send.append(DRIVE_ACTIVE)
+			array_to_send.append(params.bit0_active_send)
+		bits >>= 1
+	array_to_send.append(DRIVE_IDLE)
+	array_to_send.append(params.cooldown_send)
+	array_to_send.append(RELEASE)
+	return array_to_send
+
+def make_communicator(signal_type):
+	comm = ClassicCommunicator(ProngOutput("out", "pull"), ProngInput("in"))
+	comm._params = ClassicParams(signal_type)
+	comm._output_state_machine = ArraySink()
+	comm._build_template()
+	comm._enabled = True
+	return comm
+
+def measure(fn):
+	"Returns (microseconds per packet, bytes allocated during one packet)."
+	fn(0)  # warm up
+	start = time.perf_counter()
+	for i in range(PACKETS):
+		fn(i & 0xFFFF)
+	elapsed = time.perf_counter() - start
+	tracemalloc.start()
+	before = tracemalloc.get_traced_memory()[0]
+	tracemalloc.reset_peak()
+	fn(0x1234)
+	peak = tracemalloc.get_traced_memory()[1]
+	tracemalloc.stop()
+	return (elapsed / PACKETS * 1e6, peak - before)
+
+def main():
+	print("type  method     us/packet  bytes allocated")
+	for signal_type in ["V", "X", "Y"]:
+		comm = make_communicator(signal_type)
+		params = comm._params
+		for bits in [0x0000, 0xFFFF, 0x1234]:
+			assert comm.send(bits) is None
+			assert comm._output_state_machine.last == send_previous(params, bits)
+		results = [
+			("previous", measure(lambda bits: send_previous(params, bits))),
+			("template", measure(comm.send)),
+		]
+		for (method, (us, allocated)) in results:
+			print(f"{signal_type:<5} {method:<10} {us:9.2f}  {allocated:15d}")
+
+if __name__ == "__main__":
+	main()
@@ -0,0 +1,129 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Micro-benchmark for ColorCommunicator send and decode with several words per packet, using desktop Python.
+# Compares the previous approach (appending 4 entries per bit, decoding with attribute lookups)
+# with the nibble table and single-pass decode.
+# Run from the repository root: python benchmarks/color_words.py
+
+import array
+import collections
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "lib"))
+
+# The hardware modules are imported by the communicator modules but not used by `send` and `decode`.
+for name in ["digitalio", "pulseio", "rp2pio", "supervisor"]:
+	sys.modules.setdefault(name, types.ModuleType(name))
+
+from dmcomm import ReceiveError
+from dmcomm.hardware.comms import color
+from dmcomm.hardware.pins import ProngOutput, ProngInput
+
+MIN_SECONDS = 0.5
+
+class ArraySink:
+	def __init__(self):
+		self.last = None
+	def write(self, buf):
+		self.last = buf
+
+def send_previous(params, data):
+	"Copy of ColorCommunicator.send from before the nibble table was added."
+	DRIVE_ACTIVE = 0
+	DRIVE_IDLE = 1
+	RELEASE = 2
+	array_to_send = array.array("L", [
+		DRIVE_IDLE, params.pre_idle_send,
+		DRIVE_ACTIVE, params.pre_active_send,
+	])
+	for bits in data:
+		for i in range(16):
+			array_to_send.append(DRIVE_IDLE)
+			array_to_send.append(params.bit_idle_send)
+			array_to_send.append(DRIVE_ACTIVE)
+			if bits & 1:
+				array_to_send.append(params.bit1_active_send)
+			else:
+				array_to_send.append(params.bit0_active_send)
+			bits >>= 1
+	array_to_send.append(DRIVE_IDLE)
+	array_to_send.append(params.cooldown_send)
+	array_to_send.append(RELEASE)
+	return array_to_send
+
+def decode_previous(pulses, params):
+	"Copy of the decoding in ColorCommunicator.receive_steps from before the single-pass decode."
+	if len(pulses) < params.pulses_expected:
+		raise ReceiveError("incomplete: %d pulses" % len(pulses))
+	t = pulses.popleft()
+	if t < params.pre_active_min:
+		raise ReceiveError("pre_active = %d" % t)
+	results = []
+	bit_count = 0
+	while len(pulses) > 0:
+		result = 0
+		for i in range(16):
+			t = pulses.popleft()
+			if t < params.bit_idle_min or t > params.bit_idle_max:
+				raise ReceiveError("bit_idle %d = %d" % (bit_count + 1, t))
+			t = pulses.popleft()
+			if t < params.bit_active_min or t > params.bit_active_max:
+				raise ReceiveError("bit_active %d = %d" % (bit_count + 1, t))
+			result >>= 1
+			if t > params.bit_active_threshold:
+				result |= 0x8000
+			bit_count += 1
+		results.append(result)
+	return results
+
+def make_communicator():
+	comm = color.ColorCommunicator(ProngOutput("out", "pull"), ProngInput("in"))
+	comm._params = color.ColorParams("C")
+	comm._output_state_machine = ArraySink()
+	comm._nibble_table = memoryview(color.nibble_table(comm._params))
+	comm._build_template(color.TEMPLATE_WORDS)
+	comm._enabled = True
+	return comm
+
+def received_durations(array_sent):
+	"Returns the durations PulseIn records for a sent waveform: from the pre-active to the last active."
+	return list(array_sent[3:-3:2])
+
+def per_call_us(fn):
+	fn()  # warm up
+	count = 0
+	start = time.perf_counter()
+	while True:
+		fn()
+		count += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= MIN_SECONDS:
+			return elapsed / count * 1e6
+
+def main():
+	comm = make_communicator()
+	params = comm._params
+	print("words  method     send us/word  decode us/word")
+	for num_words in [1, 8, 32]:
+		data = [(i * 0x1357 + 0x2468) & 0xFFFF for i in range(num_words)]
+		comm.send(data)
+		assert list(comm._output_state_machine.last) == list(send_previous(params, data))
+		durations = received_durations(send_previous(params, data))
+		# So that the whole packet is accepted, as it would be with a longer packet type.
+		params.pulses_expected = len(durations)
+		assert color.decode(collections.deque(durations), params) == data
+		assert decode_previous(collections.deque(durations), params) == data
+		results = [
+			("previous", per_call_us(lambda: send_previous(params, data)),
+				per_call_us(lambda: decode_previous(collections.deque(durations), params))),
+			("table", per_call_us(lambda: comm.send(data)),
+				per_call_us(lambda: color.decode(collections.deque(durations), params))),
+		]
+		for (method, send_us, decode_us) in results:
+			print(f"{num_words:<6} {method:<10} {send_us / num_words:12.2f}  {decode_us / num_words:14.2f}")
+
+if __name__ == "__main__":
+	main()
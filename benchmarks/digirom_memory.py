@@ -0,0 +1,79 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Memory used by a parsed DigiROM, comparing one which keeps a list of plain segment objects (as before)
+# with one which keeps the array-backed segment store. Both include the DigiROM object itself.
+# Runs under desktop Python (using tracemalloc) or CircuitPython (using gc.mem_free):
+# from the repository root: python benchmarks/digirom_memory.py
+# or copy to CIRCUITPY alongside lib/dmcomm and import it from the REPL.
+
+import gc
+import os
+import sys
+
+try:
+	sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "lib"))
+except AttributeError:
+	pass  # CircuitPython: lib is already on the path
+
+import dmcomm.protocol
+from dmcomm.protocol.digirom import ClassicCommandSegment, ClassicDigiROM
+
+# 17 packets
+COMMAND = "IC2-0007-^0^207-0007-@400F" + "-0000" * 13
+
+class PlainClassicCommandSegment:
+	"Same as ClassicCommandSegment before __slots__ was added."
+	def __init__(self, bits, copy_mask=0, invert_mask=0, checksum_target=None, check_digit_LSB_pos=12):
+		self.data = bits
+		self.copy_mask = copy_mask
+		self.invert_mask = invert_mask
+		self.checksum_target = checksum_target
+		self.check_digit_LSB_pos = check_digit_LSB_pos
+	@classmethod
+	def from_string(cls, text):
+		c = ClassicCommandSegment.from_string(text)
+		return cls(c.data, c.copy_mask, c.invert_mask, c.checksum_target, c.check_digit_LSB_pos)
+
+class PlainClassicDigiROM(ClassicDigiROM):
+	"Keeps a list of segment objects, as before the segment store. Only for measuring: it can't be executed."
+	command_segment_class = PlainClassicCommandSegment
+	def _new_segment_store(self):
+		return []
+
+def build_plain():
+	parts = COMMAND.split("-")
+	return PlainClassicDigiROM(parts[0][:-1], int(parts[0][-1]), text_segments=parts[1:])
+
+def build_compiled():
+	return dmcomm.protocol.parse_command(COMMAND)
+
+def measure(fn):
+	"Returns the number of bytes still allocated after calling fn and keeping the result."
+	try:
+		import tracemalloc
+	except ImportError:
+		tracemalloc = None
+	gc.collect()
+	if tracemalloc is not None:
+		tracemalloc.start()
+		before = tracemalloc.get_traced_memory()[0]
+		kept = fn()
+		gc.collect()
+		used = tracemalloc.get_traced_memory()[0] - before
+		tracemalloc.stop()
+	else:
+		before = gc.mem_free()
+		kept = fn()
+		gc.collect()
+		used = before - gc.mem_free()
+	assert len(kept) == 17
+	return used
+
+def main():
+	plain = measure(build_plain)
+	compiled = measure(build_compiled)
+	print("17-packet IC DigiROM, bytes kept:")
+	print("with plain segment list: %d" % plain)
+	print("with segment store:      %d" % compiled)
+
+main()
@@ -0,0 +1,45 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Throughput of the PIO output programs, run on the emulator in utils/pio_emulator.py.
+# These are properties of the programs rather than of the desktop, so they only change when a program does.
+# For each program: the time for each word written, the words per second, and the cycles where
+# the program waited for the FIFO while words were still being written.
+# Run from the repository root: python benchmarks/pio_throughput.py
+
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "utils"))
+
+import pio_emulator
+
+pio_programs = pio_emulator.load_programs()
+
+WORDS = 100
+
+def measure(program, frequency, words, **kwargs):
+	state_machine = pio_emulator.StateMachine(program, frequency, **kwargs)
+	state_machine.write(words)
+	end_us = state_machine.run_until_idle()
+	return {
+		"frequency": frequency,
+		"us_per_word": end_us / len(words),
+		"words_per_second": len(words) * 1_000_000 / end_us,
+		"stalled_cycles": state_machine.stalled_cycles,
+	}
+
+def main():
+	results = {
+		"iC_TX": measure(pio_programs.iC_TX, 100_000, bytes(WORDS),
+			first_out_pin=0, first_set_pin=0),
+		"xloader_TX": measure(pio_programs.xloader_TX, 583430, bytes(WORDS),
+			first_out_pin=0, first_set_pin=0),
+		# Alternating drive words and 1000us delays, as in a V/X/Y packet.
+		"prong_TX": measure(pio_programs.prong_TX, 1_000_000, [0, 1000] * (WORDS // 2),
+			first_set_pin=0, set_pin_count=2, initial_set_pin_direction=0),
+	}
+	print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+	main()
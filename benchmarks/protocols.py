@@ -0,0 +1,219 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Per-packet cost of the protocol hot paths for every signal type, using desktop Python:
+# parse_command, DigiROM _pre_send, communicator send (building the waveform),
+# and communicator receive (decoding a pulse train captured from the simulator).
+# Results are printed as JSON, to be compared between releases. Times are in microseconds,
+# per command for parse_command and per packet for the rest.
+# Run from the repository root: python benchmarks/protocols.py [--output results.json]
+
+import argparse
+import array
+import json
+import os
+import platform
+import sys
+import time
+import types
+
+_root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+sys.path.insert(0, os.path.join(_root, "lib"))
+sys.path.insert(0, os.path.join(_root, "utils"))
+
+import simulator
+
+# Large poll cost so the receive timeouts pass in a few iterations.
+sim = simulator.Simulator(poll_cost_us=1000)
+simulator.install(sim)
+
+import dmcomm.protocol
+from dmcomm.hardware import WAIT_REPLY, pio_programs
+from dmcomm.hardware.comms import barcode, classic, color, ic, modulated, talis, witches, xloader
+
+# signal type: (command, communicator class, pin attributes of `simulator.Device`, PulseIn idle state or None)
+SIGNAL_TYPES = {
+	"V": ("V1-FC03-FD02-FE01-FF00", classic.ClassicCommunicator, ["prong_output", "prong_input"], True),
+	"X": ("X1-0A79-1169-0D89-00A9", classic.ClassicCommunicator, ["prong_output", "prong_input"], True),
+	"Y": ("Y1-0001-8002-0003-^0^F40", classic.ClassicCommunicator, ["prong_output", "prong_input"], False),
+	"IC": ("IC1-0007-^0^207-0007-@400F", ic.iC_Communicator, ["ir_output", "ir_input_raw"], True),
+	"C": ("C1-0001000200030004000500060007++++-0008000900A000B000C000D000E0++++",
+		color.ColorCommunicator, ["prong_output", "prong_input"], True),
+	"DL": ("DL1-0123456789ABCD+?-FEDCBA9876543210", modulated.ModulatedCommunicator,
+		["ir_output", "ir_input_modulated"], True),
+	"FL": ("FL1-0123-4567++", modulated.ModulatedCommunicator, ["ir_output", "ir_input_modulated"], True),
+	"LT": ("LT1-0123456789ABCDEF-00112233445566^^", talis.TalisCommunicator, ["talis_input_output"], False),
+	"MW": ("MW1-0102030405^^-A1A2A3A4A5", witches.WitchesCommunicator, ["prong_output", "prong_input"], False),
+	"!XL": ("!XL1-0102030405060708-A0B0C0D0", xloader.XLoaderCommunicator, ["ir_output", "ir_input_raw"], True),
+	"BC": ("BC1-4901234567894", barcode.BarcodeCommunicator, ["ir_output"], None),
+}
+
+class Sink:
+	"""Stands in for `StateMachine` and `PulseOut`, keeping the last buffer."""
+	def __init__(self, *args, **kwargs):
+		self.last = None
+	def write(self, buffer):
+		self.last = buffer
+	def send(self, buffer):
+		self.last = buffer
+	def deinit(self):
+		pass
+
+def stand_in_modules(durations, idle_state):
+	"""Returns replacements for the `pulseio` and `rp2pio` modules which don't simulate anything."""
+	def PulseIn(pin, maxlen=2, idle_state=idle_state):
+		# Room for the whole train, since it all arrives at once, unlike on the device.
+		return simulator.PulseTrain(durations, None, idle_state)
+	class StateMachine(Sink):
+		"""Also gives the durations as input each time it is restarted, for `HalfDuplexPulses` and `PioPulseIn`.
+
+		For `HalfDuplexPulses`, they come after the 0 which the program pushes when it starts recording.
+		"""
+		def __init__(self, program, *args, **kwargs):
+			super().__init__()
+			self._words = durations
+			if list(program) == list(pio_programs.talis_half_duplex):
+				self._words = [0] + durations
+		def restart(self):
+			self.in_waiting = len(self._words)
+		def clear_rxfifo(self):
+			pass
+		def readinto(self, buffer, *, start=0, end=None):
+			end = len(buffer) if end is None else end
+			words = self._words
+			first = len(words) - self.in_waiting
+			buffer[start:end] = array.array("L", words[first:first + end - start])
+			self.in_waiting -= end - start
+	return {
+		"pulseio": types.SimpleNamespace(PulseIn=PulseIn, PulseOut=Sink),
+		"rp2pio": types.SimpleNamespace(StateMachine=StateMachine),
+	}
+
+def patch_comms(replacements):
+	"""Replaces module attributes in the hardware modules. Returns what to restore."""
+	previous = []
+	for (module_name, module) in list(sys.modules.items()):
+		if module_name.startswith("dmcomm.hardware."):
+			for (name, replacement) in replacements.items():
+				if hasattr(module, name):
+					previous.append((module, name, getattr(module, name)))
+					setattr(module, name, replacement)
+	return previous
+
+def unpatch_comms(previous):
+	for (module, name, value) in previous:
+		setattr(module, name, value)
+
+def make_communicator(device, signal_type):
+	(_, communicator_class, pin_attributes, _) = SIGNAL_TYPES[signal_type]
+	communicator = communicator_class(*[getattr(device, name) for name in pin_attributes])
+	communicator.enable(signal_type)
+	return communicator
+
+def packets(signal_type):
+	"Returns the data for each packet of the command, as it would be sent."
+	digirom = dmcomm.protocol.parse_command(SIGNAL_TYPES[signal_type][0])
+	digirom.prepare()
+	result = []
+	while True:
+		data = digirom.next()
+		if data is None:
+			return result
+		result.append(data)
+
+def capture(sender, receiver, signal_type, data):
+	"Sends data from one simulated device and returns what PulseIn would record on the other."
+	(_, _, pin_attributes, idle_state) = SIGNAL_TYPES[signal_type]
+	input_pin = getattr(receiver, pin_attributes[-1])
+	input_pin = getattr(input_pin, "pin_input", None) or input_pin.pin
+	communicator = make_communicator(sender, signal_type)
+	pulses = simulator.PulseIn(input_pin, maxlen=2000, idle_state=idle_state)
+	# Witches bits are longer than PulseIn can time, so it records with `PioPulseIn`, which has no limit.
+	pulses._max_duration = 0xFFFFFFFF
+	communicator.send(data)
+	communicator.disable()
+	sim.clock.advance(10_000)
+	pulses.pause()
+	return [pulses[i] for i in range(len(pulses))]
+
+def per_call_us(fn, min_seconds):
+	"Calls fn repeatedly for at least min_seconds, returning microseconds per call."
+	fn()  # warm up
+	count = 0
+	start = time.perf_counter()
+	while True:
+		fn()
+		count += 1
+		elapsed = time.perf_counter() - start
+		if elapsed >= min_seconds:
+			return round(elapsed / count * 1e6, 3)
+
+def measure(signal_type, sender, receiver, min_seconds):
+	(command, _, _, idle_state) = SIGNAL_TYPES[signal_type]
+	results = {}
+	packet_count = len(packets(signal_type))
+	results["packets"] = packet_count
+
+	results["parse_command_us"] = per_call_us(lambda: dmcomm.protocol.parse_command(command), min_seconds)
+
+	digirom = dmcomm.protocol.parse_command(command)
+	def pre_send_all():
+		digirom.prepare()
+		while digirom.next() is not None:
+			pass
+	results["pre_send_us"] = round(per_call_us(pre_send_all, min_seconds) / packet_count, 3)
+
+	data = packets(signal_type)[0]
+	if idle_state is not None:
+		durations = capture(sender, receiver, signal_type, data)
+	else:
+		durations = []
+	results["pulses"] = len(durations)
+
+	previous = patch_comms(stand_in_modules(durations, idle_state))
+	try:
+		communicator = make_communicator(receiver, signal_type)
+		results["send_us"] = per_call_us(lambda: communicator.send(data), min_seconds)
+		if signal_type == "BC":
+			receive = None
+		else:
+			def receive():
+				return communicator.receive(WAIT_REPLY)
+		if receive is not None:
+			received = receive()
+			if not isinstance(data, int):
+				(received, data) = (list(received), list(data))
+			assert received == data, (signal_type, received, data)
+			results["receive_us"] = per_call_us(receive, min_seconds)
+		else:
+			results["receive_us"] = None
+		communicator.disable()
+	finally:
+		unpatch_comms(previous)
+	return results
+
+def main():
+	parser = argparse.ArgumentParser(description=__doc__)
+	parser.add_argument("--output", help="file to write the JSON results to, instead of stdout")
+	parser.add_argument("--min-seconds", type=float, default=0.2, help="minimum time for each measurement")
+	parser.add_argument("signal_types", nargs="*", help="signal types to measure (default all)")
+	args = parser.parse_args()
+	sender = simulator.Device(sim, "sender")
+	receiver = simulator.Device(sim, "receiver")
+	sim.connect(sender, receiver)
+	results = {}
+	for signal_type in args.signal_types or SIGNAL_TYPES:
+		results[signal_type] = measure(signal_type, sender, receiver, args.min_seconds)
+	report = {
+		"python": platform.python_implementation() + " " + platform.python_version(),
+		"machine": platform.machine(),
+		"results": results,
+	}
+	text = json.dumps(report, indent=2)
+	if args.output is None:
+		print(text)
+	else:
+		with open(args.output, "w") as f:
+			f.write(text + "\n")
+
+if __name__ == "__main__":
+	main()
@@ -15,6 +15,10 @@ import board_config
 # HID is not used in this project
 usb_hid.disable()
 
+# Second serial port, for `capture_stream = usb_cdc.data` in code.py
+#import usb_cdc
+#usb_cdc.enable(console=True, data=True)
+
 try:
 	supervisor.status_bar.console = False
 	supervisor.status_bar.display = False
@@ -1,5 +1,7 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
+import asyncio
+import binascii
 import board
 import busio
 import digitalio
@@ -9,6 +11,8 @@ import usb_cdc
 
 from dmcomm import CommandError, ReceiveError
 import dmcomm.hardware as hw
+from dmcomm.hardware import scheduler as hw_scheduler
+from dmcomm.hardware.misc import run_steps_async
 import dmcomm.protocol
 import dmcomm.protocol.auto
 import board_config
@@ -20,6 +24,13 @@ circuitpython_board_id = "{board.board_id}"'''
 
 DEFAULT_EOL = "\r\n"
 
+# How often to check for input while waiting, in milliseconds / seconds.
+POLL_MS = 1
+SERIAL_POLL_SECONDS = 0.01
+
+# Delay before starting a new command from serial, in milliseconds.
+COMMAND_START_DELAY_MS = 0
+
 outputs_extra_power = []
 for (pin, value) in board_config.extra_power_pins:
 	output = digitalio.DigitalInOut(pin)
@@ -30,6 +41,31 @@ for (pin, value) in board_config.extra_power_pins:
 controller = hw.Controller()
 for pin_description in board_config.controller_pins:
 	controller.register(pin_description)
+# Xros Loader transmissions, like the payloads streamed with the "U" command, are captured whole
+# and then decoded, so that long ones don't depend on keeping up with each byte.
+controller.set_options("!XL", capture_maxlen=2000)
+# Signal types to receive with PIO programs, which decode whole bytes (or V/X/Y bits) while the CPU is free,
+# but don't report timing errors within them. "V" also covers X and Y.
+pio_receive_signal_types = []  # decode from PulseIn durations
+#pio_receive_signal_types = ["V", "IC", "!XL"]
+for signal_type in pio_receive_signal_types:
+	controller.set_options(signal_type, pio_receive=True)
+# Timings for the "S" command are recorded from the first time it is used.
+STATS_SIZE = 32
+
+# Raw durations of every receive can be recorded as binary records, to replay with utils/replay.py.
+capture_stream = None  # disable
+#capture_stream = usb_cdc.data  # second serial port, enabled in boot.py
+#capture_stream = open("/captures.bin", "ab")  # needs CIRCUITPY to be writeable: see boot.py
+if capture_stream is not None:
+	if hasattr(capture_stream, "write_timeout"):
+		# Records wait in the buffer while nothing is reading the serial port, instead of stopping here.
+		capture_stream.write_timeout = 0
+	controller.capture = hw.Capture(capture_stream)
+
+# How often to repeat: see `dmcomm.hardware.scheduler.Scheduler`. Can be changed with the "R" command.
+scheduler = hw_scheduler.Scheduler()
+#scheduler.set_cadence("V", 5000)  # e.g. to wait longer between V interactions
 
 led = digitalio.DigitalInOut(board_config.led_pin)
 led.direction = digitalio.Direction.OUTPUT
@@ -54,54 +90,202 @@ def serial_print(s, end=DEFAULT_EOL):
 
 serial_print("dmcomm-python starting")
 
-while True:
-	time_start = time.monotonic()
-	if serial.in_waiting != 0:
-		digirom = None
+async def communicate(start_delay_ms):
+	"""Executes the current digirom repeatedly, as often as the scheduler decides."""
+	await asyncio.sleep(start_delay_ms / 1000)
+	while digirom is not None:
+		time_start = time.monotonic()
+		error = None
+		result_end = DEFAULT_EOL
+		try:
+			await controller.execute_async(digirom, POLL_MS)
+		except (CommandError, ReceiveError) as e:
+			error = e
+			result_end = " "
+		led.value = True
+		serial_print(str(digirom.result), end=result_end)
+		if error is not None:
+			serial_print(repr(error))
+		led.value = False
+		elapsed_ms = int((time.monotonic() - time_start) * 1000)
+		outcome = hw_scheduler.outcome(digirom.result, error)
+		await asyncio.sleep(scheduler.delay_ms(digirom, outcome, elapsed_ms) / 1000)
+
+# Every packet of one signal type is streamed with the "L" command: "L-<signal type>" listens until
+# the next command, printing "@<device time in microseconds> r:<data>" as each packet arrives.
+sniff_signal_type = None
+
+async def sniff(start_delay_ms):
+	"""Streams every packet of `sniff_signal_type` with the time it started, without gaps between packets."""
+	await asyncio.sleep(start_delay_ms / 1000)
+	segment_class = dmcomm.protocol.parse_command(sniff_signal_type + "0").result_segment_class
+	def print_packet(time_us, data, error):
+		led.value = True
+		if error is None:
+			serial_print(f"@{time_us} {segment_class(False, data)}")
+		else:
+			serial_print(f"@{time_us} {repr(error)}")
+		led.value = False
+	try:
+		await controller.sniff_async(sniff_signal_type, print_packet, POLL_MS)
+	except CommandError as e:
+		serial_print(repr(e))
+
+communicate_task = None
+def restart_communicate(start_delay_ms):
+	"""Stops the current communication, which may be partway through, and starts again."""
+	global communicate_task
+	if communicate_task is not None:
+		communicate_task.cancel()
+	scheduler.reset()
+	if sniff_signal_type is not None:
+		communicate_task = asyncio.create_task(sniff(start_delay_ms))
+	else:
+		communicate_task = asyncio.create_task(communicate(start_delay_ms))
+
+def configure_cadence(args):
+	"""Handles the "R" command.
+
+	"R-<ms>" sets the default cadence, "R-<signal type>-<ms>" sets it for one signal type,
+	and "R" on its own just shows the settings.
+	"""
+	try:
+		if len(args) == 1:
+			scheduler.set_cadence(None, int(args[0]))
+		elif len(args) == 2:
+			scheduler.set_cadence(args[0], int(args[1]))
+		elif len(args) != 0:
+			raise CommandError("R takes up to 2 arguments")
+	except ValueError as e:
+		if isinstance(e, CommandError):
+			raise
+		raise CommandError("cadence: " + str(e))
+	parts = [f"default={scheduler.default_cadence_ms}"]
+	for (signal_type, cadence_ms) in scheduler.cadences():
+		parts.append(f"{signal_type}={cadence_ms}")
+	return "[cadence " + " ".join(parts) + "]"
+
+# Payloads too large for a DigiROM are streamed to a Xros Loader with the "U" command:
+# "U-<length>" starts, then "U-<index>-<hex data>-<CRC32 hex>" for each chunk, waiting for each reply.
+# Keep chunks to 64 bytes or so, so that the lines fit in the serial buffer.
+upload = None
+
+async def upload_command(args):
+	"""Handles the "U" command. Returns the reply."""
+	global upload
+	try:
+		if len(args) == 1:
+			upload = None
+			upload = controller.transfer("!XL", int(args[0]))
+			return f"[upload {upload.length} bytes, limit {upload.limit_bytes_per_second} bytes/s]"
+		if len(args) != 3:
+			raise CommandError("U takes 1 or 3 arguments")
+		(index, data, checksum) = (int(args[0]), binascii.unhexlify(args[1]), int(args[2], 16))
+	except ValueError as e:
+		if isinstance(e, CommandError):
+			raise
+		raise CommandError("upload: " + str(e))
+	if upload is None:
+		raise CommandError("no upload started")
+	checksum = await run_steps_async(upload.add_chunk_steps(index, data, checksum), POLL_MS)
+	return f"[upload ack {index} {checksum:08X} {upload.bytes_queued}/{upload.length}]"
+
+async def finish_upload():
+	"""Waits for the upload to finish sending if all chunks have arrived, and reports the speed."""
+	global upload
+	if upload is None or not upload.complete:
+		return
+	await run_steps_async(upload.finish_steps(), POLL_MS)
+	percent = upload.bytes_per_second * 100 // upload.limit_bytes_per_second
+	serial_print(f"[upload done {upload.length} bytes in {upload.elapsed_us // 1000}ms, "
+		+ f"{upload.bytes_per_second} bytes/s = {percent}% of limit]")
+	upload = None
+
+# Ops which leave the current DigiROM or sniffing running. Any other line stops it.
+KEEP_RUNNING_OPS = ["S", "R"]
+
+def stop_command():
+	"""Forgets the current DigiROM and sniffing, so that `restart_communicate` leaves them stopped."""
+	global digirom, sniff_signal_type
+	digirom = None
+	sniff_signal_type = None
+
+async def read_serial():
+	"""Handles commands from serial, including while the communication is waiting for input."""
+	global digirom, upload, sniff_signal_type
+	while True:
+		await asyncio.sleep(SERIAL_POLL_SECONDS)
+		if serial.in_waiting == 0:
+			continue
 		serial_bytes = serial.readline()
 		try:
 			serial_str = serial_bytes.decode("utf-8")
 		except UnicodeError:
 			serial_print(f"UnicodeError: {repr(serial_bytes)}")
+			stop_command()
+			restart_communicate(0)
 			continue
 		# readline only accepts "\n" but we can receive "\r" after timeout
 		if serial_str[-1] not in ["\r", "\n"]:
 			serial_print(f"too slow: {repr(serial_bytes)}")
+			stop_command()
+			restart_communicate(0)
 			continue
 		serial_str = serial_str.strip().strip("\0")
 		output = None
+		keep_running = False
 		try:
 			command = dmcomm.protocol.parse_command(serial_str)
+			keep_running = command.signal_type is None and command.op in KEEP_RUNNING_OPS
+			if not keep_running:
+				stop_command()
 			if command.signal_type is None:
 				# It's an OtherCommand
 				if command.op == "I":
 					serial_print(VERSION)
 				elif command.op == "P":
 					output = "[pause]"
+				elif command.op == "S":
+					# Stats started here are recorded from the next execute.
+					if controller.stats is None:
+						controller.stats = hw.Stats(STATS_SIZE)
+						output = "[stats started]"
+					else:
+						for line in controller.stats.report():
+							serial_print(line)
+						output = "[stats]"
+				elif command.op == "R":
+					# The running DigiROM picks up the new cadence when it next waits.
+					output = configure_cadence(command.args)
+				elif command.op == "U":
+					output = await upload_command(command.args)
+				elif command.op == "L":
+					if len(command.args) != 1:
+						raise CommandError("L takes 1 argument")
+					# Checks the signal type
+					dmcomm.protocol.parse_command(command.args[0] + "0")
+					sniff_signal_type = command.args[0]
+					output = f"[sniff {sniff_signal_type}]"
 				else:
 					raise NotImplementedError("op=" + command.op)
 			else:
+				upload = None
 				digirom = command
 				output = f"{digirom.signal_type}{digirom.turn}-[{len(digirom)} packets]"
 		except (CommandError, NotImplementedError) as e:
+			if not keep_running:
+				stop_command()
 			output = repr(e)
 		finally:
 			if output is not None:
 				serial_print(f"got {len(serial_str)} bytes: {serial_str} -> {output}")
-		time.sleep(1)
-	if digirom is not None:
-		error = ""
-		result_end = DEFAULT_EOL
-		try:
-			controller.execute(digirom)
-		except (CommandError, ReceiveError) as e:
-			error = repr(e)
-			result_end = " "
-		led.value = True
-		serial_print(str(digirom.result), end=result_end)
-		if error != "":
-			serial_print(error)
-		led.value = False
-	seconds_passed = time.monotonic() - time_start
-	if seconds_passed < 5:
-		time.sleep(5 - seconds_passed)
+		if keep_running:
+			continue
+		await finish_upload()
+		restart_communicate(COMMAND_START_DELAY_MS)
+
+async def main():
+	restart_communicate(0)
+	await read_serial()
+
+asyncio.run(main())
@@ -15,9 +15,11 @@ WAIT_FOREVER = -2
 WAIT_REPLY = -1
 
 from .control import Controller
+from .stats import Stats
+from .capture import Capture
 from .pins import ProngOutput, ProngInput, InfraredOutput, InfraredInputModulated, InfraredInputRaw, TalisInputOutput
 
 __all__ = [
-	"WAIT_FOREVER", "WAIT_REPLY", "Controller",
+	"WAIT_FOREVER", "WAIT_REPLY", "Controller", "Stats", "Capture",
 	"ProngOutput", "ProngInput", "InfraredOutput", "InfraredInputModulated", "InfraredInputRaw", "TalisInputOutput"
 	]
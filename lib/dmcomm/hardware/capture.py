@@ -0,0 +1,188 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+import array
+import struct
+import supervisor
+
+# Each record is a header, then `count` durations in microseconds as little-endian uint16:
+# magic b"DC", format version, signal type padded to 3 bytes with zeros, flags, time_ms (uint32), count (uint16).
+_HEADER = "<2sB3sBIH"
+HEADER_SIZE = struct.calcsize(_HEADER)
+MAGIC = b"DC"
+VERSION = 1
+
+#: Flag for a receive which raised `ReceiveError`.
+FLAG_ERROR = 1
+#: Flag for a receive with more durations than the `Capture` had room for. The rest were dropped.
+FLAG_TRUNCATED = 2
+
+class Capture:
+	"""Records the raw durations of each receive, for `Controller.capture`.
+
+	Every duration which a communicator takes out of its `PulseIn` is kept, along with any left over,
+	and made into one binary record when the receive finishes. Receives with no input are skipped.
+	Durations longer than 0xFFFF are written as 0xFFFF. Communicators with `pio_receive` set decode in the
+	PIO program instead, so they have nothing to record.
+
+	The records wait in a buffer until `write_pending`, which `Controller` calls after each `execute`,
+	so that writing doesn't change the timing of the communication being recorded.
+
+	:param stream: Where to write the records, such as a file opened with "ab" or `usb_cdc.data`.
+		If `write` returns less than it was given, the rest is kept for next time.
+	:param maxlen: Most durations to keep for each receive.
+	:param buffer_size: Most bytes of records waiting to be written. More records than this are dropped.
+	"""
+	def __init__(self, stream, maxlen=1000, buffer_size=8192):
+		self.stream = stream
+		self.maxlen = maxlen
+		self.buffer_size = buffer_size
+		self.records_written = 0
+		self.records_dropped = 0
+		self._durations = array.array("H", [0] * maxlen)
+		self._count = 0
+		self._truncated = False
+		self._time_ms = 0
+		self._pulses = None
+		self._pending = []
+		self._pending_bytes = 0
+	def start(self, pulses):
+		"""Called by `CapturedPulses` when a receive resumes the input."""
+		self._count = 0
+		self._truncated = False
+		self._time_ms = supervisor.ticks_ms()
+		self._pulses = pulses
+	def add(self, duration):
+		"""Keeps one duration."""
+		count = self._count
+		if count == self.maxlen:
+			self._truncated = True
+			return
+		self._durations[count] = min(duration, 0xFFFF)
+		self._count = count + 1
+	def end(self, signal_type, error=False):
+		"""Finishes the record for the receive which has just finished, if there was any input.
+
+		:param signal_type: The signal type which was received.
+		:param error: True if the receive raised `ReceiveError`.
+		"""
+		pulses = self._pulses
+		if pulses is None:
+			return
+		pulses.keep_remaining()
+		self._pulses = None
+		count = self._count
+		if count == 0 and not error:
+			return
+		if self._pending_bytes + HEADER_SIZE + 2 * count > self.buffer_size:
+			self.records_dropped += 1
+			return
+		flags = 0
+		if error:
+			flags |= FLAG_ERROR
+		if self._truncated:
+			flags |= FLAG_TRUNCATED
+		record = (struct.pack(_HEADER, MAGIC, VERSION, signal_type.encode(), flags, self._time_ms, count)
+			+ bytes(self._durations[:count]))
+		self._pending.append(record)
+		self._pending_bytes += len(record)
+	def write_pending(self):
+		"""Writes the records which are waiting, as far as the stream will take them."""
+		stream = self.stream
+		pending = self._pending
+		while len(pending) != 0:
+			record = pending[0]
+			written = stream.write(record)
+			if written is not None and written < len(record):
+				# Such as a serial port with write_timeout 0 which nothing is reading.
+				pending[0] = record[written:]
+				self._pending_bytes -= written
+				return
+			pending.pop(0)
+			self._pending_bytes -= len(record)
+			self.records_written += 1
+		if hasattr(stream, "flush"):
+			stream.flush()
+
+class CapturedPulses:
+	"""Wraps a `PulseIn` or similar, copying every duration that is taken out of it into a `Capture`.
+
+	:param pulses: The input to wrap, which can also be a `HalfDuplexPulses`.
+	:param capture: The `Capture` to copy into.
+	"""
+	def __init__(self, pulses, capture):
+		self._pulses = pulses
+		self._capture = capture
+	@property
+	def maxlen(self):
+		return self._pulses.maxlen
+	@property
+	def paused(self):
+		return self._pulses.paused
+	def pause(self):
+		self._pulses.pause()
+	def resume(self, trigger_duration=0):
+		self._pulses.resume(trigger_duration)
+		self._capture.start(self)
+	def clear(self):
+		self.keep_remaining()
+		self._pulses.clear()
+	def keep_remaining(self):
+		"""Copies the durations still in the input, without removing them."""
+		if self._capture._pulses is not self:
+			return
+		pulses = self._pulses
+		add = self._capture.add
+		for i in range(len(pulses)):
+			add(pulses[i])
+	def send(self, durations):
+		self._pulses.send(durations)
+	def popleft(self):
+		value = self._pulses.popleft()
+		if self._capture._pulses is self:
+			self._capture.add(value)
+		return value
+	def __len__(self):
+		return len(self._pulses)
+	def __getitem__(self, index):
+		return self._pulses[index]
+	def deinit(self):
+		self._pulses.deinit()
+
+class CaptureRecord:
+	"""One record read by `read_records`."""
+	__slots__ = ("signal_type", "flags", "time_ms", "durations")
+	def __init__(self, signal_type, flags, time_ms, durations):
+		self.signal_type = signal_type  #: Signal type as a string.
+		self.flags = flags  #: `FLAG_ERROR` and `FLAG_TRUNCATED` bits.
+		self.time_ms = time_ms  #: `supervisor.ticks_ms` when the receive started.
+		self.durations = durations  #: `array.array("H")` of durations in microseconds.
+
+def scan_records(data):
+	"""Yields (signal_type, flags, time_ms, start, count) for each record in `data`, skipping anything else in between.
+
+	The durations of each record are `count` little-endian uint16 from index `start`.
+
+	:param data: The bytes written by one or more `Capture` objects.
+	"""
+	i = 0
+	length = len(data)
+	while True:
+		i = data.find(MAGIC, i)
+		if i == -1 or i + HEADER_SIZE > length:
+			return
+		(magic, version, signal_type, flags, time_ms, count) = struct.unpack_from(_HEADER, data, i)
+		start = i + HEADER_SIZE
+		end = start + 2 * count
+		if version != VERSION or end > length:
+			i += 1
+			continue
+		yield (signal_type.rstrip(b"\0").decode(), flags, time_ms, start, count)
+		i = end
+
+def read_records(data):
+	"""Yields a `CaptureRecord` for each record in `data`. See `scan_records`."""
+	for (signal_type, flags, time_ms, start, count) in scan_records(data):
+		durations = array.array("H")
+		for j in range(start, start + 2 * count, 2):
+			durations.append(data[j] | (data[j + 1] << 8))
+		yield CaptureRecord(signal_type, flags, time_ms, durations)
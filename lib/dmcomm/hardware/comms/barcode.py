@@ -1,30 +1,29 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
 import array
-import pulseio
 
 from dmcomm import CommandError
+from dmcomm.hardware.resources import ResourcePool
 from dmcomm.protocol.barcode import ean13_lengths
 
 class BarcodeCommunicator:
-	def __init__(self, ir_output):
+	stats = None  #: Set by `Controller` to record timings.
+	def __init__(self, ir_output, resources=None):
 		self._pin_output = ir_output.pin_output
+		self._resources = resources if resources is not None else ResourcePool()
 		self._output_pulses = None
 		self._enabled = False
 	def enable(self, signal_type):
 		if signal_type != "BC":
 			raise ValueError("signal_type must be BC")
-		if self._enabled:
-			return
 		try:
-			self._output_pulses = pulseio.PulseOut(self._pin_output, frequency=100_000, duty_cycle=0xF000)
+			self._output_pulses = self._resources[self._pin_output].pulse_out(100_000, 0xF000)
 		except:
 			self.disable()
 			raise
 		self._enabled = True
 	def disable(self):
-		if self._output_pulses is not None:
-			self._output_pulses.deinit()
+		self._resources[self._pin_output].release()
 		self._output_pulses = None
 		self._enabled = False
 	def reset(self):
@@ -41,3 +40,6 @@ class BarcodeCommunicator:
 		self._output_pulses.send(array_to_send)
 	def receive(self, timeout_ms):
 		return []
+	def receive_steps(self, timeout_ms):
+		return []
+		yield
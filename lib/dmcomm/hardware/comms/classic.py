@@ -4,7 +4,8 @@ import array
 
 from dmcomm import ReceiveError
 from dmcomm.hardware import WAIT_REPLY
-from dmcomm.hardware.misc import wait_for_length_2
+from dmcomm.hardware.misc import wait_for_length_2_steps
+from dmcomm.hardware.stats import PACKET
 from dmcomm.hardware.comms.classic_shared import BaseProngCommunicator
 
 class ClassicParams:
@@ -86,15 +87,62 @@ class ClassicParams:
 			self.packet_length_timeout_ms = 300
 		else:
 			raise ValueError("signal_type must be V/X/Y")
-		self.slow_input = False
+		self.pio_input = False
 		self.signal_type = signal_type
 
 class ClassicCommunicator(BaseProngCommunicator):
+	"""Sends and receives V/X/Y packets.
+
+	By default, packets are decoded from `PulseIn` durations. If `pio_receive` is True, a PIO program
+	classifies the bits as they arrive instead, so the result is ready as soon as the packet ends.
+	Then packets with a short pre-active period are ignored, and the other periods are not checked.
+
+	:param pio_receive: True to receive the bits from the PIO program.
+	"""
 	params_class = ClassicParams
-	def send(self, bits):
+	_array_to_send = None
+	_template_signal_type = None
+	_input_classifier = None
+	def __init__(self, prong_output, prong_input, resources=None, pio_receive=False):
+		super().__init__(prong_output, prong_input, resources)
+		self.pio_receive = pio_receive
+	def enable(self, signal_type):
+		super().enable(signal_type)
+		if self._template_signal_type != signal_type:
+			self._build_template()
+			self._template_signal_type = signal_type
+	def disable(self):
+		super().disable()
+		self._input_classifier = None
+		self._array_to_send = None
+		self._template_signal_type = None
+	def _enable_input(self):
+		if self.pio_receive:
+			self._input_pulses = None
+			self._input_classifier = self._resources[self._pin_input].pio_classic_in(self._params.idle_state)
+		else:
+			self._input_classifier = None
+			super()._enable_input()
+	def sniffer(self):
+		"""Returns a `Sniffer` which records every packet from the prong input. Needs `pio_receive` to be False."""
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		if self._params.idle_state == True:
+		if self._input_pulses is None:
+			raise RuntimeError("sniffing needs PulseIn")
+		from dmcomm.hardware.sniffer import Sniffer
+		params = self._params
+		gap_us = max(params.start_idle_max, params.bit_idle_max)
+		return Sniffer(self._input_pulses, gap_us, params.pre_active_min, self.decode)
+	def decode(self, pulses):
+		"""Decodes one packet from the durations in `pulses`. See `decode`."""
+		return decode(pulses, self._params)
+	def _build_template(self):
+		"""Creates the waveform for the current signal type, so `send` only needs to fill in the bits.
+
+		Bit n occupies indices 8+4n to 11+4n, with the idle duration at 9+4n and active at 11+4n.
+		"""
+		params = self._params
+		if params.idle_state == True:
 			DRIVE_ACTIVE = 0
 			DRIVE_IDLE = 1
 		else:
@@ -102,68 +150,110 @@ class ClassicCommunicator(BaseProngCommunicator):
 			DRIVE_IDLE = 0
 		RELEASE = 2
 		array_to_send = array.array("L", [
-			DRIVE_IDLE, self._params.pre_idle_send,
-			DRIVE_ACTIVE, self._params.pre_active_send,
-			DRIVE_IDLE, self._params.start_idle_send,
-			DRIVE_ACTIVE, self._params.start_active_send,
+			DRIVE_IDLE, params.pre_idle_send,
+			DRIVE_ACTIVE, params.pre_active_send,
+			DRIVE_IDLE, params.start_idle_send,
+			DRIVE_ACTIVE, params.start_active_send,
 		])
 		for i in range(16):
 			array_to_send.append(DRIVE_IDLE)
-			if bits & 1:
-				array_to_send.append(self._params.bit1_idle_send)
-				array_to_send.append(DRIVE_ACTIVE)
-				array_to_send.append(self._params.bit1_active_send)
-			else:
-				array_to_send.append(self._params.bit0_idle_send)
-				array_to_send.append(DRIVE_ACTIVE)
-				array_to_send.append(self._params.bit0_active_send)
-			bits >>= 1
+			array_to_send.append(params.bit0_idle_send)
+			array_to_send.append(DRIVE_ACTIVE)
+			array_to_send.append(params.bit0_active_send)
 		array_to_send.append(DRIVE_IDLE)
-		array_to_send.append(self._params.cooldown_send)
+		array_to_send.append(params.cooldown_send)
 		array_to_send.append(RELEASE)
+		self._array_to_send = array_to_send
+		# Indexed by bit value
+		self._bit_idle_send = (params.bit0_idle_send, params.bit1_idle_send)
+		self._bit_active_send = (params.bit0_active_send, params.bit1_active_send)
+	def send(self, bits):
+		if not self._enabled:
+			raise RuntimeError("not enabled")
+		array_to_send = self._array_to_send
+		bit_idle_send = self._bit_idle_send
+		bit_active_send = self._bit_active_send
+		for i in range(9, 73, 4):
+			bit = bits & 1
+			array_to_send[i] = bit_idle_send[bit]
+			array_to_send[i + 2] = bit_active_send[bit]
+			bits >>= 1
+		# write blocks until everything is in the FIFO, so the array can be reused
 		self._output_state_machine.write(array_to_send)
-	def receive(self, timeout_ms):
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
+		if self.pio_receive:
+			return (yield from self._receive_pio_steps(timeout_ms))
 		pulses = self._input_pulses
 		pulses.clear()
 		pulses.resume()
 		if timeout_ms == WAIT_REPLY:
 			timeout_ms = self._params.reply_timeout_ms
-		wait_for_length_2(pulses, 35, timeout_ms, self._params.packet_length_timeout_ms)
+		stats = self.stats
+		yield from wait_for_length_2_steps(pulses, 35, timeout_ms, self._params.packet_length_timeout_ms, stats)
 		pulses.pause()
 		if len(pulses) == pulses.maxlen:
 			raise ReceiveError("buffer full")
 		if len(pulses) == 0:
 			return None
-		ic_bug = False
-		if len(pulses) < 35:
-			if self._params.signal_type == "X" and len(pulses) == 34:
-				ic_bug = True
-			else:
-				raise ReceiveError("incomplete: %d pulses" % len(pulses))
-		t = pulses.popleft()
-		if t < self._params.pre_active_min:
-			raise ReceiveError("pre_active = %d" % t)
-		t = pulses.popleft()
-		if t < self._params.start_idle_min or t > self._params.start_idle_max:
-			raise ReceiveError("start_idle = %d" % t)
-		t = pulses.popleft()
-		if t < self._params.start_active_min or t > self._params.start_active_max:
-			raise ReceiveError("start_active = %d" % t)
-		result = 0
-		for i in range(16):
-			t = pulses.popleft()
-			if t < self._params.bit_idle_min or t > self._params.bit_idle_max:
-				raise ReceiveError("bit_idle %d = %d" % (i + 1, t))
-			result >>= 1
-			if t > self._params.bit_idle_threshold:
-				result |= 0x8000
-			if ic_bug and i == 15:
-				break
-			t = pulses.popleft()
-			if t < self._params.bit_active_min or t > self._params.bit_active_max:
-				raise ReceiveError("bit_active %d = %d" % (i + 1, t))
-		if self._params.invert_bit_read:
+		if stats is not None:
+			stats.lap(PACKET)
+		return decode(pulses, self._params)
+	def _receive_pio_steps(self, timeout_ms):
+		params = self._params
+		classifier = self._input_classifier
+		classifier.clear()
+		classifier.resume(params.pre_active_min, params.bit_idle_threshold)
+		if timeout_ms == WAIT_REPLY:
+			timeout_ms = params.reply_timeout_ms
+		stats = self.stats
+		yield from wait_for_length_2_steps(classifier, 3, timeout_ms, params.packet_length_timeout_ms, stats)
+		classifier.pause()
+		if len(classifier) == 0:
+			return None
+		if stats is not None:
+			stats.lap(PACKET)
+		if len(classifier) < 3:
+			# Like ic_bug in decode, where X stops partway through the last bit.
+			if not (params.signal_type == "X" and len(classifier) == 2):
+				raise ReceiveError("incomplete: %d of 3 items" % len(classifier))
+		classifier.popleft()
+		result = classifier.popleft() >> 16
+		if params.invert_bit_read:
 			result ^= 0xFFFF
 		return result
+
+def decode(pulses, params):
+	"""Decodes the bits from the durations in `pulses`, starting with the pre-active, removing them as it goes."""
+	ic_bug = False
+	if len(pulses) < 35:
+		if params.signal_type == "X" and len(pulses) == 34:
+			ic_bug = True
+		else:
+			raise ReceiveError("incomplete: %d pulses" % len(pulses))
+	t = pulses.popleft()
+	if t < params.pre_active_min:
+		raise ReceiveError("pre_active = %d" % t)
+	t = pulses.popleft()
+	if t < params.start_idle_min or t > params.start_idle_max:
+		raise ReceiveError("start_idle = %d" % t)
+	t = pulses.popleft()
+	if t < params.start_active_min or t > params.start_active_max:
+		raise ReceiveError("start_active = %d" % t)
+	result = 0
+	for i in range(16):
+		t = pulses.popleft()
+		if t < params.bit_idle_min or t > params.bit_idle_max:
+			raise ReceiveError("bit_idle %d = %d" % (i + 1, t))
+		result >>= 1
+		if t > params.bit_idle_threshold:
+			result |= 0x8000
+		if ic_bug and i == 15:
+			break
+		t = pulses.popleft()
+		if t < params.bit_active_min or t > params.bit_active_max:
+			raise ReceiveError("bit_active %d = %d" % (i + 1, t))
+	if params.invert_bit_read:
+		result ^= 0xFFFF
+	return result
@@ -1,52 +1,55 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
-import digitalio
-import pulseio
-import rp2pio
-
 from dmcomm.hardware import pio_programs
+from dmcomm.hardware.misc import run_steps
+from dmcomm.hardware.resources import ResourcePool
 
 class BaseProngCommunicator:
-	def __init__(self, prong_output, prong_input):
+	stats = None  #: Set by `Controller` to record timings.
+	def __init__(self, prong_output, prong_input, resources=None):
 		self._pin_drive_signal = prong_output.pin_drive_signal
 		self._pin_weak_pull = prong_output.pin_weak_pull
 		self._pin_input = prong_input.pin_input
+		self._resources = resources if resources is not None else ResourcePool()
 		self._output_state_machine = None
 		self._output_weak_pull = None
 		self._input_pulses = None
 		self._params = None
 		self._enabled = False
 	def enable(self, signal_type):
-		if self._enabled:
-			if signal_type == self._params.signal_type:
-				return
-			self.disable()
-		self._params = self.params_class(signal_type)
+		"""Enables for the signal type, taking over the pins from any other communicator using the same resources.
+
+		Hardware which is already set up the same way is reused.
+		"""
+		if self._params is None or signal_type != self._params.signal_type:
+			self._params = self.params_class(signal_type)
+		resources = self._resources
 		try:
-			self._output_state_machine = rp2pio.StateMachine(
+			self._output_state_machine = resources[self._pin_drive_signal].state_machine(
 				pio_programs.prong_TX,
 				frequency=1_000_000,
 				first_set_pin=self._pin_drive_signal,
 				set_pin_count=2,
 				initial_set_pin_direction=0,
 			)
-			self._output_weak_pull = digitalio.DigitalInOut(self._pin_weak_pull)
-			self._output_weak_pull.switch_to_output(value=self._params.idle_state)
-			if self._params.slow_input:
-				self._input_pulses = digitalio.DigitalInOut(self._pin_input)
-			else:
-				self._input_pulses = pulseio.PulseIn(self._pin_input, maxlen=260, idle_state=self._params.idle_state)
-				self._input_pulses.pause()
+			self._output_weak_pull = resources[self._pin_weak_pull].digital_out(self._params.idle_state)
+			self._enable_input()
 		except:
 			self.disable()
 			raise
 		self._enabled = True
+	def _enable_input(self):
+		if self._params.pio_input:
+			self._input_pulses = self._resources[self._pin_input].pio_pulse_in(260)
+		else:
+			self._input_pulses = self._resources[self._pin_input].pulse_in(260, self._params.idle_state)
 	def disable(self):
-		for item in [self._output_state_machine, self._output_weak_pull, self._input_pulses]:
-			if item is not None:
-				item.deinit()
+		for pin in [self._pin_drive_signal, self._pin_weak_pull, self._pin_input]:
+			self._resources[pin].release()
 		self._output_state_machine = None
 		self._output_weak_pull = None
 		self._input_pulses = None
 		self._params = None
 		self._enabled = False
+	def receive(self, timeout_ms):
+		return run_steps(self.receive_steps(timeout_ms))
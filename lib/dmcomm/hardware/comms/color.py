@@ -4,7 +4,8 @@ import array
 
 from dmcomm import ReceiveError
 from dmcomm.hardware import WAIT_REPLY
-from dmcomm.hardware.misc import wait_for_length_2
+from dmcomm.hardware.misc import wait_for_length_2_steps
+from dmcomm.hardware.stats import PACKET
 from dmcomm.hardware.comms.classic_shared import BaseProngCommunicator
 
 class ColorParams:
@@ -27,38 +28,93 @@ class ColorParams:
 			self.reply_timeout_ms = 200
 			self.packet_length_timeout_ms = 400
 			self.pulses_expected = 257
-			self.slow_input = False
+			self.pio_input = False
 		else:
 			raise ValueError("signal_type must be C")
 		self.signal_type = signal_type
 
+DRIVE_ACTIVE = 0
+DRIVE_IDLE = 1
+RELEASE = 2
+
+#: Number of words `ColorCommunicator` makes room for in its waveform at first.
+TEMPLATE_WORDS = 8
+
+def nibble_table(params):
+	"""Returns the waveform for each 4-bit value, LSB first, in one array of 16 * 16.
+
+	Each bit is 4 entries: drive idle, idle duration, drive active, active duration.
+	"""
+	table = array.array("L", [0] * (16 * 16))
+	i = 0
+	for value in range(16):
+		for j in range(4):
+			table[i] = DRIVE_IDLE
+			table[i + 1] = params.bit_idle_send
+			table[i + 2] = DRIVE_ACTIVE
+			table[i + 3] = params.bit1_active_send if (value >> j) & 1 else params.bit0_active_send
+			i += 4
+	return table
+
 class ColorCommunicator(BaseProngCommunicator):
 	params_class = ColorParams
+	_nibble_table = None
+	_array_to_send = None
+	_template_params = None
+	def enable(self, signal_type):
+		super().enable(signal_type)
+		if self._template_params is not self._params:
+			self._nibble_table = memoryview(nibble_table(self._params))
+			self._build_template(TEMPLATE_WORDS)
+			self._template_params = self._params
+	def disable(self):
+		super().disable()
+		self._nibble_table = None
+		self._array_to_send = None
+		self._template_params = None
+	def sniffer(self):
+		"""Returns a `Sniffer` which records every packet from the prong input."""
+		if not self._enabled:
+			raise RuntimeError("not enabled")
+		from dmcomm.hardware.sniffer import Sniffer
+		params = self._params
+		return Sniffer(self._input_pulses, params.bit_idle_max, params.pre_active_min, self.decode)
+	def decode(self, pulses):
+		"""Decodes one packet from the durations in `pulses`. See `decode`."""
+		return decode(pulses, self._params)
+	def _build_template(self, max_words):
+		"""Creates the waveform with room for `max_words`, so `send` only needs to copy in the bits.
+
+		Word n occupies indices 4+64n to 67+64n, and the cooldown and release follow the last word sent.
+		"""
+		params = self._params
+		array_to_send = array.array("L", [0] * (4 + max_words * 64 + 3))
+		array_to_send[0] = DRIVE_IDLE
+		array_to_send[1] = params.pre_idle_send
+		array_to_send[2] = DRIVE_ACTIVE
+		array_to_send[3] = params.pre_active_send
+		self._array_to_send = array_to_send
+		self._view = memoryview(array_to_send)
+		self._max_words = max_words
 	def send(self, data):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		DRIVE_ACTIVE = 0
-		DRIVE_IDLE = 1
-		RELEASE = 2
-		array_to_send = array.array("L", [
-			DRIVE_IDLE, self._params.pre_idle_send,
-			DRIVE_ACTIVE, self._params.pre_active_send,
-		])
+		if len(data) > self._max_words:
+			self._build_template(len(data))
+		view = self._view
+		table = self._nibble_table
+		cursor = 4
 		for bits in data:
-			for i in range(16):
-				array_to_send.append(DRIVE_IDLE)
-				array_to_send.append(self._params.bit_idle_send)
-				array_to_send.append(DRIVE_ACTIVE)
-				if bits & 1:
-					array_to_send.append(self._params.bit1_active_send)
-				else:
-					array_to_send.append(self._params.bit0_active_send)
-				bits >>= 1
-		array_to_send.append(DRIVE_IDLE)
-		array_to_send.append(self._params.cooldown_send)
-		array_to_send.append(RELEASE)
-		self._output_state_machine.write(array_to_send)
-	def receive(self, timeout_ms):
+			for shift in (0, 4, 8, 12):
+				offset = ((bits >> shift) & 0xF) * 16
+				view[cursor:cursor + 16] = table[offset:offset + 16]
+				cursor += 16
+		view[cursor] = DRIVE_IDLE
+		view[cursor + 1] = self._params.cooldown_send
+		view[cursor + 2] = RELEASE
+		# write blocks until everything is in the FIFO, so the array can be reused
+		self._output_state_machine.write(view[:cursor + 3])
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
 		pulses = self._input_pulses
@@ -66,33 +122,44 @@ class ColorCommunicator(BaseProngCommunicator):
 		pulses.resume()
 		if timeout_ms == WAIT_REPLY:
 			timeout_ms = self._params.reply_timeout_ms
-		wait_for_length_2(pulses, self._params.pulses_expected, timeout_ms, self._params.packet_length_timeout_ms)
+		stats = self.stats
+		yield from wait_for_length_2_steps(pulses, self._params.pulses_expected, timeout_ms, self._params.packet_length_timeout_ms, stats)
 		pulses.pause()
 		if len(pulses) == pulses.maxlen:
 			raise ReceiveError("buffer full")
 		if len(pulses) == 0:
 			return []
-		ic_bug = False
-		if len(pulses) < self._params.pulses_expected:
-			raise ReceiveError("incomplete: %d pulses" % len(pulses))
-		t = pulses.popleft()
-		if t < self._params.pre_active_min:
-			raise ReceiveError("pre_active = %d" % t)
-		pulses = self._input_pulses
-		results = []
-		bit_count = 0
-		while len(pulses) > 0:
-			result = 0
-			for i in range(16):
-				t = pulses.popleft()
-				if t < self._params.bit_idle_min or t > self._params.bit_idle_max:
-					raise ReceiveError("bit_idle %d = %d" % (bit_count + 1, t))
-				t = pulses.popleft()
-				if t < self._params.bit_active_min or t > self._params.bit_active_max:
-					raise ReceiveError("bit_active %d = %d" % (bit_count + 1, t))
-				result >>= 1
-				if t > self._params.bit_active_threshold:
-					result |= 0x8000
-				bit_count += 1
-			results.append(result)
-		return results
+		if stats is not None:
+			stats.lap(PACKET)
+		return decode(pulses, self._params)
+
+def decode(pulses, params):
+	"""Decodes the words from the durations in `pulses`, starting with the pre-active, removing them as it goes."""
+	count = len(pulses)
+	if count < params.pulses_expected or (count - 1) % 32 != 0:
+		raise ReceiveError("incomplete: %d pulses" % count)
+	popleft = pulses.popleft
+	t = popleft()
+	if t < params.pre_active_min:
+		raise ReceiveError("pre_active = %d" % t)
+	bit_idle_min = params.bit_idle_min
+	bit_idle_max = params.bit_idle_max
+	bit_active_min = params.bit_active_min
+	bit_active_max = params.bit_active_max
+	bit_active_threshold = params.bit_active_threshold
+	results = []
+	bit_count = 0
+	for _ in range((count - 1) // 32):
+		result = 0
+		for i in range(16):
+			t = popleft()
+			if t < bit_idle_min or t > bit_idle_max:
+				raise ReceiveError("bit_idle %d = %d" % (bit_count + i + 1, t))
+			t = popleft()
+			if t < bit_active_min or t > bit_active_max:
+				raise ReceiveError("bit_active %d = %d" % (bit_count + i + 1, t))
+			if t > bit_active_threshold:
+				result |= 1 << i
+		bit_count += 16
+		results.append(result)
+	return results
@@ -1,19 +1,28 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
-import pulseio
+import supervisor
 import time
-import rp2pio
 
 from dmcomm import ReceiveError
 from dmcomm.hardware import WAIT_REPLY, pio_programs
-from dmcomm.hardware.misc import wait_for_length
+from dmcomm.hardware.misc import run_steps, ticks_diff, wait_for_length_steps
+from dmcomm.hardware.resources import ResourcePool
+from dmcomm.hardware.stats import PACKET
 from dmcomm.protocol import ic_encoding
 
+#: Number of durations `iC_Communicator.sniffer` makes room for in each packet, more than 20 bytes of all 0 bits.
+SNIFF_MAXLEN = 400
+
 class iC_Params:
 	def __init__(self, signal_type):
 		if signal_type == "IC":
 			self.reply_timeout_ms = 100
 			self.packet_length_timeout_ms = 30
+			# Longer than the silence in any byte (about 11 ticks for FF), so the packet has ended.
+			self.packet_idle_ticks = 12
+			# Longer than the 10.5 ticks between bytes pushed by iC_RX.
+			self.pio_idle_ticks = 16
+			self.rx_frequency = 400_000  # 40 cycles per tick for iC_RX
 			self.pulse_max = 25
 			self.tick_length = 100
 			self.tick_margin = 30
@@ -21,118 +30,304 @@ class iC_Params:
 			raise ValueError("signal_type must be IC")
 		self.signal_type = signal_type
 
+class iC_ByteDecoder:
+	"""Converts pulse and gap durations into bytes as they arrive.
+
+	:param params: The `iC_Params` to use.
+	"""
+	def __init__(self, params):
+		self._pulse_max = params.pulse_max
+		self._tick_length = params.tick_length
+		self._tick_margin = params.tick_margin
+		self._min_gap_find = 2.5 * params.tick_length
+		self.reset()
+	def reset(self):
+		"""Prepares for a new transmission."""
+		self._found_gap = False
+		self._t_pulse = None
+		self._pulse_count = 0
+		self._current_byte = 0
+		self._ticks_into_byte = 0
+	def feed(self, t):
+		"""Processes the next duration from `PulseIn`.
+
+		:returns: The byte completed by this duration, or None.
+		:raises ReceiveError: If the timing is wrong.
+		"""
+		if not self._found_gap:
+			#discard first byte or part of byte since we're joining partway through
+			if t > self._min_gap_find:
+				self._found_gap = True
+			return None
+		if self._t_pulse is None:
+			self._pulse_count += 1
+			if t > self._pulse_max:
+				raise ReceiveError("pulse %d = %d" % (self._pulse_count, t))
+			self._t_pulse = t
+			return None
+		dur = self._t_pulse + t
+		self._t_pulse = None
+		return self._add(dur)
+	def end(self):
+		"""Processes the end of the transmission, after the last duration has been fed in.
+
+		:returns: The byte completed by the final pulse, or None.
+		:raises ReceiveError: If the transmission ended in the wrong place.
+		"""
+		if not self._found_gap:
+			raise ReceiveError("fragment")
+		if self._t_pulse is None:
+			raise ReceiveError("ended with gap")
+		dur = self._t_pulse + 0xFFFF
+		self._t_pulse = None
+		return self._add(dur)
+	def _add(self, dur):
+		tick_length = self._tick_length
+		ticks = round(dur / tick_length)
+		current_byte = self._current_byte
+		if self._ticks_into_byte + ticks >= 9:
+			#finish byte
+			for i in range(8 - self._ticks_into_byte):
+				current_byte >>= 1
+				current_byte |= 0x80
+			self._current_byte = 0
+			self._ticks_into_byte = 0
+			return current_byte
+		if abs(dur - ticks * tick_length) > self._tick_margin:
+			raise ReceiveError("pulse+gap %d = %d" % (self._pulse_count, dur))
+		for i in range(ticks - 1):
+			current_byte >>= 1
+			current_byte |= 0x80
+		current_byte >>= 1
+		self._current_byte = current_byte
+		self._ticks_into_byte += ticks
+		return None
+
+def decode(pulses, params, byte_decoder=None):
+	"""Decodes an iC packet from the durations in `pulses`, removing them as it goes.
+
+	Pass the communicator's `iC_ByteDecoder` to avoid creating one.
+
+	:raises ReceiveError: If the timing or the frame is wrong.
+	"""
+	if byte_decoder is None:
+		byte_decoder = iC_ByteDecoder(params)
+	byte_decoder.reset()
+	bytes_received = []
+	while len(pulses) != 0:
+		byte_ = byte_decoder.feed(pulses.popleft())
+		if byte_ is not None:
+			bytes_received.append(byte_)
+	byte_ = byte_decoder.end()
+	if byte_ is not None:
+		bytes_received.append(byte_)
+	try:
+		(result, count) = ic_encoding.decode(bytes_received)
+	except ValueError as e:
+		raise ReceiveError(str(e))
+	return result
+
 class iC_Communicator:
-	def __init__(self, ir_output, ir_input_raw):
+	"""Sends and receives iC packets.
+
+	By default, bytes are decoded from `PulseIn` durations. If `pio_receive` is True, the `iC_RX` PIO program
+	decodes the bytes instead, so timing errors within bytes are not reported.
+
+	:param pio_receive: True to receive whole bytes from the PIO program.
+	"""
+	stats = None  #: Set by `Controller` to record timings.
+	def __init__(self, ir_output, ir_input_raw, resources=None, pio_receive=False):
 		self._pin_output = ir_output.pin_output
 		self._pin_input = ir_input_raw.pin_input
+		self._resources = resources if resources is not None else ResourcePool()
+		self.pio_receive = pio_receive
 		self._output_state_machine = None
 		self._input_pulses = None
+		self._input_bytes = None
 		self._params = None
+		self._byte_decoder = None
+		self._frame_decoder = ic_encoding.FrameDecoder()
 		self._enabled = False
 	def enable(self, signal_type):
-		if self._enabled:
-			if signal_type == self._params.signal_type:
-				return
-			self.disable()
-		self._params = iC_Params(signal_type)
+		if self._params is None or signal_type != self._params.signal_type:
+			self._params = iC_Params(signal_type)
+			self._byte_decoder = iC_ByteDecoder(self._params)
 		try:
-			self._output_state_machine = rp2pio.StateMachine(
+			self._output_state_machine = self._resources[self._pin_output].state_machine(
 				pio_programs.iC_TX,
 				frequency=100_000,
 				first_out_pin=self._pin_output,
 				first_set_pin=self._pin_output,
 			)
-			self._input_pulses = pulseio.PulseIn(self._pin_input, maxlen=250, idle_state=True)
-			self._input_pulses.pause()
+			if self.pio_receive:
+				self._input_pulses = None
+				self._input_bytes = self._resources[self._pin_input].pio_byte_in(
+					pio_programs.iC_RX, self._params.rx_frequency, 64)
+			else:
+				self._input_bytes = None
+				self._input_pulses = self._resources[self._pin_input].pulse_in(250, True)
 		except:
 			self.disable()
 			raise
 		self._enabled = True
 	def disable(self):
-		for item in [self._output_state_machine, self._input_pulses]:
-			if item is not None:
-				item.deinit()
+		for pin in [self._pin_output, self._pin_input]:
+			self._resources[pin].release()
 		self._output_state_machine = None
 		self._input_pulses = None
+		self._input_bytes = None
 		self._params = None
+		self._byte_decoder = None
 		self._enabled = False
+	def sniffer(self):
+		"""Returns a `Sniffer` which records every packet from the raw IR input. Needs `pio_receive` to be False."""
+		if not self._enabled:
+			raise RuntimeError("not enabled")
+		if self._input_pulses is None:
+			raise RuntimeError("sniffing needs PulseIn")
+		from dmcomm.hardware.sniffer import Sniffer
+		params = self._params
+		return Sniffer(self._input_pulses, params.packet_idle_ticks * params.tick_length, None, self.decode,
+			SNIFF_MAXLEN)
+	def decode(self, pulses):
+		"""Decodes one packet from the durations in `pulses`. See `decode`."""
+		return decode(pulses, self._params, self._byte_decoder)
 	def send(self, bits):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		bytes_to_send = ic_encoding.encode(bits)
-		self.send_bytes(bytes_to_send)
+		self._output_state_machine.write(ic_encoding.encode_into(bytearray(), bits))
 	def send_bytes(self, bytes_to_send):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
 		self._output_state_machine.write(bytes(bytes_to_send))
 	def receive(self, timeout_ms):
+		return run_steps(self.receive_steps(timeout_ms))
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		bytes_received = self.receive_bytes(timeout_ms)
+		bytes_received = yield from self.receive_bytes_steps(timeout_ms)
 		if bytes_received == []:
 			return None
+		if self._frame_decoder.complete:
+			return self._frame_decoder.value
 		try:
 			(result, count) = ic_encoding.decode(bytes_received)
 		except ValueError as e:
 			raise ReceiveError(str(e))
 		return result
 	def receive_bytes(self, timeout_ms):
+		return run_steps(self.receive_bytes_steps(timeout_ms))
+	def receive_bytes_steps(self, timeout_ms):
+		"""Receives bytes until the end of the packet is detected.
+
+		Durations are decoded while they are still arriving, and the frame is checked as each byte completes,
+		so this returns as soon as the C1 terminator is complete or the frame is known to be bad.
+		Otherwise, it ends after `packet_idle_ticks` with no input.
+		"""
 		if not self._enabled:
 			raise RuntimeError("not enabled")
+		if self.pio_receive:
+			return (yield from self._receive_pio_bytes_steps(timeout_ms))
 		pulses = self._input_pulses
+		byte_decoder = self._byte_decoder
+		frame_decoder = self._frame_decoder
+		byte_decoder.reset()
+		frame_decoder.reset()
 		pulses.clear()
 		pulses.resume()
 		if timeout_ms == WAIT_REPLY:
 			timeout_ms = self._params.reply_timeout_ms
-		wait_for_length(pulses, 1, timeout_ms)
-		time.sleep(self._params.packet_length_timeout_ms / 1000)
-		pulses.pause()
-		if len(pulses) == pulses.maxlen:
-			raise ReceiveError("buffer full")
-		if len(pulses) == 0:
-			return []
-		#discard first byte or part of byte since we're joining partway through
-		min_gap_find = 2.5 * self._params.tick_length
-		while True:
-			if len(pulses) == 0:
-				raise ReceiveError("fragment")
-			if pulses.popleft() > min_gap_find:
-				break
 		bytes_received = []
-		current_byte = 0
-		pulse_count = 0
-		ticks_into_byte = 0
-		ended = False
-		while not ended:
-			pulse_count += 1
-			if len(pulses) == 0:
-				raise ReceiveError("ended with gap")
-			t_pulse = pulses.popleft()
-			if t_pulse > self._params.pulse_max:
-				raise ReceiveError("pulse %d = %d" % (pulse_count, t_pulse))
-			if len(pulses) != 0:
-				t_gap = pulses.popleft()
-			else:
-				t_gap = 0xFFFF
-				ended = True
-			dur = t_pulse + t_gap
-			ticks = round(dur / self._params.tick_length)
-			dur_rounded = ticks * self._params.tick_length
-			off_rounded = abs(dur - dur_rounded)
-			if ticks_into_byte + ticks >= 9:
-				#finish byte
-				for i in range(8 - ticks_into_byte):
-					current_byte >>= 1
-					current_byte |= 0x80
-				bytes_received.append(current_byte)
-				current_byte = 0
-				ticks_into_byte = 0
-			elif off_rounded > self._params.tick_margin:
-				raise ReceiveError("pulse+gap %d = %d" % (pulse_count, dur))
-			else:
-				for i in range(ticks - 1):
-					current_byte >>= 1
-					current_byte |= 0x80
-				current_byte >>= 1
-				ticks_into_byte += ticks
+		try:
+			if not (yield from wait_for_length_steps(pulses, 1, timeout_ms)):
+				return bytes_received
+			stats = self.stats
+			if stats is not None:
+				stats.first_input()
+			params = self._params
+			idle_us = params.packet_idle_ticks * params.tick_length
+			start_ticks_ms = supervisor.ticks_ms()
+			prev_us = time.monotonic_ns() // 1000
+			ended = False
+			while not ended:
+				count = len(pulses)
+				if count == pulses.maxlen:
+					raise ReceiveError("buffer full")
+				if count != 0:
+					prev_us = time.monotonic_ns() // 1000
+					popleft = pulses.popleft
+					feed = byte_decoder.feed
+					for _ in range(count):
+						byte_ = feed(popleft())
+						if byte_ is None:
+							continue
+						bytes_received.append(byte_)
+						try:
+							ended = frame_decoder.feed(byte_)
+						except ValueError:
+							ended = True  # receive reports the error
+						if ended:
+							break
+				elif (time.monotonic_ns() // 1000 - prev_us > idle_us
+						or ticks_diff(supervisor.ticks_ms(), start_ticks_ms) > params.packet_length_timeout_ms):
+					byte_ = byte_decoder.end()
+					if byte_ is not None:
+						bytes_received.append(byte_)
+						try:
+							frame_decoder.feed(byte_)
+						except ValueError:
+							pass  # receive reports the error
+					ended = True
+				else:
+					yield
+			if stats is not None:
+				stats.lap(PACKET)
+		finally:
+			pulses.pause()
+		return bytes_received
+	def _receive_pio_bytes_steps(self, timeout_ms):
+		# The bytes are already decoded, so this only needs to find the end of the packet.
+		input_bytes = self._input_bytes
+		frame_decoder = self._frame_decoder
+		frame_decoder.reset()
+		input_bytes.resume()
+		if timeout_ms == WAIT_REPLY:
+			timeout_ms = self._params.reply_timeout_ms
+		bytes_received = []
+		try:
+			if not (yield from wait_for_length_steps(input_bytes, 1, timeout_ms)):
+				return bytes_received
+			stats = self.stats
+			if stats is not None:
+				stats.first_input()
+			params = self._params
+			idle_us = params.pio_idle_ticks * params.tick_length
+			start_ticks_ms = supervisor.ticks_ms()
+			prev_us = time.monotonic_ns() // 1000
+			ended = False
+			while not ended:
+				count = len(input_bytes)
+				if count == input_bytes.maxlen:
+					raise ReceiveError("buffer full")
+				if count != 0:
+					prev_us = time.monotonic_ns() // 1000
+					popleft = input_bytes.popleft
+					for _ in range(count):
+						byte_ = popleft()
+						bytes_received.append(byte_)
+						try:
+							ended = frame_decoder.feed(byte_)
+						except ValueError:
+							ended = True  # receive reports the error
+						if ended:
+							break
+				elif (time.monotonic_ns() // 1000 - prev_us > idle_us
+						or ticks_diff(supervisor.ticks_ms(), start_ticks_ms) > params.packet_length_timeout_ms):
+					ended = True
+				else:
+					yield
+			if stats is not None:
+				stats.lap(PACKET)
+		finally:
+			input_bytes.pause()
 		return bytes_received
@@ -1,8 +1,8 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
-import pulseio
-
-from dmcomm.hardware.comms.modulated_shared import send, receive
+from dmcomm.hardware.misc import run_steps
+from dmcomm.hardware.resources import ResourcePool
+from dmcomm.hardware.comms.modulated_shared import PacketDecoder, SendBuffer, decode, send, receive_steps
 
 class ModulatedParams:
 	def __init__(self, signal_type):
@@ -51,42 +51,59 @@ class ModulatedParams:
 		self.signal_type = signal_type
 
 class ModulatedCommunicator:
-	def __init__(self, ir_output, ir_input_modulated):
+	stats = None  #: Set by `Controller` to record timings.
+	def __init__(self, ir_output, ir_input_modulated, resources=None):
 		self._pin_output = ir_output.pin_output
 		self._pin_input = ir_input_modulated.pin_input
+		self._resources = resources if resources is not None else ResourcePool()
 		self._output_pulses = None
 		self._input_pulses = None
 		self._params = None
+		self._send_buffer = None
+		self._decoder = None
 		self._enabled = False
 	def enable(self, signal_type):
-		if self._enabled:
-			if signal_type == self._params.signal_type:
-				return
-			self.disable()
-		self._params = ModulatedParams(signal_type)
+		if self._params is None or signal_type != self._params.signal_type:
+			self._params = ModulatedParams(signal_type)
+			self._send_buffer = SendBuffer(self._params)
+			self._decoder = PacketDecoder(self._params)
 		try:
-			self._output_pulses = pulseio.PulseOut(self._pin_output, frequency=38000, duty_cycle=0x8000)
-			self._input_pulses = pulseio.PulseIn(self._pin_input, maxlen=300, idle_state=True)
-			self._input_pulses.pause()
+			self._output_pulses = self._resources[self._pin_output].pulse_out(38000, 0x8000)
+			self._input_pulses = self._resources[self._pin_input].pulse_in(300, True)
 		except:
 			self.disable()
 			raise
 		self._enabled = True
 	def disable(self):
-		for item in [self._output_pulses, self._input_pulses]:
-			if item is not None:
-				item.deinit()
+		for pin in [self._pin_output, self._pin_input]:
+			self._resources[pin].release()
 		self._output_pulses = None
 		self._input_pulses = None
 		self._params = None
+		self._send_buffer = None
+		self._decoder = None
 		self._enabled = False
 	def reset(self):
 		pass
+	def sniffer(self):
+		"""Returns a `Sniffer` which records every packet from the modulated IR input."""
+		if not self._enabled:
+			raise RuntimeError("not enabled")
+		from dmcomm.hardware.sniffer import Sniffer
+		params = self._params
+		# Every gap is shorter than the start pulse and gap together, and every pulse but the start is
+		# no longer than the stop pulse.
+		return Sniffer(self._input_pulses, params.start_max, params.stop_pulse_max + 1, self.decode)
+	def decode(self, pulses):
+		"""Decodes one packet from the durations in `pulses`. See `modulated_shared.decode`."""
+		return decode(pulses, self._params, self._decoder)
 	def send(self, bytes_to_send):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		send(self._output_pulses, self._params, bytes_to_send)
+		send(self._output_pulses, self._params, bytes_to_send, self._send_buffer)
 	def receive(self, timeout_ms):
+		return run_steps(self.receive_steps(timeout_ms))
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		return receive(self._input_pulses, self._params, timeout_ms)
+		return (yield from receive_steps(self._input_pulses, self._params, timeout_ms, self.stats, self._decoder))
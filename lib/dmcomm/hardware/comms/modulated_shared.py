@@ -1,9 +1,11 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
 import array
+import supervisor
 
 from dmcomm import ReceiveError
 from dmcomm.hardware import WAIT_REPLY, misc
+from dmcomm.hardware.stats import PACKET
 
 def reverse_bits_8(x):
 	y = 0
@@ -13,83 +15,200 @@ def reverse_bits_8(x):
 		x >>= 1
 	return y
 
-def send(output_pulses, params, bytes_to_send):
-	if not params.low_byte_first:
-		bytes_to_send = bytes_to_send[:]  #copy
-	else:
-		bytes_to_send = bytes_to_send[::-1]  #reversed copy
-	if not params.low_bit_first:
-		for i in range(len(bytes_to_send)):
-			bytes_to_send[i] = reverse_bits_8(bytes_to_send[i])
-	num_durations = len(bytes_to_send) * 16 + 4
-	array_to_send = array.array("H")
-	for i in range(num_durations):
-		array_to_send.append(0)
-		#This function would be simpler if we append as we go along,
-		#but still hoping for a fix that allows reuse of the array.
-	array_to_send[0] = params.start_pulse_send
-	array_to_send[1] = params.start_gap_send
-	buf_cursor = 2
-	for current_byte in bytes_to_send:
+_REVERSED_BITS = bytes(reverse_bits_8(x) for x in range(256))
+
+#: Packet length in bytes which `SendBuffer` has room for at first. It grows if needed.
+SEND_BUFFER_BYTES = 32
+
+def byte_table(params):
+	"""Returns the 16 pulse/gap durations for each byte value, in sending order, in one array of 256 * 16."""
+	table = array.array("H", [0] * (256 * 16))
+	i = 0
+	for value in range(256):
 		for j in range(8):
-			array_to_send[buf_cursor] = params.bit_pulse_send
-			buf_cursor += 1
-			if current_byte & 1:
-				array_to_send[buf_cursor] = params.bit_gap_send_long
-			else:
-				array_to_send[buf_cursor] = params.bit_gap_send_short
-			buf_cursor += 1
-			current_byte >>= 1
-	array_to_send[buf_cursor] = params.stop_pulse_send
-	array_to_send[buf_cursor + 1] = params.stop_gap_send
-	output_pulses.send(array_to_send)
-
-def receive(input_pulses, params, timeout_ms):
-	pulses = input_pulses
-	pulses.clear()
-	pulses.resume()
-	if timeout_ms == WAIT_REPLY:
-		timeout_ms = params.reply_timeout_ms
-	misc.wait_for_length_no_more(pulses, timeout_ms,
-		params.packet_length_timeout_ms, params.packet_continue_timeout_ms)
-	pulses.pause()
-	if len(pulses) == pulses.maxlen:
-		raise ReceiveError("buffer full")
-	if len(pulses) == 0:
-		return []
-	bytes_received = []
-	t_pulse = misc.pop_pulse(pulses, -2)
-	t_gap = misc.pop_pulse(pulses, -1)
-	t_total = t_pulse + t_gap
-	if t_total < params.start_min or t_total > params.start_max:
-		raise ReceiveError(f"start pulse={t_pulse} gap={t_gap} total={t_total}")
-	current_byte = 0
-	bit_count = 0
-	while True:
-		t_pulse = misc.pop_pulse(pulses, 2*bit_count+1)
-		if len(pulses) == 0:
-			# Stop pulse?
-			if t_pulse < params.stop_pulse_min or t_pulse > params.stop_pulse_max:
-				raise ReceiveError(f"last pulse (bit {bit_count}) = {t_pulse}")
+			if params.low_bit_first:
+				bit = (value >> j) & 1
 			else:
-				# We are done
-				break
-		t_gap = pulses.popleft()
-		t_total = t_pulse + t_gap
+				bit = (value >> (7 - j)) & 1
+			table[i] = params.bit_pulse_send
+			table[i + 1] = params.bit_gap_send_long if bit else params.bit_gap_send_short
+			i += 2
+	return table
+
+class SendBuffer:
+	"""Durations for `send`, kept by the communicator so that sending a packet doesn't allocate an array.
+
+	:param params: The params for the signal type.
+	:param max_bytes: Packet length to make room for.
+	"""
+	def __init__(self, params, max_bytes=SEND_BUFFER_BYTES):
+		self.params = params
+		self._table = memoryview(byte_table(params))
+		self._allocate(max_bytes)
+	def _allocate(self, max_bytes):
+		self.max_bytes = max_bytes
+		self._durations = array.array("H", [0] * (max_bytes * 16 + 4))
+		self._durations[0] = self.params.start_pulse_send
+		self._durations[1] = self.params.start_gap_send
+		self._view = memoryview(self._durations)
+	def fill(self, bytes_to_send):
+		"""Returns a memoryview of the durations for sending `bytes_to_send`, valid until the next `fill`."""
+		num_bytes = len(bytes_to_send)
+		if num_bytes > self.max_bytes:
+			self._allocate(num_bytes)
+		params = self.params
+		view = self._view
+		table = self._table
+		cursor = 2
+		low_byte_first = params.low_byte_first
+		for i in range(num_bytes):
+			offset = bytes_to_send[num_bytes - 1 - i if low_byte_first else i] * 16
+			view[cursor:cursor + 16] = table[offset:offset + 16]
+			cursor += 16
+		view[cursor] = params.stop_pulse_send
+		view[cursor + 1] = params.stop_gap_send
+		return view[:cursor + 2]
+
+def send(output_pulses, params, bytes_to_send, send_buffer=None):
+	"""Sends a packet with `output_pulses`. Pass the communicator's `SendBuffer` to avoid allocating one."""
+	if send_buffer is None:
+		send_buffer = SendBuffer(params, len(bytes_to_send))
+	output_pulses.send(send_buffer.fill(bytes_to_send))
+
+class PacketDecoder:
+	"""Converts pulse and gap durations into bytes as they arrive.
+
+	:param params: The params for the signal type.
+	"""
+	def __init__(self, params):
+		self._params = params
+		self.reset()
+	def reset(self):
+		"""Prepares for a new packet."""
+		self._count = 0
+		self._started = False
+		self._t_pulse = None
+		self._bit_count = 0
+		self._current_byte = 0
+		self._bytes_received = []
+	@property
+	def stop_candidate(self):
+		"""True if the durations so far would make a complete packet, with the last one as the stop pulse."""
+		t_pulse = self._t_pulse
+		return (self._started and t_pulse is not None and self._bit_count % 8 == 0
+			and self._params.stop_pulse_min <= t_pulse <= self._params.stop_pulse_max)
+	def feed(self, t):
+		"""Processes the next duration from `PulseIn`.
+
+		:raises ReceiveError: If the timing is wrong.
+		"""
+		self._count += 1
+		if self._t_pulse is None:
+			self._t_pulse = t
+			return
+		params = self._params
+		t_pulse = self._t_pulse
+		self._t_pulse = None
+		t_total = t_pulse + t
+		if not self._started:
+			if t_total < params.start_min or t_total > params.start_max:
+				raise ReceiveError(f"start pulse={t_pulse} gap={t} total={t_total}")
+			self._started = True
+			return
+		bit_count = self._bit_count
 		if t_total < params.bit_min or t_total > params.bit_max:
-			raise ReceiveError(f"bit {bit_count} pulse={t_pulse} gap={t_gap} total={t_total}")
-		current_byte >>= 1
+			raise ReceiveError(f"bit {bit_count} pulse={t_pulse} gap={t} total={t_total}")
+		current_byte = self._current_byte >> 1
 		if t_total > params.bit_threshold:
 			current_byte |= 0x80
 		bit_count += 1
 		if bit_count % 8 == 0:
-			bytes_received.append(current_byte)
+			if not params.low_bit_first:
+				current_byte = _REVERSED_BITS[current_byte]
+			self._bytes_received.append(current_byte)
 			current_byte = 0
-	if bit_count % 8 != 0:
-		raise ReceiveError("bit_count = %d" % bit_count)
-	if params.low_byte_first:
-		bytes_received.reverse()
-	if not params.low_bit_first:
-		for i in range(len(bytes_received)):
-			bytes_received[i] = reverse_bits_8(bytes_received[i])
-	return bytes_received
+		self._bit_count = bit_count
+		self._current_byte = current_byte
+	def end(self):
+		"""Processes the end of the packet, after the last duration has been fed in.
+
+		:returns: The bytes received, or an empty list if there were no durations.
+		:raises ReceiveError: If the packet is incomplete.
+		"""
+		if self._count == 0:
+			return []
+		if not self._started:
+			raise ReceiveError("-1")
+		t_pulse = self._t_pulse
+		if t_pulse is None:
+			raise ReceiveError(str(2 * self._bit_count + 1))
+		if t_pulse < self._params.stop_pulse_min or t_pulse > self._params.stop_pulse_max:
+			raise ReceiveError(f"last pulse (bit {self._bit_count}) = {t_pulse}")
+		if self._bit_count % 8 != 0:
+			raise ReceiveError("bit_count = %d" % self._bit_count)
+		bytes_received = self._bytes_received
+		if self._params.low_byte_first:
+			bytes_received.reverse()
+		return bytes_received
+
+def decode(pulses, params, decoder=None):
+	"""Decodes a packet from the durations in `pulses`, removing them as it goes.
+
+	Pass the communicator's `PacketDecoder` to avoid creating one.
+	"""
+	if decoder is None:
+		decoder = PacketDecoder(params)
+	decoder.reset()
+	while len(pulses) != 0:
+		decoder.feed(pulses.popleft())
+	return decoder.end()
+
+def receive(input_pulses, params, timeout_ms, stats=None, decoder=None):
+	return misc.run_steps(receive_steps(input_pulses, params, timeout_ms, stats, decoder))
+
+def receive_steps(input_pulses, params, timeout_ms, stats=None, decoder=None):
+	"""Receives a packet, decoding the durations while they are still arriving.
+
+	Finishes when the line has been idle for longer than a bit could be after a possible stop pulse,
+	otherwise after `packet_continue_timeout_ms` idle or `packet_length_timeout_ms` in total.
+	Pass the communicator's `PacketDecoder` to avoid creating one.
+	"""
+	if decoder is None:
+		decoder = PacketDecoder(params)
+	decoder.reset()
+	pulses = input_pulses
+	pulses.clear()
+	pulses.resume()
+	if timeout_ms == WAIT_REPLY:
+		timeout_ms = params.reply_timeout_ms
+	# Rounded up, plus 1 for the ticks_ms resolution.
+	stop_idle_ms = params.bit_max // 1000 + 1
+	try:
+		if not (yield from misc.wait_for_length_steps(pulses, 1, timeout_ms)):
+			return []
+		if stats is not None:
+			stats.first_input()
+		start_ticks_ms = supervisor.ticks_ms()
+		prev_ticks_ms = start_ticks_ms
+		while True:
+			now_ticks_ms = supervisor.ticks_ms()
+			if len(pulses) != 0:
+				if len(pulses) == pulses.maxlen:
+					raise ReceiveError("buffer full")
+				prev_ticks_ms = now_ticks_ms
+				while len(pulses) != 0:
+					decoder.feed(pulses.popleft())
+			idle_ms = misc.ticks_diff(now_ticks_ms, prev_ticks_ms)
+			if ((idle_ms > stop_idle_ms and decoder.stop_candidate)
+					or idle_ms > params.packet_continue_timeout_ms
+					or misc.ticks_diff(now_ticks_ms, start_ticks_ms) > params.packet_length_timeout_ms):
+				break
+			yield
+		pulses.pause()
+		while len(pulses) != 0:
+			decoder.feed(pulses.popleft())
+	finally:
+		pulses.pause()
+	if stats is not None:
+		stats.lap(PACKET)
+	return decoder.end()
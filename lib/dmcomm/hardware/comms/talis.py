@@ -1,8 +1,8 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
-import pulseio
-
-from dmcomm.hardware.comms.modulated_shared import send, receive
+from dmcomm.hardware.misc import run_steps
+from dmcomm.hardware.resources import ResourcePool
+from dmcomm.hardware.comms.modulated_shared import PacketDecoder, SendBuffer, send, receive_steps
 
 class TalisParams:
 	def __init__(self, signal_type):
@@ -31,37 +31,42 @@ class TalisParams:
 		self.signal_type = signal_type
 
 class TalisCommunicator:
-	def __init__(self, talis_input_output):
+	stats = None  #: Set by `Controller` to record timings.
+	def __init__(self, talis_input_output, resources=None):
 		self._pin = talis_input_output.pin
+		self._resources = resources if resources is not None else ResourcePool()
+		self._pulses = None
 		self._params = None
+		self._send_buffer = None
+		self._decoder = None
 		self._enabled = False
 	def enable(self, signal_type):
-		if self._enabled:
-			if signal_type == self._params.signal_type:
-				return
+		if self._params is None or signal_type != self._params.signal_type:
+			self._params = TalisParams(signal_type)
+			self._send_buffer = SendBuffer(self._params)
+			self._decoder = PacketDecoder(self._params)
+		try:
+			self._pulses = self._resources[self._pin].half_duplex_pulses(600)
+		except:
 			self.disable()
-		self._params = TalisParams(signal_type)
+			raise
 		self._enabled = True
 	def disable(self):
+		self._resources[self._pin].release()
+		self._pulses = None
 		self._params = None
+		self._send_buffer = None
+		self._decoder = None
 		self._enabled = False
 	def reset(self):
 		pass
 	def send(self, bytes_to_send):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		output_pulses = pulseio.PulseOut(self._pin, frequency=100000, duty_cycle=0xFFFF)
-		try:
-			send(output_pulses, self._params, bytes_to_send)
-		finally:
-			output_pulses.deinit()
+		send(self._pulses, self._params, bytes_to_send, self._send_buffer)
 	def receive(self, timeout_ms):
+		return run_steps(self.receive_steps(timeout_ms))
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		input_pulses = pulseio.PulseIn(self._pin, maxlen=600, idle_state=False)
-		input_pulses.pause()
-		try:
-			bytes_received = receive(input_pulses, self._params, timeout_ms)
-		finally:
-			input_pulses.deinit()
-		return bytes_received
+		return (yield from receive_steps(self._pulses, self._params, timeout_ms, self.stats, self._decoder))
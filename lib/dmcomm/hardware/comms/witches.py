@@ -1,11 +1,12 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
 import array
-import time
 
 from dmcomm import ReceiveError
-from dmcomm.hardware import WAIT_REPLY
+from dmcomm.hardware import WAIT_FOREVER, WAIT_REPLY
 from dmcomm.hardware.comms.classic_shared import BaseProngCommunicator
+from dmcomm.hardware.misc import wait_for_length_no_more_steps
+from dmcomm.hardware.stats import PACKET
 
 class WitchesParams:
 	def __init__(self, signal_type):
@@ -13,8 +14,9 @@ class WitchesParams:
 			self.idle_state = False
 			self.clock = 19520
 			self.reply_timeout_ms = 300
-			self.packet_continue_timeout_seconds = 0.25
-			self.slow_input = True
+			self.packet_continue_timeout_ms = 250
+			self.packet_length_timeout_ms = 10000
+			self.pio_input = True
 		else:
 			raise ValueError("signal_type must be MW")
 		self.signal_type = signal_type
@@ -39,32 +41,29 @@ class WitchesCommunicator(BaseProngCommunicator):
 				bits_to_send <<= 1
 		array_to_send.append(RELEASE)
 		self._output_state_machine.write(array_to_send)
-	def receive(self, timeout_ms):
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		digital_input = self._input_pulses
+		params = self._params
+		pulses = self._input_pulses
 		if timeout_ms == WAIT_REPLY:
-			timeout_ms = self._params.reply_timeout_ms
-		timeout_seconds = timeout_ms / 1000
-		prev_time = time.monotonic()
-		while digital_input.value == self._params.idle_state:
-			if time.monotonic() - prev_time > timeout_seconds:
+			timeout_ms = params.reply_timeout_ms
+		if timeout_ms != WAIT_FOREVER:
+			# The first duration arrives at the end of the first active level, which can be 9 bits long.
+			timeout_ms += 9 * params.clock // 1000 + 1
+		pulses.clear()
+		pulses.resume()
+		try:
+			if not (yield from wait_for_length_no_more_steps(pulses, timeout_ms,
+					params.packet_length_timeout_ms, params.packet_continue_timeout_ms, self.stats)):
 				return []
-		prev_value = not self._params.idle_state
-		prev_time = time.monotonic()
-		clocked_pulses = []
-		clock_seconds = self._params.clock / 1000000
-		while True:
-			current_value = digital_input.value
-			current_time = time.monotonic()
-			dur = current_time - prev_time
-			if dur > self._params.packet_continue_timeout_seconds:
-				break
-			if current_value != prev_value:
-				pulse = round(dur / clock_seconds)
-				clocked_pulses.append(pulse)
-				prev_value = current_value
-				prev_time = current_time
+		finally:
+			pulses.pause()
+		if self.stats is not None:
+			self.stats.lap(PACKET)
+		clock = params.clock
+		# The last period at idle level runs into the silence at the end, so it isn't recorded.
+		clocked_pulses = [round(pulses[i] / clock) for i in range(len(pulses))]
 		return decode(clocked_pulses)
 
 def decode(clocked_pulses):
@@ -1,12 +1,13 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
-import pulseio
+import binascii
 import time
-import rp2pio
 
-from dmcomm import ReceiveError
+from dmcomm import CommandError, ReceiveError
 from dmcomm.hardware import WAIT_REPLY, pio_programs
-from dmcomm.hardware.misc import wait_for_length
+from dmcomm.hardware.misc import run_steps, sleep_steps, wait_for_length_steps, wait_for_no_more_steps
+from dmcomm.hardware.resources import ResourcePool
+from dmcomm.hardware.stats import PACKET
 
 class XLoaderParams:
 	def __init__(self, signal_type):
@@ -17,69 +18,228 @@ class XLoaderParams:
 			self.pulse_max = 250
 			self.tick_length = 17
 			self.tick_margin = 5
+			self.frequency = 583430
+			self.rx_frequency = 4 * 583430  # 40 cycles per tick for xloader_RX
+			self.cycles_per_byte = 1743  # for xloader_TX
 		else:
 			raise ValueError("signal_type must be !XL")
 		self.signal_type = signal_type
 
+def decode_bytes(durations, length, params):
+	"""Decodes a whole captured transmission in one pass.
+
+	:param durations: Pulse durations in microseconds, as from `PulseIn` with idle_state True.
+	:param length: Number of durations to decode.
+	:param params: The `XLoaderParams`.
+	:returns: List of bytes.
+	:raises ReceiveError: If the durations don't make whole bytes.
+	"""
+	byte_gap_min = params.byte_gap_min
+	pulse_max = params.pulse_max
+	tick_length = params.tick_length
+	tick_margin = params.tick_margin
+	bytes_received = []
+	i = 0
+	while i < length:
+		if durations[i] > byte_gap_min:
+			i += 1
+			if i == length:
+				break
+		current_byte = 0
+		pulse_count = 0
+		ticks_into_byte = 0
+		while True:
+			pulse_count += 1
+			if i == length:
+				raise ReceiveError("byte %d ended with gap" % len(bytes_received))
+			t_pulse = durations[i]
+			i += 1
+			if t_pulse > pulse_max:
+				raise ReceiveError("byte %d pulse %d = %d" % (len(bytes_received), pulse_count, t_pulse))
+			if i != length:
+				t_gap = durations[i]
+				i += 1
+			else:
+				t_gap = 0xFFFF
+			dur = t_pulse + t_gap
+			ticks = round(dur / tick_length)
+			if ticks_into_byte + ticks >= 9:
+				for _ in range(8 - ticks_into_byte):
+					current_byte = (current_byte >> 1) | 0x80
+				bytes_received.append(current_byte)
+				break
+			elif abs(dur - ticks * tick_length) > tick_margin:
+				raise ReceiveError("byte %d pulse+gap %d = %d" % (len(bytes_received), pulse_count, dur))
+			for _ in range(ticks - 1):
+				current_byte = (current_byte >> 1) | 0x80
+			current_byte >>= 1
+			ticks_into_byte += ticks
+	return bytes_received
+
 class XLoaderCommunicator:
-	def __init__(self, ir_output, ir_input_raw):
+	"""Sends and receives Xros Loader bytes.
+
+	By default, bytes are decoded one at a time as they arrive.
+	If `capture_maxlen` is set, the whole transmission is captured first, until there are no edges
+	for `capture_idle_ms`, and then decoded with `decode_bytes`. This needs a bigger buffer
+	(up to 18 durations per byte) but doesn't depend on keeping up with the input.
+	After each capture, `bytes_per_second` is the rate the bytes arrived at.
+	If `pio_receive` is True, the `xloader_RX` PIO program decodes the bytes instead, and `capture_maxlen`
+	is only used as the size of the buffer for them.
+
+	:param capture_maxlen: Size of the capture buffer, or None to decode byte by byte.
+	:param capture_idle_ms: Gap in milliseconds which ends the capture.
+	:param capture_timeout_ms: Longest capture in milliseconds, after which the input is taken to be stuck.
+		None allows for `capture_maxlen` durations at 2 per byte, with gaps of `capture_idle_ms` between bytes.
+	:param pio_receive: True to receive whole bytes from the PIO program.
+	"""
+	stats = None  #: Set by `Controller` to record timings.
+	def __init__(self, ir_output, ir_input_raw, resources=None, capture_maxlen=None, capture_idle_ms=5,
+			capture_timeout_ms=None, pio_receive=False):
 		self._pin_output = ir_output.pin_output
 		self._pin_input = ir_input_raw.pin_input
+		self._resources = resources if resources is not None else ResourcePool()
+		self.capture_maxlen = capture_maxlen
+		self.capture_idle_ms = capture_idle_ms
+		self.capture_timeout_ms = capture_timeout_ms
+		self.pio_receive = pio_receive
+		self.bytes_per_second = None
 		self._output_state_machine = None
 		self._input_pulses = None
+		self._input_bytes = None
 		self._params = None
 		self._enabled = False
 	def enable(self, signal_type):
-		if self._enabled:
-			if signal_type == self._params.signal_type:
-				return
-			self.disable()
-		self._params = XLoaderParams(signal_type)
+		if self._params is None or signal_type != self._params.signal_type:
+			self._params = XLoaderParams(signal_type)
 		try:
-			self._output_state_machine = rp2pio.StateMachine(
+			self._output_state_machine = self._resources[self._pin_output].state_machine(
 				pio_programs.xloader_TX,
-				frequency=583430,
+				frequency=self._params.frequency,
 				first_out_pin=self._pin_output,
 				first_set_pin=self._pin_output,
 			)
-			self._input_pulses = pulseio.PulseIn(self._pin_input, maxlen=100, idle_state=True)
-			self._input_pulses.pause()
+			maxlen = self.capture_maxlen if self.capture_maxlen is not None else 100
+			if self.pio_receive:
+				self._input_pulses = None
+				self._input_bytes = self._resources[self._pin_input].pio_byte_in(
+					pio_programs.xloader_RX, self._params.rx_frequency, maxlen)
+			else:
+				self._input_bytes = None
+				self._input_pulses = self._resources[self._pin_input].pulse_in(maxlen, True)
 		except:
 			self.disable()
 			raise
 		self._enabled = True
 	def disable(self):
-		for item in [self._output_state_machine, self._input_pulses]:
-			if item is not None:
-				item.deinit()
+		for pin in [self._pin_output, self._pin_input]:
+			self._resources[pin].release()
 		self._output_state_machine = None
 		self._input_pulses = None
+		self._input_bytes = None
 		self._params = None
 		self._enabled = False
 	def send(self, data):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
 		self._output_state_machine.write(bytes(data))
+	def send_steps(self, data):
+		"""Starts sending `data` in the background, first waiting while another buffer is queued.
+
+		`data` must not be changed until it has been sent.
+		"""
+		if not self._enabled:
+			raise RuntimeError("not enabled")
+		state_machine = self._output_state_machine
+		while state_machine.pending_write != 0:
+			yield
+		state_machine.background_write(once=data)
+	@property
+	def sending(self):
+		"""True while anything from `send_steps` is being sent."""
+		return self._output_state_machine.writing
+	@property
+	def limit_bytes_per_second(self):
+		"""The fastest rate the PIO program can send bytes at."""
+		return self._params.frequency // self._params.cycles_per_byte
 	def receive(self, timeout_ms):
+		return run_steps(self.receive_steps(timeout_ms))
+	def receive_steps(self, timeout_ms):
 		if not self._enabled:
 			raise RuntimeError("not enabled")
-		self._input_pulses.clear()
-		self._input_pulses.resume()
 		if timeout_ms == WAIT_REPLY:
 			timeout_ms = self._params.reply_timeout_ms
+		if self.pio_receive:
+			return (yield from self._receive_pio_steps(timeout_ms))
+		self._input_pulses.clear()
+		self._input_pulses.resume()
+		if self.capture_maxlen is not None:
+			return (yield from self._receive_capture_steps(timeout_ms))
 		bytes_received = []
 		while True:
-			byte = self._receive_byte(timeout_ms)
+			byte = yield from self._receive_byte_steps(timeout_ms)
 			if byte is None:
 				self._input_pulses.pause()
+				if self.stats is not None and bytes_received != []:
+					self.stats.lap(PACKET)
 				return bytes_received
+			if self.stats is not None and bytes_received == []:
+				self.stats.first_input()
 			bytes_received.append(byte)
 			timeout_ms = self._params.byte_timeout_ms
-	def _receive_byte(self, timeout_ms):
+	def _receive_pio_steps(self, timeout_ms):
+		input_bytes = self._input_bytes
+		input_bytes.resume()
+		bytes_received = []
+		try:
+			while (yield from wait_for_length_steps(input_bytes, 1, timeout_ms)):
+				if len(input_bytes) == input_bytes.maxlen:
+					raise ReceiveError("buffer full")
+				if self.stats is not None and bytes_received == []:
+					self.stats.first_input()
+				while len(input_bytes) != 0:
+					bytes_received.append(input_bytes.popleft())
+				timeout_ms = self._params.byte_timeout_ms
+		finally:
+			input_bytes.pause()
+		if self.stats is not None and bytes_received != []:
+			self.stats.lap(PACKET)
+		return bytes_received
+	def _receive_capture_steps(self, timeout_ms):
+		pulses = self._input_pulses
+		params = self._params
+		capture_timeout_ms = self.capture_timeout_ms
+		if capture_timeout_ms is None:
+			byte_ms = params.cycles_per_byte * 1000 // params.frequency + 1
+			capture_timeout_ms = self.capture_maxlen // 2 * (byte_ms + self.capture_idle_ms)
+		if not (yield from wait_for_length_steps(pulses, 1, timeout_ms)):
+			pulses.pause()
+			return []
+		if self.stats is not None:
+			self.stats.first_input()
+		finished = yield from wait_for_no_more_steps(pulses, capture_timeout_ms, self.capture_idle_ms)
+		pulses.pause()
+		length = len(pulses)
+		# The pool can hand back a bigger PulseIn than capture_maxlen, which is only full at its own maxlen.
+		if length >= pulses.maxlen:
+			raise ReceiveError("capture full: %d durations, increase capture_maxlen" % length)
+		if not finished:
+			raise ReceiveError("capture too long: still receiving after %dms, increase capture_timeout_ms"
+				% capture_timeout_ms)
+		if self.stats is not None:
+			self.stats.lap(PACKET)
+		bytes_received = decode_bytes(pulses, length, self._params)
+		start = 1 if pulses[0] > self._params.byte_gap_min else 0
+		duration_us = sum(pulses[i] for i in range(start, length))
+		if duration_us > 0:
+			self.bytes_per_second = len(bytes_received) * 1000000 // duration_us
+		pulses.clear()
+		return bytes_received
+	def _receive_byte_steps(self, timeout_ms):
 		pulses = self._input_pulses
-		if not wait_for_length(pulses, 1, timeout_ms):
+		if not (yield from wait_for_length_steps(pulses, 1, timeout_ms)):
 			return None
-		time.sleep(0.001)
+		yield from sleep_steps(1)
 		if len(pulses) == pulses.maxlen:
 			raise ReceiveError("buffer full")
 		current_byte = 0
@@ -116,3 +276,68 @@ class XLoaderCommunicator:
 					current_byte |= 0x80
 				current_byte >>= 1
 				ticks_into_byte += ticks
+
+class XLoaderTransfer:
+	"""Streams a large payload to a Xros Loader in numbered chunks, for `Controller.transfer`.
+
+	Each chunk starts sending in the background once the previous one has started,
+	so the next chunk can arrive while the current one is being sent.
+	Chunks are checked with `binascii.crc32`.
+
+	:param communicator: An enabled `XLoaderCommunicator`.
+	:param length: Total number of bytes to send.
+	"""
+	def __init__(self, communicator, length):
+		if length <= 0:
+			raise CommandError("length must be positive")
+		self.length = length
+		self.bytes_queued = 0
+		self.next_index = 0
+		#: Set by `finish_steps`.
+		self.elapsed_us = None
+		self.bytes_per_second = None
+		self._communicator = communicator
+		self._chunks = [None, None]  # kept until sent
+		self._start_us = None
+	@property
+	def limit_bytes_per_second(self):
+		return self._communicator.limit_bytes_per_second
+	@property
+	def complete(self):
+		"""True when all chunks have been queued."""
+		return self.bytes_queued == self.length
+	def add_chunk_steps(self, index, data, checksum):
+		"""Checks a chunk and queues it for sending, waiting while the previous chunk is queued.
+
+		:param index: The chunk number, starting from 0.
+		:param data: The bytes of the chunk.
+		:param checksum: The CRC32 of `data`.
+		:returns: The checksum.
+		:raises CommandError: If the chunk is out of order, fails the checksum or goes past the length.
+		"""
+		if index != self.next_index:
+			raise CommandError("chunk %d: expected %d" % (index, self.next_index))
+		actual = binascii.crc32(data)
+		if actual != checksum:
+			raise CommandError("chunk %d: checksum %08X, expected %08X" % (index, actual, checksum))
+		if self.bytes_queued + len(data) > self.length:
+			raise CommandError("chunk %d: past length %d" % (index, self.length))
+		yield from self._communicator.send_steps(data)
+		if self._start_us is None:
+			self._start_us = time.monotonic_ns() // 1000
+		self._chunks[index % 2] = data
+		self.bytes_queued += len(data)
+		self.next_index += 1
+		return actual
+	def finish_steps(self):
+		"""Waits until everything has been sent, and sets `elapsed_us` and `bytes_per_second`.
+
+		On the device, the last few bytes may still be in the PIO FIFO when this returns.
+		"""
+		if not self.complete:
+			raise CommandError("received %d of %d bytes" % (self.bytes_queued, self.length))
+		while self._communicator.sending:
+			yield
+		self.elapsed_us = time.monotonic_ns() // 1000 - self._start_us
+		self.bytes_per_second = self.length * 1000000 // max(self.elapsed_us, 1)
+		self._chunks = [None, None]
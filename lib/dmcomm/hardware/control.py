@@ -1,17 +1,28 @@
 # This file is part of the DMComm project by BladeSabre. License: MIT.
 
-from dmcomm import CommandError
+from dmcomm import CommandError, ReceiveError
 from . import WAIT_REPLY
 from . import pins
+from .misc import run_steps, run_steps_async
+from .stats import PREPARE, PRE_SEND, SEND, WAIT, REPLY_GAP, DECODE, SWITCH
 
 class Controller:
 	"""Main class which controls the communication.
 
 	The constructor takes no parameters.
 	"""
+	#: Set to a `Stats` to record timings, or None (the default) to skip that.
+	stats = None
+	#: Set to a `Capture` to record the raw durations of each receive, or None (the default) to skip that.
+	#: The records are written when each `execute` finishes.
+	capture = None
 	def __init__(self):
 		self._digirom = None
 		self._communicator = None
+		self._communicators = {}
+		self._options = {}
+		self._signal_type = None
+		self._resources = None
 		self._prong_output = None
 		self._prong_input = None
 		self._ir_output = None
@@ -44,93 +55,241 @@ class Controller:
 		:raises CommandError: If the required pins for the selected signal type are not registered.
 		:raises ReceiveError: If a broken transmission was received.
 		"""
+		try:
+			run_steps(self._execute_steps(digirom))
+		except (CommandError, ReceiveError):
+			self._write_capture(False)
+			raise
+		self._write_capture(True)
+	async def execute_async(self, digirom, poll_ms=1) -> None:
+		"""Carries out the communication specified, allowing other `asyncio` tasks to run while waiting.
+
+		Requires the `asyncio` library. Sending is still blocking.
+		The task can be cancelled while waiting.
+
+		:param digirom: The DigiROM to execute.
+		:param poll_ms: How long to sleep in milliseconds each time the input is checked while waiting.
+		:raises CommandError: If the required pins for the selected signal type are not registered.
+		:raises ReceiveError: If a broken transmission was received.
+		"""
+		try:
+			await run_steps_async(self._execute_steps(digirom), poll_ms)
+		except (CommandError, ReceiveError):
+			self._write_capture(False)
+			raise
+		self._write_capture(True)
+	def sniff(self, signal_type, callback) -> None:
+		"""Records every packet of the signal type, until `callback` raises an exception.
+
+		Unlike turn 0, the input keeps recording between packets, and any gap between packets is allowed.
+		Only V, X, Y, C, IC, DL and FL are supported.
+
+		:param signal_type: The signal type to listen for.
+		:param callback: Called as `callback(time_us, data, error)` for each packet. See `Sniffer.steps`.
+		:raises CommandError: If the signal type doesn't support this or the required pins are not registered.
+		"""
+		run_steps(self._sniff_steps(signal_type, callback))
+	async def sniff_async(self, signal_type, callback, poll_ms=1) -> None:
+		"""Records every packet of the signal type, allowing other `asyncio` tasks to run while waiting.
+
+		Runs until the task is cancelled or `callback` raises an exception. See `sniff`.
+
+		:param poll_ms: How long to sleep in milliseconds each time the input is checked.
+		"""
+		await run_steps_async(self._sniff_steps(signal_type, callback), poll_ms)
+	def transfer(self, signal_type, length):
+		"""Prepares to stream a payload too large for a DigiROM. Only "!XL" is supported so far.
+
+		:param signal_type: The signal type to send with.
+		:param length: Total number of bytes to send.
+		:returns: An `XLoaderTransfer` to add the chunks to.
+		:raises CommandError: If the signal type doesn't support this or the required pins are not registered.
+		"""
+		if signal_type != "!XL":
+			raise CommandError("transfer not supported for " + signal_type)
+		self._enable(signal_type)
+		from .comms.xloader import XLoaderTransfer
+		return XLoaderTransfer(self._communicator, length)
+	def _execute_steps(self, digirom):
 		self._digirom = digirom
+		stats = self.stats
 		try:
+			if stats is not None:
+				stats.start()
 			self._prepare()
+			if stats is not None:
+				stats.lap(PREPARE)
 			if digirom.turn in [0, 2]:
-				if not self._received(5000):
+				if not (yield from self._received_steps(5000)):
 					return
 			if digirom.turn == 0:
 				while True:
-					if not self._received(WAIT_REPLY):
+					if not (yield from self._received_steps(WAIT_REPLY)):
 						return
 			else:
 				while True:
+					if stats is not None:
+						stats.start()
 					data_to_send = self._digirom.next()
 					if data_to_send is None:
 						return
+					if stats is not None:
+						stats.lap(PRE_SEND)
 					self._communicator.send(data_to_send)
-					if not self._received(WAIT_REPLY):
+					if stats is not None:
+						stats.lap(SEND)
+					if not (yield from self._received_steps(WAIT_REPLY)):
 						return
 		finally:
 			self._digirom = None
+	def _write_capture(self, raise_errors):
+		"""Writes the capture records after an execute. When it raised an error, a write error doesn't replace it."""
+		if self.capture is None:
+			return
+		try:
+			self.capture.write_pending()
+		except OSError:
+			if raise_errors:
+				raise
+	def _sniff_steps(self, signal_type, callback):
+		if not hasattr(self._get_communicator(signal_type), "sniffer"):
+			raise CommandError("sniffing not supported for " + signal_type)
+		self._enable(signal_type)
+		yield from self._communicator.sniffer().steps(callback)
 	def _prepare(self):
 		"""Prepares for a single interaction.
 		"""
-		signal_type = self._digirom.signal_type
 		self._digirom.prepare()
-		if self._communicator is not None:
-			try:
-				self._communicator.enable(signal_type)
-				return
-			except ValueError:
-				self._disable()  # going to create a new communicator
-		if signal_type in ["V", "X", "Y", "C", "MW"]:
+		self._enable(self._digirom.signal_type)
+	def _enable(self, signal_type):
+		comm = self._get_communicator(signal_type)
+		if self._resources.capture is not self.capture:
+			# The inputs are created again with or without recording.
+			self._resources.capture = self.capture
+		if comm is self._communicator and signal_type == self._signal_type:
+			comm.enable(signal_type)
+		else:
+			stats = self.stats
+			if stats is not None:
+				start_us = stats.now_us()
+			comm.enable(signal_type)
+			self._signal_type = signal_type
+			if stats is not None:
+				stats.record_since(SWITCH, start_us)
+		comm.stats = self.stats
+		self._communicator = comm
+	def set_options(self, signal_type, **options):
+		"""Sets keyword arguments for the communicator which handles the signal type, such as `pio_receive`.
+
+		The options apply to every signal type sharing that communicator, so V, X and Y have the same ones.
+		If the communicator already exists, its attributes of the same names are changed.
+
+		:raises CommandError: If the signal type is not supported.
+		:raises TypeError: If the communicator already exists and has no such option.
+		"""
+		key = self._communicator_key(signal_type)
+		comm = self._communicators.get(key)
+		if comm is not None:
+			for name in options:
+				if not hasattr(comm, name):
+					raise TypeError("no option " + name + " for " + signal_type)
+			for (name, value) in options.items():
+				setattr(comm, name, value)
+		self._options.setdefault(key, {}).update(options)
+	def _communicator_key(self, signal_type):
+		if signal_type in ["V", "X", "Y"]:
+			return "classic"
+		elif signal_type in ["C", "MW", "IC", "!XL", "BC"]:
+			return signal_type
+		elif signal_type in ["DL", "FL"]:
+			return "modulated"
+		elif signal_type in ["LT"]:
+			return "talis"
+		else:
+			raise CommandError("signal_type=" + signal_type)
+	def _get_communicator(self, signal_type):
+		"""Returns the communicator for the signal type, creating it the first time with any `set_options`.
+
+		Communicators are kept for reuse. Those using the same pins share the hardware through `_resources`.
+		"""
+		key = self._communicator_key(signal_type)
+		comm = self._communicators.get(key)
+		if comm is not None:
+			return comm
+		options = self._options.get(key, {})
+		if self._resources is None:
+			from .resources import ResourcePool
+			self._resources = ResourcePool()
+		resources = self._resources
+		if key in ["classic", "C", "MW"]:
 			if self._prong_output is None:
 				raise CommandError("no prong output registered")
 			if self._prong_input is None:
 				raise CommandError("no prong input registered")
-			if signal_type == "C":
+			if key == "C":
 				from .comms import color
-				comm = color.ColorCommunicator(self._prong_output, self._prong_input)
-			elif signal_type == "MW":
+				comm = color.ColorCommunicator(self._prong_output, self._prong_input, resources, **options)
+			elif key == "MW":
 				from .comms import witches
-				comm = witches.WitchesCommunicator(self._prong_output, self._prong_input)
+				comm = witches.WitchesCommunicator(self._prong_output, self._prong_input, resources, **options)
 			else:
 				from .comms import classic
-				comm = classic.ClassicCommunicator(self._prong_output, self._prong_input)
-		elif signal_type in ["IC"]:
+				comm = classic.ClassicCommunicator(self._prong_output, self._prong_input, resources, **options)
+		elif key == "IC":
 			if self._ir_output is None:
 				raise CommandError("no infrared output registered")
 			if self._ir_input_raw is None:
 				raise CommandError("no raw infrared input registered")
 			from .comms import ic
-			comm = ic.iC_Communicator(self._ir_output, self._ir_input_raw)
-		elif signal_type in ["!XL"]:
+			comm = ic.iC_Communicator(self._ir_output, self._ir_input_raw, resources, **options)
+		elif key == "!XL":
 			if self._ir_output is None:
 				raise CommandError("no infrared output registered")
 			if self._ir_input_raw is None:
 				raise CommandError("no raw infrared input registered")
 			from .comms import xloader
-			comm = xloader.XLoaderCommunicator(self._ir_output, self._ir_input_raw)
-		elif signal_type in ["DL", "FL"]:
+			comm = xloader.XLoaderCommunicator(self._ir_output, self._ir_input_raw, resources, **options)
+		elif key == "modulated":
 			if self._ir_output is None:
 				raise CommandError("no infrared output registered")
 			if self._ir_input_modulated is None:
 				raise CommandError("no modulated infrared input registered")
 			from .comms import modulated
-			comm = modulated.ModulatedCommunicator(self._ir_output, self._ir_input_modulated)
-		elif signal_type in ["LT"]:
+			comm = modulated.ModulatedCommunicator(self._ir_output, self._ir_input_modulated, resources, **options)
+		elif key == "talis":
 			if self._talis_input_output is None:
 				raise CommandError("no talis pin registered")
 			from .comms import talis
-			comm = talis.TalisCommunicator(self._talis_input_output)
-		elif signal_type in ["BC"]:
+			comm = talis.TalisCommunicator(self._talis_input_output, resources, **options)
+		else:  # BC
 			if self._ir_output is None:
 				raise CommandError("no infrared output registered")
 			from .comms import barcode
-			comm = barcode.BarcodeCommunicator(self._ir_output)
-		else:
-			raise CommandError("signal_type=" + signal_type)
-		comm.enable(signal_type)
-		self._communicator = comm
-	def _received(self, timeout_ms):
-		received_data = self._communicator.receive(timeout_ms)
+			comm = barcode.BarcodeCommunicator(self._ir_output, resources, **options)
+		self._communicators[key] = comm
+		return comm
+	def _received_steps(self, timeout_ms):
+		stats = self.stats
+		if stats is not None:
+			stats.start(REPLY_GAP if timeout_ms == WAIT_REPLY else WAIT)
+		capture = self.capture
+		try:
+			received_data = yield from self._communicator.receive_steps(timeout_ms)
+		except ReceiveError:
+			if capture is not None:
+				capture.end(self._signal_type, error=True)
+			raise
+		if capture is not None:
+			capture.end(self._signal_type)
+		if stats is not None and received_data is not None and received_data != []:
+			stats.lap(DECODE)
 		self._digirom.store(received_data)
 		if received_data is None or received_data == []:
 			return False
 		return True
 	def _disable(self):
-		if self._communicator is not None:
-			self._communicator.disable()
-			self._communicator = None
+		"""Releases all the hardware used by the communicators."""
+		if self._resources is not None:
+			self._resources.release_all()
+		self._communicator = None
+		self._signal_type = None
@@ -15,7 +15,36 @@ def ticks_diff(ticks1, ticks2):
 	diff = ((diff + _TICKS_HALFPERIOD) & _TICKS_MAX) - _TICKS_HALFPERIOD
 	return diff
 
-def wait_for_length(obj, target, timeout_ms):
+# Waiting is done in generators which yield each time they check and find nothing to do yet,
+# so that the same code can be run to completion with `run_steps`, or alongside other tasks with `run_steps_async`.
+# The result of the wait is the return value of the generator.
+
+def run_steps(steps):
+	"Runs a generator of steps to completion, returning its result."
+	try:
+		while True:
+			next(steps)
+	except StopIteration as e:
+		return e.value
+
+async def run_steps_async(steps, poll_ms):
+	"""Runs a generator of steps to completion, returning its result.
+
+	Sleeps for `poll_ms` milliseconds each time the generator yields, so that other tasks can run.
+	"""
+	import asyncio
+	delay = poll_ms / 1000
+	try:
+		while True:
+			try:
+				next(steps)
+			except StopIteration as e:
+				return e.value
+			await asyncio.sleep(delay)
+	finally:
+		steps.close()
+
+def wait_for_length_steps(obj, target, timeout_ms):
 	"""Wait for `obj` to have length >= `target` with timeout in milliseconds.
 
 	Returns True if target length was reached in time, False otherwise.
@@ -28,15 +57,28 @@ def wait_for_length(obj, target, timeout_ms):
 		passed_ms = ticks_diff(supervisor.ticks_ms(), start_ticks_ms)
 		if timeout_ms != WAIT_FOREVER and passed_ms >= timeout_ms:
 			return False
+		yield
 
-def wait_for_length_2(obj, target, start_timeout_ms, dur_timeout_ms):
-	if not wait_for_length(obj, 1, start_timeout_ms):
+def wait_for_length_2_steps(obj, target, start_timeout_ms, dur_timeout_ms, stats=None):
+	if not (yield from wait_for_length_steps(obj, 1, start_timeout_ms)):
 		return False
-	return wait_for_length(obj, target, dur_timeout_ms)
+	if stats is not None:
+		stats.first_input()
+	return (yield from wait_for_length_steps(obj, target, dur_timeout_ms))
 
-def wait_for_length_no_more(obj, start_timeout_ms, dur_timeout_ms, no_more_timeout_ms):
-	if not wait_for_length(obj, 1, start_timeout_ms):
+def wait_for_length_no_more_steps(obj, start_timeout_ms, dur_timeout_ms, no_more_timeout_ms, stats=None):
+	if not (yield from wait_for_length_steps(obj, 1, start_timeout_ms)):
 		return False
+	if stats is not None:
+		stats.first_input()
+	yield from wait_for_no_more_steps(obj, dur_timeout_ms, no_more_timeout_ms)
+	return True  # even if it was cut off before it was done
+
+def wait_for_no_more_steps(obj, dur_timeout_ms, no_more_timeout_ms):
+	"""Wait for the length of `obj` to stay the same for `no_more_timeout_ms`, with timeout in milliseconds.
+
+	Returns True if it stopped changing in time, False if it was still changing.
+	"""
 	prev_length = len(obj)
 	start_ticks_ms = supervisor.ticks_ms()
 	prev_ticks_ms = start_ticks_ms
@@ -49,7 +91,26 @@ def wait_for_length_no_more(obj, start_timeout_ms, dur_timeout_ms, no_more_timeo
 		if ticks_diff(now_ticks_ms, prev_ticks_ms) > no_more_timeout_ms:
 			return True
 		if ticks_diff(now_ticks_ms, start_ticks_ms) > dur_timeout_ms:
-			return True #cut it off before it was done, but not worrying about that for now
+			return False
+		yield
+
+def sleep_steps(duration_ms):
+	"Waits for at least the specified time in milliseconds."
+	start_ticks_ms = supervisor.ticks_ms()
+	while ticks_diff(supervisor.ticks_ms(), start_ticks_ms) <= duration_ms:
+		yield
+
+def wait_for_length(obj, target, timeout_ms):
+	"Blocking version of `wait_for_length_steps`."
+	return run_steps(wait_for_length_steps(obj, target, timeout_ms))
+
+def wait_for_length_2(obj, target, start_timeout_ms, dur_timeout_ms):
+	"Blocking version of `wait_for_length_2_steps`."
+	return run_steps(wait_for_length_2_steps(obj, target, start_timeout_ms, dur_timeout_ms))
+
+def wait_for_length_no_more(obj, start_timeout_ms, dur_timeout_ms, no_more_timeout_ms):
+	"Blocking version of `wait_for_length_no_more_steps`."
+	return run_steps(wait_for_length_no_more_steps(obj, start_timeout_ms, dur_timeout_ms, no_more_timeout_ms))
 
 def pop_pulse(pulses, empty_error_code):
 	if len(pulses) == 0:
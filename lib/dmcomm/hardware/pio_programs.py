@@ -8,3 +8,15 @@ prong_TX = array('H', [32928, 40999, 68, 10, 70, 13, 72, 16, 72, 0, 57344, 57475
 iC_TX = array('H', [32928, 41199, 57345, 59136, 57383, 24577, 59136, 69, 44098])
 
 xloader_TX = array('H', [32928, 41199, 58369, 58112, 57383, 24577, 59136, 69, 57400, 57439, 394, 73])
+
+talis_half_duplex = array('H', [32928, 24624, 45, 57473, 57345, 325, 32928, 24624, 57344, 329, 32928, 24624, 68, 57472, 32768, 8352, 41003, 211, 20, 81, 41161, 32768, 41003, 217, 87, 41161, 32768, 16])
+
+pulse_RX = array('H', [8352, 41003, 196, 5, 66, 41161, 32768, 41003, 202, 72, 41161, 32768, 1])
+
+iC_RX = array('H', [8224, 8352, 57432, 197, 1, 643, 8224, 57383, 45378, 57425, 205, 138, 18, 209, 16481, 72, 20, 141, 16449, 73, 8352, 16504, 32768, 6])
+
+xloader_RX = array('H', [8224, 57383, 45378, 57425, 199, 132, 12, 203, 16481, 66, 14, 135, 16449, 67, 8352, 16504, 32768, 0])
+
+classic_RX_idle_high = array('H', [32928, 41159, 32928, 24656, 8352, 8224, 40998, 196, 71, 8352, 32768, 8224, 8352, 40994, 209, 16481, 20, 78, 16417, 8224, 24673, 236, 32768, 8352, 32768])
+
+classic_RX_idle_low = array('H', [32928, 41159, 32928, 24656, 8224, 8352, 40998, 201, 4, 71, 8224, 32768, 8352, 8224, 40994, 212, 79, 16417, 8352, 21, 16481, 24673, 237, 32768, 8224, 32768])
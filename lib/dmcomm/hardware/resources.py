@@ -0,0 +1,317 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+import array
+import digitalio
+import pulseio
+import rp2pio
+
+from dmcomm.hardware import pio_programs
+
+class PinResource:
+	"""Keeps the hardware object which is using a pin, so that communicators can share it.
+
+	Each method returns the existing object if it was created with the same settings,
+	otherwise deinits it and creates a new one. So switching between signal types which use the same
+	PIO program or PulseIn settings doesn't set up the hardware again.
+
+	:param pin: The pin, which is also the first pin for state machines.
+	"""
+	def __init__(self, pin):
+		self.pin = pin
+		#: `Capture` to record the durations from `pulse_in`, `pio_pulse_in` and `half_duplex_pulses` into, or None.
+		self.capture = None
+		self._settings = None
+		self._object = None
+	def _get(self, settings):
+		if settings == self._settings:
+			return self._object
+		self.release()
+		return None
+	def _set(self, settings, obj):
+		self._settings = settings
+		self._object = obj
+		return obj
+	def state_machine(self, program, frequency, **kwargs):
+		"""Returns a `rp2pio.StateMachine` running `program`. Other keyword arguments are passed on."""
+		settings = ("StateMachine", program, frequency, tuple(sorted(kwargs.items())))
+		obj = self._get(settings)
+		if obj is None:
+			obj = self._set(settings, rp2pio.StateMachine(program, frequency=frequency, **kwargs))
+		return obj
+	def pulse_out(self, frequency, duty_cycle):
+		"""Returns a `pulseio.PulseOut` with the settings given."""
+		settings = ("PulseOut", frequency, duty_cycle)
+		obj = self._get(settings)
+		if obj is None:
+			obj = self._set(settings, pulseio.PulseOut(self.pin, frequency=frequency, duty_cycle=duty_cycle))
+		return obj
+	def pulse_in(self, maxlen, idle_state):
+		"""Returns a paused `pulseio.PulseIn` with at least `maxlen`."""
+		current = self._settings
+		if current is not None and current[0] == "PulseIn" and current[1] >= maxlen and current[2] == idle_state:
+			return self._object
+		self.release()
+		obj = pulseio.PulseIn(self.pin, maxlen=maxlen, idle_state=idle_state)
+		obj.pause()
+		return self._set(("PulseIn", maxlen, idle_state), self._captured(obj))
+	def half_duplex_pulses(self, maxlen):
+		"""Returns a `HalfDuplexPulses` with at least `maxlen`."""
+		current = self._settings
+		if current is not None and current[0] == "HalfDuplexPulses" and current[1] >= maxlen:
+			return self._object
+		self.release()
+		return self._set(("HalfDuplexPulses", maxlen), self._captured(HalfDuplexPulses(self.pin, maxlen)))
+	def pio_pulse_in(self, maxlen):
+		"""Returns a paused `PioPulseIn` with at least `maxlen`."""
+		current = self._settings
+		if current is not None and current[0] == "PioPulseIn" and current[1] >= maxlen:
+			return self._object
+		self.release()
+		return self._set(("PioPulseIn", maxlen), self._captured(PioPulseIn(self.pin, maxlen)))
+	def pio_byte_in(self, program, frequency, maxlen):
+		"""Returns a paused `PioByteIn` running `program`, with at least `maxlen`."""
+		current = self._settings
+		if (current is not None and current[0] == "PioByteIn" and current[1] == program
+				and current[2] == frequency and current[3] >= maxlen):
+			return self._object
+		self.release()
+		return self._set(("PioByteIn", program, frequency, maxlen), PioByteIn(self.pin, maxlen, program, frequency))
+	def pio_classic_in(self, idle_state):
+		"""Returns a paused `PioClassicIn` for `idle_state`."""
+		settings = ("PioClassicIn", idle_state)
+		obj = self._get(settings)
+		if obj is None:
+			obj = self._set(settings, PioClassicIn(self.pin, idle_state))
+		return obj
+	def digital_out(self, value):
+		"""Returns a `digitalio.DigitalInOut` set as an output with `value`."""
+		settings = ("DigitalOut",)
+		obj = self._get(settings)
+		if obj is None:
+			obj = self._set(settings, digitalio.DigitalInOut(self.pin))
+			obj.switch_to_output(value=value)
+		else:
+			obj.value = value
+		return obj
+	def _captured(self, pulses):
+		if self.capture is None:
+			return pulses
+		from dmcomm.hardware.capture import CapturedPulses
+		return CapturedPulses(pulses, self.capture)
+	def release(self):
+		"""Deinits the object using the pin, if any."""
+		if self._object is not None:
+			self._object.deinit()
+		self._object = None
+		self._settings = None
+
+_END = array.array("H", [0])
+
+class _StateMachinePulses:
+	"""Durations pushed by a PIO state machine, kept in a ring buffer with the interface of `pulseio.PulseIn`.
+
+	The state machine only holds a few durations, so `len` needs checking every few milliseconds while recording.
+	"""
+	def __init__(self, state_machine, maxlen):
+		self.maxlen = maxlen
+		self._state_machine = state_machine
+		self._buffer = array.array("L", [0] * maxlen)
+		self._start = 0
+		self._length = 0
+		self._recording = False
+	@property
+	def paused(self):
+		return not self._recording
+	def pause(self):
+		self._fill()
+		self._recording = False
+	def resume(self, trigger_duration=0):
+		"""Starts recording from the beginning of the program."""
+		if self._recording:
+			return
+		state_machine = self._state_machine
+		state_machine.restart()
+		state_machine.clear_rxfifo()
+		self.clear()
+		self._recording = True
+	def clear(self):
+		self._start = 0
+		self._length = 0
+	def _fill(self):
+		if not self._recording:
+			return
+		state_machine = self._state_machine
+		maxlen = self.maxlen
+		while True:
+			length = self._length
+			index = self._start + length
+			if index >= maxlen:
+				index -= maxlen
+			# Straight into the ring, up to the wrap; anything which doesn't fit stays in the FIFO and is dropped.
+			count = min(state_machine.in_waiting, maxlen - length, maxlen - index)
+			if count == 0:
+				return
+			state_machine.readinto(self._buffer, start=index, end=index + count)
+			self._length = length + count
+	def popleft(self):
+		if self._length == 0:
+			self._fill()
+		if self._length == 0:
+			raise IndexError("pop from empty " + type(self).__name__)
+		value = self._buffer[self._start]
+		self._start = (self._start + 1) % self.maxlen
+		self._length -= 1
+		return value
+	def __len__(self):
+		self._fill()
+		return self._length
+	def __getitem__(self, index):
+		if index < 0 or index >= self._length:
+			self._fill()
+		if index < 0:
+			index += self._length
+		if index < 0 or index >= self._length:
+			raise IndexError("index out of range")
+		return self._buffer[(self._start + index) % self.maxlen]
+	def deinit(self):
+		self._state_machine.deinit()
+
+class PioPulseIn(_StateMachinePulses):
+	"""Records pulses with a PIO state machine, like `pulseio.PulseIn` with idle_state False,
+	but without the 0xFFFF limit on durations.
+
+	:param pin: The pin to use.
+	:param maxlen: Number of durations to keep.
+	"""
+	def __init__(self, pin, maxlen):
+		super().__init__(rp2pio.StateMachine(
+			pio_programs.pulse_RX,
+			frequency=2_000_000,
+			first_in_pin=pin,
+			jmp_pin=pin,
+		), maxlen)
+
+class PioByteIn(_StateMachinePulses):
+	"""Receives whole bytes with a PIO state machine, for iC or Xros Loader.
+
+	Works like `PioPulseIn`, but the items are bytes instead of durations.
+
+	:param pin: The raw infrared input pin.
+	:param maxlen: Number of bytes to keep.
+	:param program: `pio_programs.iC_RX` or `pio_programs.xloader_RX`.
+	:param frequency: The state machine frequency, which is 40 cycles per tick.
+	"""
+	def __init__(self, pin, maxlen, program, frequency):
+		super().__init__(rp2pio.StateMachine(
+			program,
+			frequency=frequency,
+			first_in_pin=pin,
+			jmp_pin=pin,
+		), maxlen)
+
+class PioClassicIn(_StateMachinePulses):
+	"""Classifies the bits of V/X/Y packets with a PIO state machine.
+
+	After `resume`, there are 3 items for each packet: the first when the pre-active period ends,
+	the bits in the top 16 bits of the second as the last active period starts, and the third when it ends.
+
+	:param pin: The prong input pin.
+	:param idle_state: The level of the input when nothing is sending.
+	"""
+	def __init__(self, pin, idle_state):
+		super().__init__(rp2pio.StateMachine(
+			pio_programs.classic_RX_idle_high if idle_state else pio_programs.classic_RX_idle_low,
+			frequency=2_000_000,
+			first_in_pin=pin,
+			jmp_pin=pin,
+		), 4)
+		self._thresholds = array.array("L", [0, 0])
+	def resume(self, pre_active_min, bit_idle_threshold):
+		"""Starts waiting for a packet.
+
+		:param pre_active_min: The shortest pre-active period in microseconds.
+		:param bit_idle_threshold: Idle periods longer than this in microseconds are 1.
+		"""
+		if self._recording:
+			return
+		super().resume()
+		self._thresholds[0] = pre_active_min
+		self._thresholds[1] = bit_idle_threshold
+		self._state_machine.write(self._thresholds)
+
+class HalfDuplexPulses(_StateMachinePulses):
+	"""Sends and records pulses on one pin with one PIO state machine, switching direction without new objects.
+
+	Recording works like `PioPulseIn`, so it can be used in place of `pulseio.PulseIn` with idle_state False.
+	Like `pulseio.PulseOut.send`, `send` returns when the pulses have been sent, and the state machine
+	is already recording by then.
+
+	:param pin: The pin to use.
+	:param maxlen: Number of durations to keep.
+	"""
+	def __init__(self, pin, maxlen):
+		super().__init__(rp2pio.StateMachine(
+			pio_programs.talis_half_duplex,
+			frequency=2_000_000,
+			first_set_pin=pin,
+			first_in_pin=pin,
+			jmp_pin=pin,
+			initial_set_pin_direction=0,
+		), maxlen)
+		self._marker = array.array("L", [0])
+	def send(self, durations):
+		"""Sends high and low alternately for the durations in microseconds (up to 0xFFFF), then records.
+
+		An even number of durations, so that the pin is low at the end. Waits until they have been sent.
+		"""
+		state_machine = self._state_machine
+		state_machine.restart()
+		state_machine.clear_rxfifo()
+		state_machine.write(durations)
+		state_machine.write(_END)
+		self._start_recording()
+	def resume(self, trigger_duration=0):
+		"""Starts recording, unless it already started at the end of `send`."""
+		if self._recording:
+			return
+		state_machine = self._state_machine
+		state_machine.restart()
+		state_machine.clear_rxfifo()
+		state_machine.write(_END)
+		self._start_recording()
+	def _start_recording(self):
+		# The program pushes a 0 when it switches to input, after anything written has been sent.
+		state_machine = self._state_machine
+		while state_machine.in_waiting == 0:
+			pass
+		state_machine.readinto(self._marker)
+		self.clear()
+		self._recording = True
+
+class ResourcePool:
+	"""A `PinResource` for each pin, created when first used."""
+	def __init__(self):
+		self._resources = {}
+		self._capture = None
+	def __getitem__(self, pin):
+		resource = self._resources.get(pin)
+		if resource is None:
+			resource = PinResource(pin)
+			resource.capture = self._capture
+			self._resources[pin] = resource
+		return resource
+	@property
+	def capture(self):
+		"""`Capture` for the pulse inputs, or None. Changing it releases everything, so inputs are created again."""
+		return self._capture
+	@capture.setter
+	def capture(self, capture):
+		if capture is self._capture:
+			return
+		self.release_all()
+		self._capture = capture
+		for resource in self._resources.values():
+			resource.capture = capture
+	def release_all(self):
+		for resource in self._resources.values():
+			resource.release()
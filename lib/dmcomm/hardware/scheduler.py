@@ -0,0 +1,80 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+#: Outcomes of executing a DigiROM, for `Scheduler.delay_ms`.
+COMPLETE = 0
+TIMEOUT = 1
+ERROR = 2
+
+#: Default minimum time between the starts of turn 1 interactions, in milliseconds.
+DEFAULT_CADENCE_MS = 1000
+
+def outcome(result, error=None):
+	"""Returns the outcome of executing a DigiROM.
+
+	:param result: The `Result` of the DigiROM.
+	:param error: The exception raised, if any.
+	"""
+	if error is not None:
+		return ERROR
+	if result is not None:
+		for i in range(len(result)):
+			segment = result[i]
+			if not segment.sent and segment.data != segment.null_value:
+				return COMPLETE
+	return TIMEOUT
+
+class Scheduler:
+	"""Decides how long to wait before executing the DigiROM again.
+
+	Turn 1 repeats at the cadence for its signal type.
+	Turn 0 and turn 2 listen again straight away after receiving something.
+	After a timeout or an error, the backoff doubles each time, from `backoff_min_ms` up to `backoff_max_ms`,
+	and goes back to normal once something is received. Turn 0 and turn 2 wait for the backoff,
+	and turn 1 waits for the backoff or the cadence, whichever is longer.
+
+	:param default_cadence_ms: Cadence for signal types not set with `set_cadence`.
+	:param backoff_min_ms: First delay after a timeout or an error.
+	:param backoff_max_ms: Longest delay after repeated timeouts or errors.
+	"""
+	def __init__(self, default_cadence_ms=DEFAULT_CADENCE_MS, backoff_min_ms=250, backoff_max_ms=5000):
+		self.default_cadence_ms = default_cadence_ms
+		self.backoff_min_ms = backoff_min_ms
+		self.backoff_max_ms = backoff_max_ms
+		self._cadences_ms = {}
+		self._backoff_ms = 0
+	def cadence_ms(self, signal_type):
+		"""Returns the minimum time between the starts of turn 1 interactions for the signal type."""
+		return self._cadences_ms.get(signal_type, self.default_cadence_ms)
+	def set_cadence(self, signal_type, cadence_ms):
+		"""Sets the cadence for the signal type, or the default if `signal_type` is None."""
+		if cadence_ms < 0:
+			raise ValueError("cadence_ms must not be negative")
+		if signal_type is None:
+			self.default_cadence_ms = cadence_ms
+		else:
+			self._cadences_ms[signal_type] = cadence_ms
+	def cadences(self):
+		"""Returns a list of (signal_type, cadence_ms) for the signal types which have been set."""
+		return sorted(self._cadences_ms.items())
+	def reset(self):
+		"""Forgets any backoff, such as when a new command arrives."""
+		self._backoff_ms = 0
+	def delay_ms(self, digirom, outcome, elapsed_ms):
+		"""Returns how long to wait before starting again.
+
+		:param digirom: The DigiROM which was executed.
+		:param outcome: `COMPLETE`, `TIMEOUT` or `ERROR`.
+		:param elapsed_ms: How long the execution took.
+		"""
+		if outcome != COMPLETE:
+			if self._backoff_ms == 0:
+				self._backoff_ms = self.backoff_min_ms
+			else:
+				self._backoff_ms = min(self._backoff_ms * 2, self.backoff_max_ms)
+			if digirom.turn in [0, 2]:
+				return self._backoff_ms
+			return max(self._backoff_ms, self.cadence_ms(digirom.signal_type) - elapsed_ms)
+		self._backoff_ms = 0
+		if digirom.turn in [0, 2]:
+			return 0
+		return max(0, self.cadence_ms(digirom.signal_type) - elapsed_ms)
@@ -0,0 +1,178 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+import array
+import time
+
+from dmcomm import ReceiveError
+
+class Durations:
+	"""Durations in a fixed-size array, with the parts of the `pulseio.PulseIn` interface which the decoders use.
+
+	:param maxlen: Number of durations to make room for.
+	"""
+	def __init__(self, maxlen):
+		self.maxlen = maxlen
+		self._buffer = array.array("L", [0] * maxlen)
+		self._start = 0
+		self._end = 0
+	def append(self, value):
+		if self._end == self.maxlen:
+			raise IndexError("Durations full")
+		self._buffer[self._end] = value
+		self._end += 1
+	def pop(self):
+		"""Removes and returns the last duration."""
+		if self._end == self._start:
+			raise IndexError("pop from empty Durations")
+		self._end -= 1
+		return self._buffer[self._end]
+	def popleft(self):
+		if self._end == self._start:
+			raise IndexError("pop from empty Durations")
+		value = self._buffer[self._start]
+		self._start += 1
+		return value
+	def clear(self):
+		self._start = 0
+		self._end = 0
+	def __len__(self):
+		return self._end - self._start
+	def __getitem__(self, index):
+		if index < 0:
+			index += self._end - self._start
+		if index < 0 or index >= self._end - self._start:
+			raise IndexError("index out of range")
+		return self._buffer[self._start + index]
+
+class Sniffer:
+	"""Records every packet from an input continuously, for logging two toys talking to each other.
+
+	The input is never paused, so it keeps recording while a packet is decoded. Durations are moved from it
+	into one of two packet buffers, and a finished packet is decoded from one while the other fills.
+	A packet ends at an idle period longer than `gap_us`, either when the next packet starts
+	or when the input has been quiet for that long. An active period of at least `start_us` always starts
+	a new packet, in case the gap was shorter.
+
+	:param input_pulses: A `pulseio.PulseIn` or similar, whose first duration is an active period.
+	:param gap_us: Longest idle period within a packet, in microseconds.
+	:param start_us: Shortest active period which starts a packet, or None if there isn't one.
+	:param decode: Function which takes the `Durations` of one packet and returns the data,
+		raising `ReceiveError` if it is broken.
+	:param maxlen: Number of durations to make room for in each packet. Defaults to the maxlen of the input.
+	"""
+	def __init__(self, input_pulses, gap_us, start_us, decode, maxlen=None):
+		if maxlen is None:
+			maxlen = input_pulses.maxlen
+		self._input = input_pulses
+		self._gap_us = gap_us
+		self._start_us = start_us
+		self._decode = decode
+		self._batch = array.array("L", [0] * input_pulses.maxlen)
+		self._buffers = [Durations(maxlen), Durations(maxlen)]
+	def steps(self, callback):
+		"""Records and decodes packets until closed, calling `callback(time_us, data, error)` for each one.
+
+		`time_us` is when the packet started in microseconds, from `time.monotonic_ns`, to within the time
+		between steps. `data` is the decoded packet, or None if `error` is the `ReceiveError` for it.
+		"""
+		pulses = self._input
+		self._packet = self._buffers[0]
+		self._packet.clear()
+		self._packet_us = 0
+		self._packet_full = False
+		self._pending = None
+		self._active_next = True
+		self._synced = True
+		self._last_us = time.monotonic_ns() // 1000
+		pulses.clear()
+		pulses.resume()
+		try:
+			while True:
+				self._poll(callback)
+				yield
+		finally:
+			pulses.pause()
+	def _poll(self, callback):
+		pulses = self._input
+		count = len(pulses)
+		now_us = time.monotonic_ns() // 1000
+		if count == pulses.maxlen:
+			# Some durations were lost, so which ones are active isn't known until the next quiet gap.
+			pulses.clear()
+			self._packet.clear()
+			self._packet_full = False
+			self._synced = False
+			self._last_us = now_us
+			callback(now_us, None, ReceiveError("buffer full"))
+		elif count != 0:
+			# The last edge was just now, so each duration can be timed backwards from here.
+			batch = self._batch
+			total = 0
+			popleft = pulses.popleft
+			for i in range(count):
+				t = popleft()
+				batch[i] = t
+				total += t
+			time_us = now_us - total
+			if self._synced:
+				for i in range(count):
+					t = batch[i]
+					self._add(t, time_us, callback)
+					time_us += t
+			self._last_us = now_us
+		elif now_us - self._last_us > self._gap_us:
+			if not self._synced:
+				# The next duration is the quiet gap.
+				self._synced = True
+				self._active_next = False
+			elif not self._active_next:
+				# Only while idle: quiet during an active period, such as the pre-active for C, doesn't end it.
+				self._end_packet(callback)
+		if self._pending is not None:
+			self._decode_pending(callback)
+	def _add(self, t, time_us, callback):
+		"Adds the duration `t`, which started at `time_us`."
+		active = self._active_next
+		self._active_next = not active
+		packet = self._packet
+		if active:
+			if self._start_us is not None and t >= self._start_us and len(packet) != 0:
+				# The idle period before this was the gap.
+				packet.pop()
+				self._end_packet(callback)
+				packet = self._packet
+			if len(packet) == 0:
+				self._packet_us = time_us
+		elif t > self._gap_us:
+			self._end_packet(callback)
+			return
+		elif len(packet) == 0:
+			return
+		if len(packet) == packet.maxlen:
+			self._packet_full = True
+		else:
+			packet.append(t)
+	def _end_packet(self, callback):
+		packet = self._packet
+		if len(packet) == 0:
+			return
+		if self._pending is not None:
+			self._decode_pending(callback)
+		self._pending = (packet, self._packet_us, self._packet_full)
+		self._packet = self._buffers[1] if packet is self._buffers[0] else self._buffers[0]
+		self._packet.clear()
+		self._packet_full = False
+	def _decode_pending(self, callback):
+		(packet, time_us, full) = self._pending
+		self._pending = None
+		data = None
+		error = None
+		if full:
+			error = ReceiveError("buffer full")
+		else:
+			try:
+				data = self._decode(packet)
+			except ReceiveError as e:
+				error = e
+		packet.clear()
+		callback(time_us, data, error)
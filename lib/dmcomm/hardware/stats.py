@@ -0,0 +1,99 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+import array
+import time
+
+#: Phase indexes for `Stats.lap`.
+PREPARE = 0
+PRE_SEND = 1
+SEND = 2
+WAIT = 3
+REPLY_GAP = 4
+PACKET = 5
+DECODE = 6
+SWITCH = 7
+
+PHASE_NAMES = ("prepare", "pre_send", "send", "wait", "reply_gap", "packet", "decode", "switch")
+
+#: Upper bounds of the histogram bins in microseconds. The last bin has no upper bound.
+HISTOGRAM_BOUNDS = (100, 300, 1000, 3000, 10000, 30000, 100000, 300000)
+
+def _now_us():
+	return time.monotonic_ns() // 1000
+
+class Stats:
+	"""Timings in microseconds for each phase of `Controller.execute`, kept in fixed-size ring buffers.
+
+	Set `Controller.stats` to an instance of this to start recording.
+
+	:param size: Number of timings kept for each phase.
+	"""
+	def __init__(self, size=32):
+		self._size = size
+		self._durations = [array.array("L", [0] * size) for _ in PHASE_NAMES]
+		self._counts = array.array("L", [0] * len(PHASE_NAMES))
+		self._last_us = _now_us()
+		self._first_input_phase = WAIT
+	def start(self, first_input_phase=WAIT):
+		"""Starts timing from now.
+
+		:param first_input_phase: The phase to record when `first_input` is called.
+		"""
+		self._first_input_phase = first_input_phase
+		self._last_us = _now_us()
+	def lap(self, phase):
+		"""Records the time since the previous `start` or `lap` for the phase given."""
+		now_us = _now_us()
+		self.record(phase, now_us - self._last_us)
+		self._last_us = now_us
+	def now_us(self):
+		return _now_us()
+	def record_since(self, phase, start_us):
+		"""Records the time since `start_us` from `now_us` for the phase given, without affecting `lap`."""
+		self.record(phase, _now_us() - start_us)
+	def first_input(self):
+		"""Called by the communicators when input starts arriving."""
+		self.lap(self._first_input_phase)
+	def record(self, phase, duration_us):
+		count = self._counts[phase]
+		self._durations[phase][count % self._size] = min(duration_us, 0xFFFFFFFF)
+		self._counts[phase] = count + 1
+	def clear(self):
+		for phase in range(len(PHASE_NAMES)):
+			self._counts[phase] = 0
+	def durations(self, phase):
+		"""Returns the timings kept for the phase, oldest first."""
+		count = self._counts[phase]
+		durations = self._durations[phase]
+		if count <= self._size:
+			return list(durations[:count])
+		start = count % self._size
+		return list(durations[start:]) + list(durations[:start])
+	def summary(self, phase):
+		"""Returns (count, min, average, max, histogram) for the timings kept, or None if there are none.
+
+		The count is the total recorded, which may be more than the number kept.
+		The histogram is a list of counts for the bins in `HISTOGRAM_BOUNDS`.
+		"""
+		durations = self.durations(phase)
+		if len(durations) == 0:
+			return None
+		histogram = [0] * (len(HISTOGRAM_BOUNDS) + 1)
+		for duration in durations:
+			i = 0
+			while i < len(HISTOGRAM_BOUNDS) and duration >= HISTOGRAM_BOUNDS[i]:
+				i += 1
+			histogram[i] += 1
+		average = sum(durations) // len(durations)
+		return (self._counts[phase], min(durations), average, max(durations), histogram)
+	def report(self):
+		"""Returns the summaries as lines of text."""
+		lines = ["phase n min avg max hist<" + "/".join(str(bound) for bound in HISTOGRAM_BOUNDS)]
+		for phase in range(len(PHASE_NAMES)):
+			summary = self.summary(phase)
+			if summary is None:
+				continue
+			(count, min_us, average_us, max_us, histogram) = summary
+			lines.append("%s %d %d %d %d %s" % (PHASE_NAMES[phase], count, min_us, average_us, max_us,
+				"/".join(str(n) for n in histogram)))
+		return lines
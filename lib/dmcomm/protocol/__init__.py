@@ -24,8 +24,8 @@ def parse_command(text):
 		op = op_turn
 	except IndexError:
 		raise CommandError("op=")
-	if op in ["T", "I", "P"]:
-		return OtherCommand(op)
+	if op in ["T", "I", "P", "S", "R", "U", "L"]:
+		return OtherCommand(op, parts[1:])
 	elif op in ["V", "X", "Y", "IC"]:
 		DigiROM = digirom.ClassicDigiROM
 	elif op in ["C"]:
@@ -41,6 +41,7 @@ def parse_command(text):
 	return DigiROM(op, turn, text_segments=parts[1:])
 
 class OtherCommand:
-	def __init__(self, op):
+	def __init__(self, op, args=None):
 		self.signal_type = None
 		self.op = op
+		self.args = args if args is not None else []
@@ -9,6 +9,8 @@ Handling of DigiROM formats.
 Note: This API is still under development and may change at any time.
 """
 
+from array import array
+
 from dmcomm import CommandError
 
 def checksum_datalink(bytes_):
@@ -23,19 +25,114 @@ def checksum_datalink(bytes_):
 			carry_bit = 0
 	return checksum
 
-def _sequence_from_hex_string(text, grouplen):
+class Operator:
+	"""Base class for instructions which calculate an item in a byte or word sequence, such as "++".
+
+	One instance is used for each instruction in a DigiROM.
+	If the result depends on the items before it in the segment, set `accumulates` to True
+	and keep a running state in `update`, which is called once for each item.
+
+	:param mask: 0xFF for byte sequences, 0xFFFF for word sequences.
+	"""
+	accumulates = False  #: Subclasses can override.
+	def __init__(self, mask):
+		self.mask = mask
+		self.reset()
+	def reset(self):
+		"""Called at the start of each segment."""
+		pass
+	def update(self, item):
+		"""Called with each item of the segment as it is decided, if `accumulates` is True."""
+		pass
+	def value(self, index, data_received):
+		"""Returns the item for position `index` in the segment.
+
+		:param data_received: The data most recently received, or None.
+		"""
+		raise NotImplementedError("Subclasses must override value()")
+
+class SumOperator(Operator):
+	"""Sum of the previous items in the segment."""
+	accumulates = True
+	def reset(self):
+		self._sum = 0
+	def update(self, item):
+		self._sum += item
+	def value(self, index, data_received):
+		return self._sum & self.mask
+
+class XorOperator(Operator):
+	"""XOR of the previous items in the segment."""
+	accumulates = True
+	def reset(self):
+		self._xor = 0
+	def update(self, item):
+		self._xor ^= item
+	def value(self, index, data_received):
+		return self._xor
+
+class DataLinkChecksumOperator(Operator):
+	"""Data Link checksum of the previous items in the segment, as `checksum_datalink`."""
+	accumulates = True
+	def reset(self):
+		self._checksum = 0
+		self._carry_bit = 0
+	def update(self, item):
+		checksum = self._checksum + item + self._carry_bit
+		if checksum >= 0x100:
+			self._checksum = checksum & 0xFF
+			self._carry_bit = 1
+		else:
+			self._checksum = checksum
+			self._carry_bit = 0
+	def value(self, index, data_received):
+		return self._checksum
+
+class MirrorOperator(Operator):
+	"""Item received in the same position, or 0."""
+	def value(self, index, data_received):
+		try:
+			return data_received[index]
+		except:
+			return 0
+
+class ShiftOperator(Operator):
+	"""Item received in the previous position, or 0."""
+	def value(self, index, data_received):
+		try:
+			return data_received[index - 1]
+		except:
+			return 0
+
+#: Instructions for byte sequences. New `Operator` subclasses can be added here.
+BYTE_OPERATORS = {
+	"++": SumOperator,
+	"^^": XorOperator,
+	"+?": DataLinkChecksumOperator,
+	"__": MirrorOperator,
+	">>": ShiftOperator,
+}
+
+#: Instructions for word sequences. New `Operator` subclasses can be added here.
+WORD_OPERATORS = {
+	"++++": SumOperator,
+	"____": MirrorOperator,
+}
+
+def _sequence_from_hex_string(text, grouplen, operators):
 	"""Creates a list of command data from one of the dash-separated parts of a text command.
 
 	For Bytes|WordsCommandSegment.
 
 	:param grouplen: The number of hex digits in each group.
+	:param operators: Dict of the instructions allowed.
 	"""
 	if len(text) < grouplen or len(text) % grouplen != 0:
 		raise CommandError("bad length: " + text)
 	data = []
 	for i in range(0, len(text)-1, grouplen):
 		digits = text[i:i+grouplen]
-		if digits in ["++++", "____", "++", "+?", "__", ">>", "^^"]:
+		if digits in operators:
 			item = digits
 		else:
 			try:
@@ -84,6 +181,7 @@ class BaseResultSegment:
 	:param data: The data sent or received.
 		If sent is False, can be `null_value` to indicate nothing was received before timeout.
 	"""
+	__slots__ = ("sent", "data")
 	null_value = None  #: Subclasses can override.
 	def __init__(self, sent: bool, data):
 		self.sent = sent
@@ -110,27 +208,36 @@ class BaseDigiROM:
 		self.signal_type = signal_type
 		self.turn = turn
 		self.result = None
+		self._segments = self._new_segment_store()
 		if segments is not None:
-			self._segments = segments
+			for c in segments:
+				self.append(c)
 		elif text_segments is not None:
 			conv = self.command_segment_class.from_string
-			self._segments = [conv(item) for item in text_segments]
-		else:
-			self._segments = []
+			for item in text_segments:
+				self.append(conv(item))
+	def _new_segment_store(self):
+		"""Returns an empty container for the command segments.
+
+		Subclasses can override to use a more compact container, which must support `append`, `len`
+		and indexing which gives objects with the same fields as the command segments. These can be read-only.
+		"""
+		return []
 	def append(self, c):
 		self._segments.append(c)
 	def prepare(self):
 		self.result = Result(self.signal_type)
 		self._command_index = 0
 		self._data_received = None
-	def _pre_send(self, segment):
-		return segment.data
+	def _pre_send(self, i):
+		"""Calculates the data to send for command segment `i`."""
+		return self._segments[i].data
 	def next(self):
-		if self._command_index >= len(self._segments):
+		i = self._command_index
+		if i >= len(self._segments):
 			return None
-		segment = self._segments[self._command_index]
 		self._command_index += 1
-		data = self._pre_send(segment)
+		data = self._pre_send(i)
 		self.result.append(self.result_segment_class(True, data))
 		return data
 	def store(self, data):
@@ -170,6 +277,7 @@ class BaseHighLevelDigiROM:
 class ClassicCommandSegment:
 	"""Describes how to carry out one segment of the communication for 16-bit protocols.
 	"""
+	__slots__ = ("data", "copy_mask", "invert_mask", "checksum_target", "check_digit_LSB_pos")
 	@classmethod
 	def from_string(cls, text):
 		"""Creates a `ClassicCommandSegment` from one of the dash-separated parts of a text command.
@@ -216,9 +324,69 @@ class ClassicCommandSegment:
 		self.check_digit_LSB_pos = check_digit_LSB_pos
 	#def __str__():
 
+def _check_index(i, length):
+	if i < 0:
+		i += length
+	if i < 0 or i >= length:
+		raise IndexError("segment index out of range")
+	return i
+
+class ClassicSegmentView:
+	"""Read-only view of one segment in a `ClassicSegmentStore`, with the fields of `ClassicCommandSegment`.
+
+	Assigning to the fields raises `AttributeError`, since the segment is only stored in the arrays.
+	"""
+	__slots__ = ("_store", "_index")
+	def __init__(self, store, index):
+		self._store = store
+		self._index = index
+	@property
+	def data(self):
+		return self._store.data[self._index]
+	@property
+	def copy_mask(self):
+		return self._store.copy_mask[self._index]
+	@property
+	def invert_mask(self):
+		return self._store.invert_mask[self._index]
+	@property
+	def checksum_target(self):
+		value = self._store.checksum_target[self._index]
+		return None if value == self._store.NONE else value
+	@property
+	def check_digit_LSB_pos(self):
+		value = self._store.check_digit_LSB_pos[self._index]
+		return None if value == self._store.NONE else value
+
+class ClassicSegmentStore:
+	"""Stores `ClassicCommandSegment` fields in flat arrays, one item per segment.
+
+	Indexing returns a read-only `ClassicSegmentView`.
+	"""
+	__slots__ = ("data", "copy_mask", "invert_mask", "checksum_target", "check_digit_LSB_pos")
+	NONE = 0xFF  #: Stored in place of None in `checksum_target` and `check_digit_LSB_pos`.
+	def __init__(self):
+		self.data = array("H")
+		self.copy_mask = array("H")
+		self.invert_mask = array("H")
+		self.checksum_target = array("B")
+		self.check_digit_LSB_pos = array("B")
+	def append(self, c):
+		NONE = self.NONE
+		self.data.append(c.data)
+		self.copy_mask.append(c.copy_mask)
+		self.invert_mask.append(c.invert_mask)
+		self.checksum_target.append(NONE if c.checksum_target is None else c.checksum_target)
+		self.check_digit_LSB_pos.append(NONE if c.check_digit_LSB_pos is None else c.check_digit_LSB_pos)
+	def __len__(self):
+		return len(self.data)
+	def __getitem__(self, i):
+		return ClassicSegmentView(self, _check_index(i, len(self)))
+
 class ClassicResultSegment(BaseResultSegment):
 	"""Describes the result of one segment of the communication for 16-bit protocols.
 	"""
+	__slots__ = ()
 	def str_data(self):
 		return "%04X" % self.data
 
@@ -227,30 +395,38 @@ class ClassicDigiROM(BaseDigiROM):
 	"""
 	command_segment_class = ClassicCommandSegment
 	result_segment_class = ClassicResultSegment
+	def _new_segment_store(self):
+		return ClassicSegmentStore()
 	def prepare(self):
 		super().prepare()
 		self._checksum = 0
-	def _pre_send(self, c):
+	def _pre_send(self, segment_index):
+		store = self._segments
 		bits_received = self._data_received or 0
-		bits = c.data
-		bits &= ~c.copy_mask
-		bits |= c.copy_mask & bits_received
-		bits &= ~c.invert_mask
-		bits |= c.invert_mask & ~bits_received
-		if c.checksum_target is not None:
-			bits &= ~(0xF << c.check_digit_LSB_pos)
+		bits = store.data[segment_index]
+		copy_mask = store.copy_mask[segment_index]
+		invert_mask = store.invert_mask[segment_index]
+		checksum_target = store.checksum_target[segment_index]
+		bits &= ~copy_mask
+		bits |= copy_mask & bits_received
+		bits &= ~invert_mask
+		bits |= invert_mask & ~bits_received
+		if checksum_target != store.NONE:
+			check_digit_LSB_pos = store.check_digit_LSB_pos[segment_index]
+			bits &= ~(0xF << check_digit_LSB_pos)
 		for i in range(4):
 			self._checksum += bits >> (4 * i)
 		self._checksum %= 16
-		if c.checksum_target is not None:
-			check_digit = (c.checksum_target - self._checksum) % 16
-			bits |= check_digit << c.check_digit_LSB_pos
-			self._checksum = c.checksum_target
+		if checksum_target != store.NONE:
+			check_digit = (checksum_target - self._checksum) % 16
+			bits |= check_digit << check_digit_LSB_pos
+			self._checksum = checksum_target
 		return bits
 
 class DigitsCommandSegment:
 	"""Describes how to carry out one segment of the communication for digit-sequence protocols.
 	"""
+	__slots__ = ("data",)
 	@classmethod
 	def from_string(cls, text):
 		"""Creates a `DigitsCommandSegment` from one of the dash-separated parts of a text command.
@@ -270,6 +446,7 @@ class DigitsCommandSegment:
 class DigitsResultSegment(BaseResultSegment):
 	"""Describes the result of one segment of the communication for digit-sequence protocols.
 	"""
+	__slots__ = ()
 	null_value = []
 	def str_data(self):
 		digits = ["%d" % n for n in self.data]
@@ -281,14 +458,102 @@ class DigitsDigiROM(BaseDigiROM):
 	command_segment_class = DigitsCommandSegment
 	result_segment_class = DigitsResultSegment
 
+class SequenceSegmentView:
+	"""Read-only view of one segment in a `SequenceSegmentStore`.
+
+	`data` is a tuple of the items, so neither it nor the items can be assigned to.
+	"""
+	__slots__ = ("_store", "_index")
+	def __init__(self, store, index):
+		self._store = store
+		self._index = index
+	@property
+	def data(self):
+		store = self._store
+		items = []
+		for j in range(store.starts[self._index], store.starts[self._index + 1]):
+			op = store.ops[j]
+			items.append(store.data[j] if op == 0 else store.op_names[op - 1])
+		return tuple(items)
+
+class SequenceSegmentStore:
+	"""Stores the items of byte or word sequence segments one after another in flat arrays.
+
+	Indexing returns a read-only `SequenceSegmentView`.
+
+	:param typecode: The array typecode for the data items.
+	"""
+	__slots__ = ("data", "ops", "op_names", "starts")
+	def __init__(self, typecode):
+		#: Item values, or 0 where the item is an instruction.
+		self.data = array(typecode)
+		#: 0 where the item is a value, otherwise 1 + the index of the instruction in `op_names`.
+		self.ops = array("B")
+		#: The instruction strings found so far, such as "++".
+		self.op_names = []
+		#: Index in `data` where each segment starts, followed by the total length.
+		self.starts = array("H", [0])
+	def append(self, c):
+		for item in c.data:
+			if type(item) is str:
+				if item not in self.op_names:
+					self.op_names.append(item)
+				self.data.append(0)
+				self.ops.append(self.op_names.index(item) + 1)
+			else:
+				self.data.append(item)
+				self.ops.append(0)
+		self.starts.append(len(self.data))
+	def __len__(self):
+		return len(self.starts) - 1
+	def __getitem__(self, i):
+		return SequenceSegmentView(self, _check_index(i, len(self)))
+
+class BaseSequenceDigiROM(BaseDigiROM):
+	"""Base class for byte-sequence and word-sequence DigiROMs.
+	"""
+	operators = None  #: Subclasses must override.
+	item_mask = None  #: Subclasses must override.
+	def prepare(self):
+		super().prepare()
+		self._operators = []
+		self._accumulators = []
+	def _pre_send(self, segment_index):
+		store = self._segments
+		operators = self._operators
+		while len(operators) < len(store.op_names):
+			op = self.operators[store.op_names[len(operators)]](self.item_mask)
+			operators.append(op)
+			if op.accumulates:
+				self._accumulators.append(op)
+		accumulators = self._accumulators
+		for op in accumulators:
+			op.reset()
+		data = store.data
+		ops = store.ops
+		data_received = self._data_received
+		start = store.starts[segment_index]
+		data_to_send = []
+		for i in range(store.starts[segment_index + 1] - start):
+			op = ops[start + i]
+			if op == 0:
+				item = data[start + i]
+			else:
+				item = operators[op - 1].value(i, data_received)
+			data_to_send.append(item)
+			for accumulator in accumulators:
+				accumulator.update(item)
+		return data_to_send
+
 class BytesCommandSegment:
 	"""Describes how to carry out one segment of the communication for byte-sequence protocols.
 	"""
+	__slots__ = ("data",)
 	@classmethod
 	def from_string(cls, text):
 		"""Creates a `BytesCommandSegment` from one of the dash-separated parts of a text command.
 		"""
-		return cls(_sequence_from_hex_string(text, 2))
+		return cls(_sequence_from_hex_string(text, 2, BYTE_OPERATORS))
 	def __init__(self, data):
 		self.data = data
 	#def __str__():
@@ -296,51 +561,31 @@ class BytesCommandSegment:
 class BytesResultSegment(BaseResultSegment):
 	"""Describes the result of one segment of the communication for byte-sequence protocols.
 	"""
+	__slots__ = ()
 	null_value = []
 	def str_data(self):
 		hex_parts = ["%02X" % b for b in self.data]
 		return "".join(hex_parts)
 
-class BytesDigiROM(BaseDigiROM):
+class BytesDigiROM(BaseSequenceDigiROM):
 	"""Describes the communication for byte-sequence protocols and records the results.
 	"""
 	command_segment_class = BytesCommandSegment
 	result_segment_class = BytesResultSegment
-	def _pre_send(self, segment):
-		data_to_send = []
-		for i in range(len(segment.data)):
-			item = segment.data[i]
-			if item == "++":
-				b = sum(data_to_send[:i]) % 0x100
-			elif item == "^^":
-				b = 0
-				for b2 in data_to_send[:i]:
-					b ^= b2
-			elif item == "+?":
-				b = checksum_datalink(data_to_send[:i])
-			elif item == "__":
-				try:
-					b = self._data_received[i]
-				except:
-					b = 0
-			elif item == ">>":
-				try:
-					b = self._data_received[i-1]
-				except:
-					b = 0
-			else:
-				b = item
-			data_to_send.append(b)
-		return data_to_send
+	operators = BYTE_OPERATORS
+	item_mask = 0xFF
+	def _new_segment_store(self):
+		return SequenceSegmentStore("B")
 
 class WordsCommandSegment:
 	"""Describes how to carry out one segment of the communication for word-sequence protocols.
 	"""
+	__slots__ = ("data",)
 	@classmethod
 	def from_string(cls, text):
 		"""Creates a `WordsCommandSegment` from one of the dash-separated parts of a text command.
 		"""
-		return cls(_sequence_from_hex_string(text, 4))
+		return cls(_sequence_from_hex_string(text, 4, WORD_OPERATORS))
 	def __init__(self, data):
 		self.data = data
 	#def __str__():
@@ -348,28 +593,18 @@ class WordsCommandSegment:
 class WordsResultSegment(BaseResultSegment):
 	"""Describes the result of one segment of the communication for word-sequence protocols.
 	"""
+	__slots__ = ()
 	null_value = []
 	def str_data(self):
 		hex_parts = ["%04X" % b for b in self.data]
 		return "".join(hex_parts)
 
-class WordsDigiROM(BaseDigiROM):
+class WordsDigiROM(BaseSequenceDigiROM):
 	"""Describes the communication for word-sequence protocols and records the results.
 	"""
 	command_segment_class = WordsCommandSegment
 	result_segment_class = WordsResultSegment
-	def _pre_send(self, segment):
-		data_to_send = []
-		for i in range(len(segment.data)):
-			item = segment.data[i]
-			if item == "++++":
-				w = sum(data_to_send[:i]) % 0x10000
-			elif item == "____":
-				try:
-					w = self._data_received[i]
-				except:
-					w = 0
-			else:
-				w = item
-			data_to_send.append(w)
-		return data_to_send
+	operators = WORD_OPERATORS
+	item_mask = 0xFFFF
+	def _new_segment_store(self):
+		return SequenceSegmentStore("H")
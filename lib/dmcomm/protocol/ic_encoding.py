@@ -7,39 +7,156 @@
 Handles conversion between 16-bit values and IR sequences for iC protocol.
 """
 
+from array import array
+
 START_SEQUENCE = [0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xC0,0xFF,0x13,0x70,0x70]
 
-def redundancy_bits(x):
-	"Calculates the 16 redundancy bits for 16 bits of data."
-	result = 0x79B4
+_START_SEQUENCE_BYTES = bytes(START_SEQUENCE)
+
+def _make_redundancy_tables():
+	"""Builds the lookup tables for `redundancy_bits`.
+
+	The code is linear apart from the initial value, so the contribution of each data byte can be looked up separately.
+	"""
+	table_low = array("H", [0] * 256)
+	table_high = array("H", [0] * 256)
+	masks = []
 	mask = 0x19D8
 	for i in range(16):
-		if x & 1:
-			result ^= mask
-		x >>= 1
+		masks.append(mask)
 		mask <<= 1
 		if mask >= 0x10000:
 			mask ^= 0x10811
-	return result
+	for x in range(256):
+		for i in range(8):
+			if x & (1 << i):
+				table_low[x] ^= masks[i]
+				table_high[x] ^= masks[i + 8]
+	return (table_low, table_high)
 
-def encode(x):
-	"Calculates the byte sequence for 16 bits of data."
+_REDUNDANCY_LOW, _REDUNDANCY_HIGH = _make_redundancy_tables()
+
+#: Second byte of the escape sequence for each byte which needs escaping, otherwise 0.
+_ESCAPE = bytearray(256)
+_ESCAPE[0xC0] = 0xE0
+_ESCAPE[0xC1] = 0xE1
+_ESCAPE[0x7D] = 0x5D
+
+#: Reverse of `_ESCAPE`: the byte represented by each escape sequence, otherwise 0.
+_UNESCAPE = bytearray(256)
+for _i in range(256):
+	if _ESCAPE[_i] != 0:
+		_UNESCAPE[_ESCAPE[_i]] = _i
+del _i
+
+def redundancy_bits(x):
+	"Calculates the 16 redundancy bits for 16 bits of data."
+	return 0x79B4 ^ _REDUNDANCY_LOW[x & 0xFF] ^ _REDUNDANCY_HIGH[(x >> 8) & 0xFF]
+
+def encode_into(buffer, x):
+	"Appends the byte sequence for 16 bits of data to `buffer`, which can be a `bytearray` or list."
+	x &= 0xFFFF
 	r = redundancy_bits(x)
-	result = START_SEQUENCE[:]
-	for byte_ in [x & 0xFF, (x & 0xFF00) >> 8, r & 0xFF, (r & 0xFF00) >> 8]:
-		if byte_ == 0xC0:
-			result.append(0x7D)
-			result.append(0xE0)
-		elif byte_ == 0xC1:
-			result.append(0x7D)
-			result.append(0xE1)
-		elif byte_ == 0x7D:
-			result.append(0x7D)
-			result.append(0x5D)
+	buffer.extend(_START_SEQUENCE_BYTES)
+	for byte_ in (x & 0xFF, x >> 8, r & 0xFF, r >> 8):
+		escaped = _ESCAPE[byte_]
+		if escaped != 0:
+			buffer.append(0x7D)
+			buffer.append(escaped)
 		else:
-			result.append(byte_)
-	result.append(0xC1)
-	return result
+			buffer.append(byte_)
+	buffer.append(0xC1)
+	return buffer
+
+def encode(x):
+	"Calculates the byte sequence for 16 bits of data."
+	return encode_into([], x)
+
+def encode_many(values):
+	"Calculates the byte sequences for a list of 16-bit values, joined together in one `bytearray`."
+	buffer = bytearray()
+	for x in values:
+		encode_into(buffer, x)
+	return buffer
+
+_STAGE_PREAMBLE = 1
+_STAGE_START = 2
+_STAGE_DATA = 3
+_STAGE_DONE = 4
+
+class FrameDecoder:
+	"""Decodes the byte sequence for 16 bits of data one byte at a time, as the bytes arrive.
+
+	Accepts the same sequences as `decode`, but raises ValueError as soon as a bad byte arrives.
+	"""
+	def __init__(self):
+		self.reset()
+	def reset(self):
+		"""Prepares for a new sequence."""
+		#: True when the C1 terminator has been received and `value` is ready.
+		self.complete = False
+		#: The 16-bit value, or None.
+		self.value = None
+		self._stage = _STAGE_PREAMBLE
+		self._offset = 0
+		self._count_C0 = 0
+		self._start_index = len(START_SEQUENCE) - 4
+		self._escape = False
+		self._bytes4 = []
+	def feed(self, b):
+		"""Processes the next byte.
+
+		:returns: True if the sequence is complete, False otherwise.
+		:raises ValueError: If the sequence is invalid.
+		"""
+		offset = self._offset
+		self._offset += 1
+		stage = self._stage
+		if stage == _STAGE_DATA:
+			if self._escape:
+				unescaped = _UNESCAPE[b]
+				if unescaped == 0:
+					raise ValueError("bad escape sequence 7D %02X" % b)
+				self._bytes4.append(unescaped)
+				self._escape = False
+			elif b == 0x7D:
+				self._escape = True
+			elif b == 0xC1:
+				self._finish()
+				return True
+			else:
+				self._bytes4.append(b)
+			return False
+		if stage == _STAGE_PREAMBLE:
+			if b == 0xC0:
+				self._count_C0 += 1
+				if self._count_C0 > 10:
+					raise ValueError("more than 10 leading C0")
+				return False
+			if self._count_C0 < 5:
+				raise ValueError("less than 5 leading C0")
+			self._stage = _STAGE_START
+		if self._stage == _STAGE_START:
+			target = START_SEQUENCE[self._start_index]
+			if b != target:
+				raise ValueError("byte at position %d expected %02X, got %02X" % (offset, target, b))
+			self._start_index += 1
+			if self._start_index == len(START_SEQUENCE):
+				self._stage = _STAGE_DATA
+			return False
+		return True
+	def _finish(self):
+		bytes4 = self._bytes4
+		if len(bytes4) != 4:
+			raise ValueError("length not 4: " + str(bytes4))
+		x = bytes4[0] | (bytes4[1] << 8)
+		r = bytes4[2] | (bytes4[3] << 8)
+		r_calc = redundancy_bits(x)
+		if r_calc != r:
+			raise ValueError("redundancy bits for %04X expected %04X, got %04X" % (x, r_calc, r))
+		self._stage = _STAGE_DONE
+		self.value = x
+		self.complete = True
 
 def decode(bytes_, start_index=0):
 	offset = 0
@@ -76,16 +193,12 @@ def decode(bytes_, start_index=0):
 			if start_sequence_remaining == 0:
 				stage = 3
 		elif b1 == 0x7D:
-			if b2 == 0xE0:
-				bytes4.append(0xC0)
-			elif b2 == 0xE1:
-				bytes4.append(0xC1)
-			elif b2 == 0x5D:
-				bytes4.append(0x7D)
-			elif b2 is None:
+			if b2 is None:
 				raise ValueError("ended during escape sequence: " + str(bytes_))
-			else:
+			unescaped = _UNESCAPE[b2]
+			if unescaped == 0:
 				raise ValueError("bad escape sequence %02X %02X in %s" % (b1, b2, str(bytes_)))
+			bytes4.append(unescaped)
 			offset += 1
 		elif b1 == 0xC1:
 			if b2 == 0xFF:
@@ -102,3 +215,17 @@ def decode(bytes_, start_index=0):
 	if r_calc != r:
 		raise ValueError("redundancy bits for %04X expected %04X, got %04X" % (x, r_calc, r))
 	return (x, offset + 1)
+
+def decode_many(bytes_, start_index=0):
+	"""Decodes consecutive byte sequences, such as the output of `encode_many`.
+
+	:returns: A list of the 16-bit values.
+	:raises ValueError: If any of the sequences is invalid.
+	"""
+	results = []
+	i = start_index
+	while i < len(bytes_):
+		(x, count) = decode(bytes_, i)
+		results.append(x)
+		i += count
+	return results
@@ -0,0 +1,262 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Timing analysis of many `dmcomm.hardware.Capture` records at once, for V/X/Y and DL/FL.
+# The records of each signal type in a file are loaded into a 2-D array with one row per packet,
+# and decoded with array operations using the thresholds from `ClassicParams` and `ModulatedParams`,
+# giving the same results as the decoders on the device.
+# Prints JSON with, for each file and signal type, how many packets decoded and the first field out of tolerance
+# in the others, then for each field: the range of durations, a histogram, and the margin to the nearest limit,
+# which is negative when out of tolerance. Keeping the captures from each toy in its own file shows drift per toy.
+# Needs numpy. Run from the repository root: python utils/analyze.py <capture file> [...] [--bin-us 50]
+
+import argparse
+import json
+import os
+import sys
+import time
+import types
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "lib"))
+
+# The hardware modules are imported by the communicator modules but not used here.
+for name in ["digitalio", "pulseio", "rp2pio", "supervisor"]:
+	sys.modules.setdefault(name, types.ModuleType(name))
+
+from dmcomm.hardware.capture import scan_records
+from dmcomm.hardware.comms.classic import ClassicParams
+from dmcomm.hardware.comms.modulated import ModulatedParams
+
+SIGNAL_TYPES = ["V", "X", "Y", "DL", "FL"]
+
+#: For fields with no maximum.
+_NO_MAX = np.iinfo(np.int32).max
+
+#: Index into `Analysis.error_names` for packets with too few durations.
+INCOMPLETE = 0
+
+#: Durations in each V/X/Y packet, starting with the pre-active.
+CLASSIC_LENGTH = 35
+
+def index_records(data):
+	"""Finds the records in `data` in one pass.
+
+	:returns: {signal type: (starts, lengths)}, as int64 arrays of the start of the durations of each record
+		and the number of them.
+	"""
+	found = {}
+	for (signal_type, flags, time_ms, start, count) in scan_records(data):
+		(starts, counts) = found.setdefault(signal_type, ([], []))
+		starts.append(start)
+		counts.append(count)
+	return {signal_type: (np.array(starts, dtype=np.int64), np.array(counts, dtype=np.int64))
+		for (signal_type, (starts, counts)) in found.items()}
+
+def load(data, starts, lengths, width=None):
+	"""Returns the durations of the records found by `index_records` as a 2-D int32 array.
+
+	There is one row per record, padded with zeros, cut to `width` if given.
+	"""
+	if width is None:
+		width = int(lengths.max()) if len(lengths) != 0 else 0
+	raw = np.frombuffer(data, dtype=np.uint8)
+	columns = np.arange(width)
+	present = columns < lengths[:, None]
+	index = np.where(present, starts[:, None] + 2 * columns, 0)
+	durations = raw[index].astype(np.int32) | (raw[index + 1].astype(np.int32) << 8)
+	durations[~present] = 0
+	return durations
+
+class Analysis:
+	"""Results of decoding one array of packets.
+
+	:param signal_type: The signal type.
+	:param field_names: Name of each field, in the order they arrive.
+	"""
+	def __init__(self, signal_type, field_names):
+		self.signal_type = signal_type
+		#: "incomplete", then the field names.
+		self.error_names = ["incomplete"] + field_names
+		#: For each packet, -1 if it decoded, otherwise the index into `error_names` of the first problem.
+		self.errors = None
+		#: For V/X/Y, the 16-bit result for each packet. For DL/FL, a 2-D array of bytes.
+		self.words = None
+		#: For DL/FL, the number of bytes in each row of `words`.
+		self.byte_counts = None
+		#: Field name: (durations, margins, minimum, maximum), for every duration of that field received.
+		self.fields = {}
+	def _add_field(self, name, durations, present, minimum, maximum):
+		values = durations[present]
+		margins = np.minimum(values - minimum, maximum - values)
+		self.fields[name] = (values, margins, minimum, None if maximum == _NO_MAX else maximum)
+
+def _first_bad(bad):
+	"Column of the first True in each row of `bad`, or -1."
+	if bad.shape[1] == 0:
+		return np.full(len(bad), -1)
+	return np.where(bad.any(axis=1), bad.argmax(axis=1), -1)
+
+def analyze_classic(durations, lengths, params):
+	"""Decodes V/X/Y packets, one per row of `durations` starting with the pre-active, like `classic.decode`.
+
+	:param durations: At least `CLASSIC_LENGTH` columns, as from `load`.
+	:param lengths: Number of durations in each row.
+	:param params: The `ClassicParams`.
+	:returns: `Analysis`.
+	"""
+	analysis = Analysis(params.signal_type, ["pre_active", "start_idle", "start_active", "bit_idle", "bit_active"])
+	durations = durations[:, :CLASSIC_LENGTH]
+	columns = np.arange(CLASSIC_LENGTH)
+	field = np.full(CLASSIC_LENGTH, 4)
+	field[:3] = [0, 1, 2]
+	field[3::2] = 3
+	minimum = np.array([params.pre_active_min, params.start_idle_min, params.start_active_min,
+		params.bit_idle_min, params.bit_active_min])
+	maximum = np.array([_NO_MAX, params.start_idle_max, params.start_active_max,
+		params.bit_idle_max, params.bit_active_max])
+	# X stops partway through the last bit with some iC toys.
+	ic_bug = (lengths == CLASSIC_LENGTH - 1) if params.signal_type == "X" else np.zeros(len(lengths), dtype=bool)
+	incomplete = (lengths < CLASSIC_LENGTH) & ~ic_bug
+	present = columns < np.minimum(lengths, CLASSIC_LENGTH)[:, None]
+	bad = present & ((durations < minimum[field]) | (durations > maximum[field]))
+	first_bad = _first_bad(bad)
+	analysis.errors = np.where(incomplete, INCOMPLETE, np.where(first_bad == -1, -1, field[first_bad] + 1))
+	bits = (durations[:, 3::2] > params.bit_idle_threshold).astype(np.int32)
+	words = (bits << np.arange(16)).sum(axis=1)
+	if params.invert_bit_read:
+		words ^= 0xFFFF
+	analysis.words = words.astype(np.uint16)
+	for (i, name) in enumerate(analysis.error_names[1:]):
+		analysis._add_field(name, durations, present & (field == i), minimum[i], maximum[i])
+	return analysis
+
+def analyze_modulated(durations, lengths, params):
+	"""Decodes DL/FL packets, one per row of `durations`, like `modulated_shared.decode`.
+
+	The start and each bit are timed by the total of the pulse and the gap, and the stop by the pulse.
+
+	:param durations: As from `load`.
+	:param lengths: Number of durations in each row.
+	:param params: The `ModulatedParams`.
+	:returns: `Analysis`.
+	"""
+	analysis = Analysis(params.signal_type, ["start", "bit", "stop_pulse"])
+	(rows, width) = durations.shape
+	pairs = width // 2
+	totals = durations[:, 0:2 * pairs:2] + durations[:, 1:2 * pairs:2]
+	pair_present = 2 * np.arange(pairs) + 1 < lengths[:, None]
+	minimum = np.full(pairs, params.bit_min)
+	maximum = np.full(pairs, params.bit_max)
+	minimum[:1] = params.start_min
+	maximum[:1] = params.start_max
+	bad = pair_present & ((totals < minimum) | (totals > maximum))
+	first_bad = _first_bad(bad)
+	stop_pulse = durations[np.arange(rows), np.maximum(lengths - 1, 0)] if width != 0 else np.zeros(rows, dtype=np.int32)
+	bit_count = (lengths - 3) // 2
+	stop_bad = (stop_pulse < params.stop_pulse_min) | (stop_pulse > params.stop_pulse_max)
+	# Indexes into error_names: a bad pair is the start or a bit. Otherwise the end is checked,
+	# with the stop pulse before the bit count.
+	errors = np.where(first_bad == 0, 1, 2)
+	short = (lengths % 2 == 0) | (lengths == 1)
+	end_errors = np.where(short, INCOMPLETE, np.where(stop_bad, 3, np.where(bit_count % 8 != 0, INCOMPLETE, -1)))
+	errors = np.where(first_bad != -1, errors, end_errors)
+	# Nothing received isn't an error.
+	analysis.errors = np.where(lengths == 0, -1, errors)
+	ok = analysis.errors == -1
+	byte_max = max(pairs - 1, 0) // 8
+	bits = (totals[:, 1:1 + 8 * byte_max] > params.bit_threshold).reshape(rows, byte_max, 8).astype(np.int32)
+	if params.low_bit_first:
+		weights = 1 << np.arange(8)
+	else:
+		weights = 1 << np.arange(7, -1, -1)
+	words = (bits * weights).sum(axis=2).astype(np.uint8)
+	byte_counts = np.where(ok & (lengths != 0), bit_count // 8, 0)
+	if params.low_byte_first:
+		j = np.arange(byte_max)
+		index = np.where(j < byte_counts[:, None], byte_counts[:, None] - 1 - j, j)
+		words = np.take_along_axis(words, index, axis=1)
+	analysis.words = words
+	analysis.byte_counts = byte_counts
+	start_present = np.zeros_like(pair_present)
+	start_present[:, :1] = pair_present[:, :1]
+	analysis._add_field("start", totals, start_present, params.start_min, params.start_max)
+	analysis._add_field("bit", totals, pair_present & ~start_present, params.bit_min, params.bit_max)
+	analysis._add_field("stop_pulse", stop_pulse, (lengths % 2 == 1) & (lengths >= 3),
+		params.stop_pulse_min, params.stop_pulse_max)
+	return analysis
+
+def analyze(data, signal_type, index=None):
+	"""Loads and decodes the records of `signal_type` in `data`, returning an `Analysis`.
+
+	:param index: The result of `index_records`, to avoid finding the records again.
+	"""
+	if index is None:
+		index = index_records(data)
+	empty = np.zeros(0, dtype=np.int64)
+	(starts, lengths) = index.get(signal_type, (empty, empty))
+	if signal_type in ["V", "X", "Y"]:
+		durations = load(data, starts, lengths, CLASSIC_LENGTH)
+		return analyze_classic(durations, lengths, ClassicParams(signal_type))
+	durations = load(data, starts, lengths)
+	return analyze_modulated(durations, lengths, ModulatedParams(signal_type))
+
+def histogram(values, bin_us):
+	"Returns {start, bin_us, counts} for `values`, with bins starting at a multiple of `bin_us`."
+	if len(values) == 0:
+		return {"start": 0, "bin_us": bin_us, "counts": []}
+	start = int(values.min()) // bin_us * bin_us
+	counts = np.bincount((values - start) // bin_us)
+	return {"start": start, "bin_us": bin_us, "counts": counts.tolist()}
+
+def report(analysis, bin_us):
+	"Summarises an `Analysis` for JSON."
+	errors = analysis.errors
+	result = {
+		"packets": len(errors),
+		"decoded": int((errors == -1).sum()),
+		"errors": {name: int((errors == i).sum()) for (i, name) in enumerate(analysis.error_names)},
+		"fields": {},
+	}
+	for (name, (values, margins, minimum, maximum)) in analysis.fields.items():
+		summary = {"count": len(values), "min_allowed": int(minimum), "max_allowed": None if maximum is None else int(maximum)}
+		if len(values) != 0:
+			summary.update({
+				"min": int(values.min()),
+				"mean": round(float(values.mean()), 1),
+				"max": int(values.max()),
+				"min_margin": int(margins.min()),
+				"out_of_tolerance": int((margins < 0).sum()),
+				"histogram": histogram(values, bin_us),
+			})
+		result["fields"][name] = summary
+	return result
+
+def main():
+	parser = argparse.ArgumentParser(description="Analyses the timing of captured V/X/Y and DL/FL packets.")
+	parser.add_argument("files", nargs="+", help="capture files")
+	parser.add_argument("--bin-us", type=int, default=50, help="width of the histogram bins in microseconds")
+	parser.add_argument("--signal-types", nargs="*", default=SIGNAL_TYPES, help="signal types to analyse")
+	args = parser.parse_args()
+	results = {}
+	start = time.perf_counter()
+	packets = 0
+	for path in args.files:
+		with open(path, "rb") as f:
+			data = f.read()
+		results[path] = {}
+		index = index_records(data)
+		for signal_type in args.signal_types:
+			analysis = analyze(data, signal_type, index)
+			if len(analysis.errors) != 0:
+				results[path][signal_type] = report(analysis, args.bin_us)
+				packets += len(analysis.errors)
+	seconds = time.perf_counter() - start
+	print(json.dumps({
+		"packets": packets,
+		"packets_per_second": round(packets / seconds) if seconds > 0 else None,
+		"results": results,
+	}, indent=2))
+
+if __name__ == "__main__":
+	main()
@@ -78,6 +78,210 @@ delay_y:
 	jmp x-- delay_x
 """
 
+# Half-duplex pulses for Talis, on one pin. Run with 2MHz clock.
+# 1 set pin, 1 in pin and jmp pin which are all the same, initial_set_pin_direction=0 (input).
+# After restart, pulls 16-bit durations in microseconds, sending high then low alternately,
+# until a 0 duration. Then switches to input, pushes a 0 to show that sending has finished,
+# waits for the pin to go high, and pushes the high and low durations measured in microseconds.
+talis_half_duplex_ASM = """
+	pull
+	out x 16
+	jmp !x receive
+	set pindirs 1
+send_high:
+	set pins 1
+high:
+	jmp x-- high [1]
+	pull
+	out x 16
+	set pins 0
+low:
+	jmp x-- low [1]
+	pull
+	out x 16
+	jmp x-- send_high
+receive:
+	set pindirs 0
+	push noblock
+	wait 1 pin 0
+measure:
+	mov x ~null
+measure_high:
+	jmp pin still_high
+	jmp high_done
+still_high:
+	jmp x-- measure_high
+high_done:
+	mov isr ~x
+	push noblock
+	mov x ~null
+measure_low:
+	jmp pin low_done
+	jmp x-- measure_low
+low_done:
+	mov isr ~x
+	push noblock
+	jmp measure
+"""
+
+# Records pulses on an input which idles low, like PulseIn but with 32-bit durations. Run with 2MHz clock.
+# 1 in pin which is also the jmp pin. After restart, waits for the pin to go high,
+# then pushes the high and low durations measured in microseconds.
+pulse_RX_ASM = """
+	wait 1 pin 0
+measure:
+	mov x ~null
+measure_high:
+	jmp pin still_high
+	jmp high_done
+still_high:
+	jmp x-- measure_high
+high_done:
+	mov isr ~x
+	push noblock
+	mov x ~null
+measure_low:
+	jmp pin low_done
+	jmp x-- measure_low
+low_done:
+	mov isr ~x
+	push noblock
+	jmp measure
+"""
+
+# Receives the bytes sent by iC_TX or xloader_TX on the raw IR input, which idles high.
+# Run with a clock of 40 cycles per tick: 400kHz for iC, 2333720 for Xros Loader.
+# 1 in pin which is also the jmp pin. Shifts right, without autopush.
+# Each byte is a start pulse, then a slot for each bit from LSB to MSB, 1 tick apart, where a pulse means 0.
+# Each slot is watched for a pulse starting in the 36 cycles around where it is due. The window starts
+# half a tick after the last pulse started, or 40 cycles after the last window started if that had no pulse,
+# so the timing follows the sender. If the last pulse is still going, the window waits for it to end.
+# Pushes each byte in the lowest 8 bits.
+_bytes_RX_ASM = """
+start:
+	wait 0 pin 0
+	set x 7
+found:
+	nop [17]
+bit:
+	set y 17
+still_low:
+	jmp pin window
+	jmp y-- still_low
+	jmp no_pulse
+window:
+	jmp pin idle
+	in null 1
+	jmp x-- found
+	jmp done
+idle:
+	jmp y-- window
+no_pulse:
+	in y 1
+	jmp x-- bit
+done:
+	wait 1 pin 0
+	in null 24
+	push noblock
+	jmp start
+"""
+
+# For iC, first skips to a gap of at least 2.5 ticks, since receiving may start partway through a byte.
+# See _bytes_RX_ASM.
+iC_RX_ASM = """
+	wait 0 pin 0
+sync_pulse:
+	wait 1 pin 0
+	set y 24
+sync_gap:
+	jmp pin sync_high
+	jmp sync_pulse
+sync_high:
+	jmp y-- sync_gap [2]
+""" + _bytes_RX_ASM
+
+# For Xros Loader, bytes start from the first pulse. See _bytes_RX_ASM.
+xloader_RX_ASM = _bytes_RX_ASM
+
+# Receives V/X packets on the prong input, which idles high. Run with 2MHz clock.
+# 1 in pin which is also the jmp pin. Shifts right, without autopush or autopull, pull threshold 32.
+# After restart, pulls pre_active_min then bit_idle_threshold, both in microseconds.
+# Waits for an active period of at least pre_active_min, and pushes when it ends.
+# Skips the start idle and start active periods. Then for each bit, an idle period longer than
+# bit_idle_threshold is a 1, and the OSR counts 16 bits after the threshold is taken out of it.
+# Pushes the bits in the top 16 bits of the word as the last active period starts,
+# and pushes again when it ends.
+classic_RX_idle_high_ASM = """
+	pull
+	mov isr osr
+	pull
+	out y 16
+pre_active:
+	wait 1 pin 0
+	wait 0 pin 0
+	mov x isr
+pre_active_loop:
+	jmp pin pre_active
+	jmp x-- pre_active_loop
+	wait 1 pin 0
+	push noblock
+	wait 0 pin 0
+next_bit:
+	wait 1 pin 0
+	mov x y
+idle_loop:
+	jmp pin still_idle
+	in null 1
+	jmp counted
+still_idle:
+	jmp x-- idle_loop
+	in x 1
+	wait 0 pin 0
+counted:
+	out null 1
+	jmp !osre next_bit
+	push noblock
+	wait 1 pin 0
+	push noblock
+"""
+
+# The same as classic_RX_idle_high, for Y where the prong input idles low.
+classic_RX_idle_low_ASM = """
+	pull
+	mov isr osr
+	pull
+	out y 16
+pre_active:
+	wait 0 pin 0
+	wait 1 pin 0
+	mov x isr
+pre_active_loop:
+	jmp pin still_active
+	jmp pre_active
+still_active:
+	jmp x-- pre_active_loop
+	wait 0 pin 0
+	push noblock
+	wait 1 pin 0
+next_bit:
+	wait 0 pin 0
+	mov x y
+idle_loop:
+	jmp pin active_started
+	jmp x-- idle_loop
+	in x 1
+	wait 1 pin 0
+	jmp counted
+active_started:
+	in null 1
+counted:
+	out null 1
+	jmp !osre next_bit
+	push noblock
+	wait 0 pin 0
+	push noblock
+"""
+
 this_file_name = os.path.basename(__file__)
 
 output_text = f"""# This file is part of the DMComm project by BladeSabre. License: MIT.
@@ -90,6 +294,18 @@ prong_TX = {repr(adafruit_pioasm.assemble(prong_TX_ASM))}
 iC_TX = {repr(adafruit_pioasm.assemble(iC_TX_ASM))}
 
 xloader_TX = {repr(adafruit_pioasm.assemble(xloader_TX_ASM))}
+
+talis_half_duplex = {repr(adafruit_pioasm.assemble(talis_half_duplex_ASM))}
+
+pulse_RX = {repr(adafruit_pioasm.assemble(pulse_RX_ASM))}
+
+iC_RX = {repr(adafruit_pioasm.assemble(iC_RX_ASM))}
+
+xloader_RX = {repr(adafruit_pioasm.assemble(xloader_RX_ASM))}
+
+classic_RX_idle_high = {repr(adafruit_pioasm.assemble(classic_RX_idle_high_ASM))}
+
+classic_RX_idle_low = {repr(adafruit_pioasm.assemble(classic_RX_idle_low_ASM))}
 """
 
 if __name__ == "__main__":
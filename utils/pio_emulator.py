@@ -0,0 +1,438 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Cycle-accurate emulator of an RP2040 PIO state machine, for checking the programs in `pio_programs`
+# under desktop Python.
+#
+# Example:
+#	import pio_emulator
+#	pio_programs = pio_emulator.load_programs()
+#	sm = pio_emulator.StateMachine(pio_programs.iC_TX, 100_000, first_out_pin=0, first_set_pin=0)
+#	sm.write(b"\x12")
+#	sm.run_until_idle()
+#	print(sm.edges(0, pull=False))
+#
+# Pins are numbered like GPIOs, so the in/out/set pins can be counted from the first one.
+# Inputs are given as timed edges with `drive_input`. Outputs are recorded as timed edges,
+# which can be fed into the input of another state machine.
+# Not supported: side-set, IRQ, EXEC, and the STATUS source (which always reads 0, as with the default setup).
+
+import bisect
+import collections
+import os
+
+_MASK = 0xFFFFFFFF
+
+def load_programs(path=None):
+	"""Returns the `pio_programs` module, loaded from its file so that `dmcomm.hardware` is not imported.
+
+	:param path: The file to load. Defaults to the one in this repository.
+	"""
+	import importlib.util
+	if path is None:
+		root = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+		path = os.path.join(root, "lib", "dmcomm", "hardware", "pio_programs.py")
+	spec = importlib.util.spec_from_file_location("pio_programs", path)
+	module = importlib.util.module_from_spec(spec)
+	spec.loader.exec_module(module)
+	return module
+
+def _reverse_bits(value):
+	result = 0
+	for _ in range(32):
+		result = (result << 1) | (value & 1)
+		value >>= 1
+	return result
+
+class _Input:
+	"""Level of an input pin over time, from a list of edges."""
+	def __init__(self, edges, initial):
+		self.times = [time_us for (time_us, level) in edges]
+		self.levels = [bool(level) for (time_us, level) in edges]
+		self.initial = bool(initial)
+	def level_at(self, time_us):
+		i = bisect.bisect_right(self.times, time_us)
+		return self.initial if i == 0 else self.levels[i - 1]
+	def next_edge_after(self, time_us):
+		i = bisect.bisect_right(self.times, time_us)
+		return self.times[i] if i < len(self.times) else None
+
+class StateMachine:
+	"""Emulates one PIO state machine running `program`, one clock cycle at a time.
+
+	The arguments are the same as for `rp2pio.StateMachine`, apart from the pins being numbers.
+	Set and out pins start as outputs unless the initial direction says otherwise.
+
+	:param program: The assembled program, as in `pio_programs`.
+	:param frequency: The state machine clock frequency in Hz.
+	"""
+	FIFO_DEPTH = 4
+	def __init__(self, program, frequency, *,
+			first_out_pin=None, out_pin_count=1, initial_out_pin_state=0, initial_out_pin_direction=_MASK,
+			first_set_pin=None, set_pin_count=1, initial_set_pin_state=0, initial_set_pin_direction=0x1F,
+			first_in_pin=None, in_pin_count=1, jmp_pin=None,
+			in_shift_right=True, out_shift_right=True,
+			auto_push=False, push_threshold=32, auto_pull=False, pull_threshold=32,
+			wrap_target=0, wrap=-1, **kwargs):
+		if kwargs.get("first_sideset_pin") is not None:
+			raise NotImplementedError("side-set")
+		self.program = list(program)
+		if len(self.program) > 32:
+			raise ValueError("program too long")
+		self.frequency = frequency
+		self.cycle_us = 1_000_000 / frequency
+		self.first_out_pin = first_out_pin
+		self.out_pin_count = out_pin_count
+		self.first_set_pin = first_set_pin
+		self.set_pin_count = set_pin_count
+		self.first_in_pin = first_in_pin
+		self.in_pin_count = in_pin_count
+		self.jmp_pin = jmp_pin
+		self.in_shift_right = in_shift_right
+		self.out_shift_right = out_shift_right
+		self.auto_push = auto_push
+		self.push_threshold = push_threshold
+		self.auto_pull = auto_pull
+		self.pull_threshold = pull_threshold
+		self.wrap_target = wrap_target
+		self.wrap = wrap if wrap >= 0 else len(self.program) - 1
+		self.cycles = 0  #: Clock cycles run so far.
+		self.stalled_cycles = 0  #: Cycles spent stalled on wait, pull or push.
+		self.pushed = []  #: (time_us, word) for everything pushed, including anything dropped.
+		self._inputs = {}
+		self._values = {}  # pin: output value
+		self._directions = {}  # pin: True for output
+		self._edges = collections.defaultdict(list)  # pin: [(time_us, driven level or None)]
+		self._tx = collections.deque()
+		self._rx = collections.deque()
+		self._pending = collections.deque()  # written but not yet in the TX FIFO
+		self.x = 0
+		self.y = 0
+		self.isr = 0
+		self.osr = 0
+		for (first, count, state, direction) in [
+			(first_out_pin, out_pin_count, initial_out_pin_state, initial_out_pin_direction),
+			(first_set_pin, set_pin_count, initial_set_pin_state, initial_set_pin_direction),
+		]:
+			if first is not None:
+				self._write_pins(first, count, state, self._values)
+				self._write_pins(first, count, direction, self._directions)
+		self.restart()
+	@property
+	def time_us(self):
+		"""Time since the start, in microseconds."""
+		return self.cycles * self.cycle_us
+	def restart(self):
+		"""Goes back to the start of the program and empties the shift registers, like `rp2pio.StateMachine.restart`."""
+		self.pc = 0
+		self.isr = 0
+		self.isr_count = 0
+		self.osr_count = 32
+		self._delay = 0
+	def drive_input(self, pin, edges, initial=False):
+		"""Sets the level of an input pin over time.
+
+		:param edges: List of (time_us, level) in order, such as from `edges`.
+		:param initial: The level before the first edge.
+		"""
+		self._inputs[pin] = _Input(edges, initial)
+	def edges(self, pin, pull=None):
+		"""Returns the recorded output as a list of (time_us, level), starting from the initial state.
+
+		:param pull: The level when the pin is not an output, or None to give None for that.
+		"""
+		result = []
+		for (time_us, level) in self._edges[pin]:
+			if level is None:
+				level = pull
+			if result == [] or result[-1][1] != level:
+				result.append((time_us, level))
+		return result
+	def pulses(self, pin, pull=None):
+		"""Returns the durations between the recorded edges of `pin` in microseconds."""
+		edges = self.edges(pin, pull)
+		return [edges[i + 1][0] - edges[i][0] for i in range(len(edges) - 1)]
+	def write(self, buffer):
+		"""Queues words for the TX FIFO. They go in as the program makes space."""
+		self._pending.extend(buffer)
+		self._fill_tx()
+	@property
+	def in_waiting(self):
+		"""Number of words in the RX FIFO."""
+		return len(self._rx)
+	def read(self):
+		"""Takes one word from the RX FIFO."""
+		return self._rx.popleft()
+	def readinto(self, buffer, *, start=0, end=None):
+		if end is None:
+			end = len(buffer)
+		for i in range(start, end):
+			buffer[i] = self._rx.popleft()
+	def clear_rxfifo(self):
+		self._rx.clear()
+	@property
+	def pending(self):
+		"""Number of words written which the program hasn't taken yet."""
+		return len(self._pending) + len(self._tx)
+	def run(self, cycles):
+		"""Runs for the number of clock cycles given."""
+		end_cycle = self.cycles + cycles
+		while self.cycles < end_cycle:
+			self._step(end_cycle)
+	def run_until(self, time_us):
+		"""Runs until the time given, in microseconds since the start."""
+		end_cycle = -int(-time_us // self.cycle_us)
+		self.run(end_cycle - self.cycles)
+	def run_until_idle(self, max_cycles=100_000_000):
+		"""Runs until everything written has been taken and the program is stalled on a pull.
+
+		:returns: The time in microseconds.
+		"""
+		end_cycle = self.cycles + max_cycles
+		while not (self.pending == 0 and self._stalled_on_pull()):
+			if self.cycles >= end_cycle:
+				raise RuntimeError("still running after %d cycles" % max_cycles)
+			self._step(end_cycle)
+		return self.time_us
+	def _stalled_on_pull(self):
+		instruction = self.program[self.pc]
+		if self._tx or self._delay != 0:
+			return False
+		opcode = instruction >> 13
+		if opcode == 3:
+			return self.auto_pull and self.osr_count >= self.pull_threshold
+		if opcode != 4 or not instruction & 0x80 or not instruction & 0x20:
+			return False
+		return not (instruction & 0x40 and self.osr_count < self.pull_threshold)
+	def _fill_tx(self):
+		while self._pending and len(self._tx) < self.FIFO_DEPTH:
+			self._tx.append(self._pending.popleft() & _MASK)
+	def _pin_level(self, pin):
+		if self._directions.get(pin):
+			return bool(self._values.get(pin, 0))
+		source = self._inputs.get(pin)
+		if source is None:
+			return False
+		return source.level_at(self.time_us)
+	def _read_pins(self, first, count):
+		value = 0
+		for i in range(count):
+			value |= self._pin_level(first + i) << i
+		return value
+	def _write_pins(self, first, count, value, target):
+		for i in range(count):
+			target[first + i] = (value >> i) & 1
+		for i in range(count):
+			self._record(first + i)
+	def _record(self, pin):
+		if pin not in self._directions:
+			return
+		level = bool(self._values.get(pin, 0)) if self._directions[pin] else None
+		edges = self._edges[pin]
+		if edges == [] or edges[-1][1] != level:
+			edges.append((self.time_us, level))
+	def _next_input_cycle(self, pin):
+		"The cycle where `pin` may next change, or None if it won't."
+		if self._directions.get(pin) or pin not in self._inputs:
+			return None
+		time_us = self._inputs[pin].next_edge_after(self.time_us)
+		if time_us is None:
+			return None
+		return max(self.cycles + 1, -int(-time_us // self.cycle_us))
+	def _stall(self, end_cycle, skip_to=None):
+		# Nothing changes until the input does, so jump ahead.
+		if skip_to is None or skip_to > end_cycle:
+			skip_to = end_cycle
+		cycles = max(1, skip_to - self.cycles)
+		self.cycles += cycles
+		self.stalled_cycles += cycles
+	def _push(self, blocking):
+		if len(self._rx) < self.FIFO_DEPTH:
+			self._rx.append(self.isr)
+		elif blocking:
+			return False
+		self.pushed.append((self.time_us, self.isr))
+		self.isr = 0
+		self.isr_count = 0
+		return True
+	def _pull(self, blocking):
+		self._fill_tx()
+		if self._tx:
+			self.osr = self._tx.popleft()
+		elif blocking:
+			return False
+		else:
+			self.osr = self.x
+		self.osr_count = 0
+		self._fill_tx()
+		return True
+	def _shift_in(self, value, count):
+		value &= (1 << count) - 1
+		if count == 32:
+			self.isr = value
+		elif self.in_shift_right:
+			self.isr = (self.isr >> count) | (value << (32 - count))
+		else:
+			self.isr = ((self.isr << count) | value) & _MASK
+		self.isr_count = min(self.isr_count + count, 32)
+	def _shift_out(self, count):
+		if count == 32:
+			value = self.osr
+			self.osr = 0
+		elif self.out_shift_right:
+			value = self.osr & ((1 << count) - 1)
+			self.osr >>= count
+		else:
+			value = self.osr >> (32 - count)
+			self.osr = (self.osr << count) & _MASK
+		self.osr_count = min(self.osr_count + count, 32)
+		return value
+	def _source(self, source):
+		if source == 0:
+			return self._read_pins(self.first_in_pin, 32 if self.first_in_pin is not None else 0)
+		if source == 1:
+			return self.x
+		if source == 2:
+			return self.y
+		if source == 3 or source == 5:
+			return 0
+		if source == 6:
+			return self.isr
+		if source == 7:
+			return self.osr
+		raise ValueError("reserved source")
+	def _destination(self, destination, value, count=32):
+		if destination == 0:
+			self._write_pins(self.first_out_pin, min(count, self.out_pin_count), value, self._values)
+		elif destination == 1:
+			self.x = value & _MASK
+		elif destination == 2:
+			self.y = value & _MASK
+		elif destination == 3:
+			pass
+		elif destination == 4:
+			self._write_pins(self.first_out_pin, min(count, self.out_pin_count), value, self._directions)
+		elif destination == 5:
+			return value & 31
+		else:
+			raise NotImplementedError("destination %d" % destination)
+		return None
+	def _step(self, end_cycle):
+		if self._delay != 0:
+			self._delay -= 1
+			self.cycles += 1
+			return
+		instruction = self.program[self.pc]
+		opcode = instruction >> 13
+		delay = (instruction >> 8) & 0x1F
+		arg1 = (instruction >> 5) & 0x7
+		arg2 = instruction & 0x1F
+		next_pc = self.wrap_target if self.pc == self.wrap else self.pc + 1
+		if opcode == 0:  # JMP
+			if arg1 == 0:
+				taken = True
+			elif arg1 == 1:
+				taken = self.x == 0
+			elif arg1 == 2:
+				taken = self.x != 0
+				self.x = (self.x - 1) & _MASK
+			elif arg1 == 3:
+				taken = self.y == 0
+			elif arg1 == 4:
+				taken = self.y != 0
+				self.y = (self.y - 1) & _MASK
+			elif arg1 == 5:
+				taken = self.x != self.y
+			elif arg1 == 6:
+				taken = self._pin_level(self.jmp_pin)
+			else:
+				taken = self.osr_count < self.pull_threshold
+			if taken:
+				next_pc = arg2
+		elif opcode == 1:  # WAIT
+			polarity = arg1 >> 2
+			source = arg1 & 3
+			if source == 0:
+				pin = arg2
+			elif source == 1:
+				pin = self.first_in_pin + arg2
+			else:
+				raise NotImplementedError("wait irq")
+			if self._pin_level(pin) != polarity:
+				self._stall(end_cycle, self._next_input_cycle(pin))
+				return
+		elif opcode == 2:  # IN
+			count = arg2 or 32
+			if self.auto_push and self.isr_count >= self.push_threshold:
+				if not self._push(True):
+					self._stall(end_cycle)
+					return
+			self._shift_in(self._source(arg1), count)
+			if self.auto_push and self.isr_count >= self.push_threshold:
+				self._push(False)
+		elif opcode == 3:  # OUT
+			count = arg2 or 32
+			if self.auto_pull and self.osr_count >= self.pull_threshold:
+				if not self._pull(True):
+					self._stall(end_cycle)
+					return
+			if arg1 == 7:
+				raise NotImplementedError("out exec")
+			if arg1 == 6:
+				self._shift_in(self._shift_out(count), count)
+			else:
+				new_pc = self._destination(arg1, self._shift_out(count), count)
+				if new_pc is not None:
+					next_pc = new_pc
+		elif opcode == 4:  # PUSH / PULL
+			blocking = bool(instruction & 0x20)
+			if not instruction & 0x80:
+				if not (instruction & 0x40 and self.isr_count < self.push_threshold):
+					if not self._push(blocking):
+						self._stall(end_cycle)
+						return
+			else:
+				if not (instruction & 0x40 and self.osr_count < self.pull_threshold):
+					if not self._pull(blocking):
+						skip_to = None if self._pending else end_cycle
+						self._stall(end_cycle, skip_to)
+						return
+		elif opcode == 5:  # MOV
+			destination = arg1
+			operation = (instruction >> 3) & 3
+			value = self._source(instruction & 7)
+			if operation == 1:
+				value = ~value & _MASK
+			elif operation == 2:
+				value = _reverse_bits(value)
+			if destination == 0:
+				self._write_pins(self.first_out_pin, self.out_pin_count, value, self._values)
+			elif destination == 1:
+				self.x = value
+			elif destination == 2:
+				self.y = value
+			elif destination == 5:
+				next_pc = value & 31
+			elif destination == 6:
+				self.isr = value
+				self.isr_count = 0
+			elif destination == 7:
+				self.osr = value
+				self.osr_count = 0
+			else:
+				raise NotImplementedError("mov exec")
+		elif opcode == 6:
+			raise NotImplementedError("irq")
+		else:  # SET
+			if arg1 == 0:
+				self._write_pins(self.first_set_pin, self.set_pin_count, arg2, self._values)
+			elif arg1 == 1:
+				self.x = arg2
+			elif arg1 == 2:
+				self.y = arg2
+			elif arg1 == 4:
+				self._write_pins(self.first_set_pin, self.set_pin_count, arg2, self._directions)
+			else:
+				raise ValueError("reserved set destination")
+		self.cycles += 1
+		self.pc = next_pc
+		self._delay = delay
@@ -0,0 +1,115 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Replays records from `dmcomm.hardware.Capture` through the decoders, as fast as they will go.
+# For each record, prints the signal type, the time it was captured, the number of durations,
+# how long decoding took, and the result or error. Records which decode differently from on the device
+# (an error there but not here, or the other way round) are marked "changed", and the exit status is 1 if any are.
+# Run from the repository root: python utils/replay.py <capture file> [...]
+
+import argparse
+import os
+import sys
+import time
+import types
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "lib"))
+
+# The hardware modules are imported by the communicator modules but not used by the decoders.
+for name in ["digitalio", "pulseio", "rp2pio", "supervisor"]:
+	sys.modules.setdefault(name, types.ModuleType(name))
+
+from dmcomm import ReceiveError
+import dmcomm.protocol
+from dmcomm.hardware.capture import FLAG_ERROR, FLAG_TRUNCATED, read_records
+from dmcomm.hardware.comms import classic, color, ic, modulated, modulated_shared, talis, xloader
+from dmcomm.hardware.sniffer import Durations
+
+def _decode_xloader(pulses, params):
+	return xloader.decode_bytes(pulses, len(pulses), params)
+
+# Signal type: (params class, decode function taking the durations and the params)
+DECODERS = {
+	"V": (classic.ClassicParams, classic.decode),
+	"X": (classic.ClassicParams, classic.decode),
+	"Y": (classic.ClassicParams, classic.decode),
+	"C": (color.ColorParams, color.decode),
+	"IC": (ic.iC_Params, ic.decode),
+	"DL": (modulated.ModulatedParams, modulated_shared.decode),
+	"FL": (modulated.ModulatedParams, modulated_shared.decode),
+	"LT": (talis.TalisParams, modulated_shared.decode),
+	"!XL": (xloader.XLoaderParams, _decode_xloader),
+}
+
+class Replayer:
+	"""Decodes `CaptureRecord` objects, keeping the params and buffer for each signal type."""
+	def __init__(self):
+		self._params = {}
+		self._durations = Durations(0)
+	def decode(self, record):
+		"""Returns (data, error) for `record`, where error is the `ReceiveError` or None.
+
+		:raises KeyError: If there is no decoder for the signal type.
+		"""
+		(params_class, decode) = DECODERS[record.signal_type]
+		params = self._params.get(record.signal_type)
+		if params is None:
+			params = params_class(record.signal_type)
+			self._params[record.signal_type] = params
+		durations = self._durations
+		if durations.maxlen < len(record.durations):
+			durations = Durations(len(record.durations))
+			self._durations = durations
+		durations.clear()
+		for duration in record.durations:
+			durations.append(duration)
+		try:
+			return (decode(durations, params), None)
+		except ReceiveError as e:
+			return (None, e)
+
+def format_data(signal_type, data):
+	"Formats `data` like a received segment of a result."
+	segment_class = dmcomm.protocol.parse_command(signal_type + "0").result_segment_class
+	return str(segment_class(False, data))
+
+def main():
+	parser = argparse.ArgumentParser(description="Replays captures through the decoders.")
+	parser.add_argument("files", nargs="+", help="capture files")
+	parser.add_argument("--repeat", type=int, default=1, help="decode each record this many times, for timing")
+	parser.add_argument("--quiet", action="store_true", help="only print the summary and changed records")
+	args = parser.parse_args()
+	replayer = Replayer()
+	counts = {"records": 0, "ok": 0, "errors": 0, "changed": 0, "skipped": 0}
+	total_ns = 0
+	for path in args.files:
+		with open(path, "rb") as f:
+			data = f.read()
+		for record in read_records(data):
+			counts["records"] += 1
+			if record.signal_type not in DECODERS:
+				counts["skipped"] += 1
+				if not args.quiet:
+					print("%s: no decoder" % record.signal_type)
+				continue
+			start_ns = time.perf_counter_ns()
+			for _ in range(args.repeat):
+				(result, error) = replayer.decode(record)
+			decode_ns = (time.perf_counter_ns() - start_ns) // args.repeat
+			total_ns += decode_ns
+			counts["ok" if error is None else "errors"] += 1
+			changed = (error is not None) != bool(record.flags & FLAG_ERROR)
+			if changed:
+				counts["changed"] += 1
+			if changed or not args.quiet:
+				text = repr(error) if error is not None else format_data(record.signal_type, result)
+				print("%s @%d %d%s %dus %s%s" % (
+					record.signal_type, record.time_ms, len(record.durations),
+					"+" if record.flags & FLAG_TRUNCATED else "", decode_ns // 1000, text,
+					" changed" if changed else ""))
+	decoded = counts["ok"] + counts["errors"]
+	print(", ".join("%d %s" % (count, name) for (name, count) in counts.items())
+		+ (", %.1fus per record" % (total_ns / decoded / 1000) if decoded != 0 else ""))
+	return 1 if counts["changed"] != 0 else 0
+
+if __name__ == "__main__":
+	sys.exit(main())
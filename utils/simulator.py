@@ -0,0 +1,832 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Simulated hardware for running `dmcomm.hardware` under desktop Python.
+#
+# Provides fake `pulseio`, `rp2pio`, `digitalio` and `supervisor` modules, and a fake `time`
+# for the communicator modules, all driven by a virtual clock. Outputs are turned into timed edges
+# on a `Net`, which any inputs connected to that net can see, including another simulated device.
+#
+# Example:
+#	import simulator
+#	sim = simulator.Simulator()
+#	simulator.install(sim)
+#	a = simulator.Device(sim, "A")
+#	b = simulator.Device(sim, "B")
+#	sim.connect(a, b)
+#	sim.run((a, a.execute_async(digirom_a)), (b, b.execute_async(digirom_b)))
+#
+# Each device has its own virtual clock, which advances by `poll_cost_us` each time the code under test
+# reads the time, and jumps to the end of each transmission when sending.
+# `Simulator.run` always resumes the device whose clock is furthest behind,
+# so the other devices see the edges in the right order, including by polling.
+
+import bisect
+import collections
+import sys
+import types
+
+_TICKS_PERIOD = 1 << 29
+
+_current_simulator = None
+
+def _simulator():
+	if _current_simulator is None:
+		raise RuntimeError("no simulator installed")
+	return _current_simulator
+
+class Clock:
+	"""Virtual time in microseconds.
+
+	:param poll_cost_us: How far time moves each time it is read.
+	"""
+	def __init__(self, poll_cost_us=10):
+		self.now_us = 0.0
+		self.poll_cost_us = poll_cost_us
+	def advance(self, duration_us):
+		self.now_us += duration_us
+	def advance_to(self, time_us):
+		if time_us > self.now_us:
+			self.now_us = time_us
+	def read_us(self):
+		"""Returns the current time, then moves forward by `poll_cost_us`."""
+		now_us = self.now_us
+		self.now_us += self.poll_cost_us
+		return now_us
+
+class Pin:
+	"""A simulated pin, which can be connected to a `Net`."""
+	def __init__(self, name):
+		self.name = name
+	def __repr__(self):
+		return "Pin(%r)" % self.name
+
+class _Driver:
+	"""One output driving a `Net`. Level None means not driving."""
+	def __init__(self, net):
+		self.net = net
+		self.times = [float("-inf")]
+		self.levels = [None]
+	def set(self, time_us, level):
+		if time_us < self.times[-1]:
+			raise ValueError("driver times must not go backwards")
+		if level == self.levels[-1]:
+			return
+		self.times.append(time_us)
+		self.levels.append(level)
+		bisect.insort(self.net.event_times, time_us)
+	def level_at(self, time_us):
+		return self.levels[bisect.bisect_right(self.times, time_us) - 1]
+	@property
+	def end_us(self):
+		return self.times[-1]
+
+class Net:
+	"""A signal which outputs can drive and inputs can read.
+
+	:param pull: The level when nothing is driving.
+	"""
+	def __init__(self, pull=False):
+		self.pull = pull
+		self.drivers = []
+		self.event_times = []
+	def new_driver(self):
+		driver = _Driver(self)
+		self.drivers.append(driver)
+		return driver
+	def level_at(self, time_us):
+		for driver in self.drivers:
+			level = driver.level_at(time_us)
+			if level is not None:
+				return level
+		return self.pull
+	def events_between(self, start_us, end_us):
+		"""Returns the times where a driver changed, after `start_us` and up to `end_us`."""
+		i = bisect.bisect_right(self.event_times, start_us)
+		j = bisect.bisect_right(self.event_times, end_us)
+		return self.event_times[i:j]
+	def inject(self, start_us, durations, first_level=True):
+		"""Drives the net with alternating levels for the durations given, then stops driving.
+
+		For playing recorded or made-up pulses into an input.
+		"""
+		driver = self.new_driver()
+		time_us = start_us
+		level = first_level
+		for duration in durations:
+			driver.set(time_us, level)
+			time_us += duration
+			level = not level
+		driver.set(time_us, None)
+		return time_us
+
+class _Connection:
+	def __init__(self, net, inverted=False, pull_pin=False):
+		self.net = net
+		self.inverted = inverted
+		self.pull_pin = pull_pin
+
+class Simulator:
+	"""Keeps the virtual clocks and the connections between pins.
+
+	:param poll_cost_us: See `Clock`.
+	"""
+	def __init__(self, poll_cost_us=10):
+		self.poll_cost_us = poll_cost_us
+		self.clock = Clock(poll_cost_us)  #: The clock used outside of `run`.
+		self.clocks = [self.clock]
+		self.current_clock = self.clock
+		self._connections = {}
+	def new_clock(self):
+		clock = Clock(self.poll_cost_us)
+		self.clocks.append(clock)
+		return clock
+	@property
+	def horizon_us(self):
+		"""The latest time any clock has reached. Outputs start after this, so no input misses an edge."""
+		return max(clock.now_us for clock in self.clocks)
+	def attach(self, pin, net, inverted=False, pull_pin=False):
+		"""Connects a pin to a net.
+
+		:param inverted: True if the pin reads the opposite of the net, such as an IR receiver.
+		:param pull_pin: True if a `DigitalInOut` output on this pin sets the pull level of the net.
+		"""
+		self._connections[pin] = _Connection(net, inverted, pull_pin)
+	def connection(self, pin):
+		if pin not in self._connections:
+			self._connections[pin] = _Connection(Net())
+		return self._connections[pin]
+	def connect(self, a, b):
+		"""Connects the prongs, infrared and Talis pins of two `Device` objects to each other."""
+		prongs = Net(pull=True)
+		talis = Net(pull=False)
+		for device in [a, b]:
+			self.attach(device.prong_output.pin_drive_signal, prongs)
+			self.attach(device.prong_output.pin_weak_pull, prongs, pull_pin=True)
+			self.attach(device.prong_input.pin_input, prongs)
+			self.attach(device.talis_input_output.pin, talis)
+		for (sender, receiver) in [(a, b), (b, a)]:
+			light = Net(pull=False)
+			self.attach(sender.ir_output.pin_output, light)
+			# IR receivers output low when they see light
+			self.attach(receiver.ir_input_modulated.pin_input, light, inverted=True)
+			self.attach(receiver.ir_input_raw.pin_input, light, inverted=True)
+	def run(self, *tasks, max_time_us=60_000_000):
+		"""Runs coroutines such as `Controller.execute_async` with `poll_ms=0` until all are done.
+
+		:param tasks: (device, coroutine) pairs. Each step goes to the device whose clock is furthest behind.
+		:returns: A list of the results, with the exception instead if one was raised.
+		"""
+		results = [None] * len(tasks)
+		running = list(range(len(tasks)))
+		start_us = self.horizon_us
+		for (device, _) in tasks:
+			device.clock.advance_to(start_us)
+		try:
+			while running:
+				i = min(running, key=lambda i: tasks[i][0].clock.now_us)
+				(device, coroutine) = tasks[i]
+				clock = device.clock
+				if clock.now_us > max_time_us:
+					raise RuntimeError("simulation took too long")
+				self.current_clock = clock
+				before_us = clock.now_us
+				try:
+					coroutine.send(None)
+				except StopIteration as e:
+					results[i] = e.value
+					running.remove(i)
+				except Exception as e:
+					results[i] = e
+					running.remove(i)
+				if clock.now_us == before_us:
+					clock.advance(self.poll_cost_us)
+		finally:
+			self.current_clock = self.clock
+			for i in running:
+				tasks[i][1].close()
+		return results
+
+# Fake `supervisor`
+
+def ticks_ms():
+	return int(_simulator().current_clock.read_us() // 1000) % _TICKS_PERIOD
+
+# Fake `time`, for the communicator modules only
+
+def monotonic():
+	return _simulator().current_clock.read_us() / 1_000_000
+
+def monotonic_ns():
+	return int(_simulator().current_clock.read_us() * 1000)
+
+def sleep(seconds):
+	_simulator().current_clock.advance(seconds * 1_000_000)
+
+# Fake `pulseio`
+
+class PulseIn:
+	"""Records the durations between edges, starting at the first edge away from `idle_state`."""
+	_max_duration = 0xFFFF
+	def __init__(self, pin, maxlen=2, idle_state=False):
+		self._simulator = _simulator()
+		connection = self._simulator.connection(pin)
+		self._net = connection.net
+		self._inverted = connection.inverted
+		self._maxlen = maxlen
+		self._idle_state = idle_state
+		self._buffer = collections.deque(maxlen=maxlen)
+		self._paused = True
+		self._deinited = False
+		self.resume()
+	def _level_at(self, time_us):
+		return self._net.level_at(time_us) != self._inverted
+	def _update(self):
+		if self._paused:
+			return
+		now_us = self._simulator.current_clock.now_us
+		for time_us in self._net.events_between(self._scan_from_us, now_us):
+			level = self._level_at(time_us)
+			if level == self._level:
+				continue
+			self._level = level
+			if self._last_edge_us is None:
+				if level != self._idle_state:
+					self._last_edge_us = time_us
+				continue
+			self._buffer.append(min(round(time_us - self._last_edge_us), self._max_duration))
+			self._last_edge_us = time_us
+		self._scan_from_us = now_us
+	@property
+	def maxlen(self):
+		return self._maxlen
+	@property
+	def paused(self):
+		return self._paused
+	def pause(self):
+		self._update()
+		self._paused = True
+	def resume(self, trigger_duration=0):
+		if self._deinited:
+			raise ValueError("deinitialized")
+		now_us = self._simulator.current_clock.now_us
+		self._scan_from_us = now_us
+		self._level = self._level_at(now_us)
+		self._last_edge_us = None
+		self._paused = False
+	def clear(self):
+		self._buffer.clear()
+	def popleft(self):
+		self._update()
+		if len(self._buffer) == 0:
+			raise IndexError("pop from empty PulseIn")
+		return self._buffer.popleft()
+	def __len__(self):
+		self._update()
+		return len(self._buffer)
+	def __getitem__(self, index):
+		self._update()
+		return self._buffer[index]
+	def deinit(self):
+		self._paused = True
+		self._deinited = True
+
+class PulseTrain:
+	"""Stands in for `PulseIn`, with the given durations all arriving at once each time it is resumed.
+
+	For feeding the decoders without any simulated timing.
+	"""
+	def __init__(self, durations, maxlen=None, idle_state=False):
+		self.durations = list(durations)
+		self.maxlen = maxlen if maxlen is not None else len(self.durations) + 1
+		self.idle_state = idle_state
+		self._buffer = collections.deque()
+		self.paused = True
+	def pause(self):
+		self.paused = True
+	def resume(self, trigger_duration=0):
+		self._buffer.extend(self.durations[:self.maxlen - len(self._buffer)])
+		self.paused = False
+	def clear(self):
+		self._buffer.clear()
+	def popleft(self):
+		return self._buffer.popleft()
+	def __len__(self):
+		return len(self._buffer)
+	def __getitem__(self, index):
+		return self._buffer[index]
+	def deinit(self):
+		self.paused = True
+
+class _Output:
+	def __init__(self, pin):
+		self._simulator = _simulator()
+		self._driver = self._simulator.connection(pin).net.new_driver()
+	def _start_us(self):
+		simulator = self._simulator
+		return max(simulator.horizon_us + simulator.poll_cost_us, self._driver.end_us)
+	def _finish(self, end_us):
+		self._driver.set(end_us, None)
+		self._simulator.current_clock.advance_to(end_us)
+	def deinit(self):
+		pass
+
+class PulseOut(_Output):
+	"""Sends alternating on/off durations, starting with on. The carrier is not simulated."""
+	def __init__(self, pin, *, frequency=38000, duty_cycle=1 << 15):
+		super().__init__(pin)
+	def send(self, pulses):
+		time_us = self._start_us()
+		for i in range(len(pulses)):
+			self._driver.set(time_us, True if i % 2 == 0 else None)
+			time_us += pulses[i]
+		self._finish(time_us)
+
+# Fake `rp2pio`
+
+def _prong_TX_model(buffer, cycle_us):
+	"Yields (time, level) from the start, and returns the total time. See `prong_TX_ASM`."
+	time_us = 0
+	for word in buffer:
+		if word == 0:
+			yield (time_us, False)
+		elif word == 1:
+			yield (time_us, True)
+		elif word == 2:
+			yield (time_us, None)
+		else:
+			time_us += word * cycle_us
+	return time_us
+
+def _iC_TX_model(buffer, cycle_us):
+	"See `iC_TX_ASM`: 1-cycle pulses for the start bit and each 0 bit, bits every 10 cycles."
+	time_us = 0
+	for byte_ in buffer:
+		yield (time_us + 2 * cycle_us, True)
+		yield (time_us + 3 * cycle_us, None)
+		for i in range(8):
+			if not (byte_ >> i) & 1:
+				yield (time_us + (12 + 10 * i) * cycle_us, True)
+				yield (time_us + (13 + 10 * i) * cycle_us, None)
+		time_us += 105 * cycle_us
+	return time_us
+
+def _xloader_TX_model(buffer, cycle_us):
+	"See `xloader_TX_ASM`: 5-cycle start pulse, 1-cycle pulses for each 0 bit, long delay after each byte."
+	time_us = 0
+	for byte_ in buffer:
+		yield (time_us + 2 * cycle_us, True)
+		yield (time_us + 7 * cycle_us, None)
+		for i in range(8):
+			if not (byte_ >> i) & 1:
+				yield (time_us + (12 + 10 * i) * cycle_us, True)
+				yield (time_us + (13 + 10 * i) * cycle_us, None)
+		time_us += 1743 * cycle_us
+	return time_us
+
+class _Fifo(collections.deque):
+	"Drops new items when full, like `push noblock`."
+	def __init__(self, size):
+		super().__init__()
+		self.size = size
+	def append(self, item):
+		if len(self) < self.size:
+			super().append(item)
+
+class _PulseRXModel:
+	"""See `pulse_RX_ASM`: after restart, records like `PulseIn` with 32-bit durations and a small FIFO."""
+	def __init__(self, state_machine, pin):
+		self._state_machine = state_machine
+		self._pin = pin
+		self._state = "start"
+		self._rx = None
+		self.rx_armed_us = None
+	def restart(self):
+		self._arm(self._simulator().current_clock.now_us)
+	def write(self, words, cycle_us):
+		raise RuntimeError("pulse_RX has no output")
+	def _simulator(self):
+		return self._state_machine._simulator
+	def _arm(self, time_us):
+		self._state = "recording"
+		self.rx_armed_us = time_us
+		rx = PulseIn(self._pin, maxlen=4, idle_state=False)
+		rx._max_duration = 0xFFFFFFFF
+		rx._buffer = _Fifo(4)
+		rx._scan_from_us = time_us
+		rx._level = rx._level_at(time_us)
+		self._rx = rx
+	def clear_rxfifo(self):
+		if self._rx is not None:
+			self._rx.clear()
+	@property
+	def in_waiting(self):
+		return 0 if self._rx is None else len(self._rx)
+	def readinto(self, buffer, start=0, end=None):
+		if end is None:
+			end = len(buffer)
+		for i in range(start, end):
+			buffer[i] = self._rx.popleft()
+
+class _HalfDuplexModel(_PulseRXModel):
+	"""See `talis_half_duplex_ASM`: after restart, sends durations until a 0, then pushes a 0 and records
+	like `_PulseRXModel`. Writing takes until the 0 has been pushed, which stands for `HalfDuplexPulses` waiting for it.
+
+	`tx_end_us` and `rx_armed_us` are the simulated times the last send finished and recording started.
+	"""
+	def __init__(self, state_machine, pin):
+		super().__init__(state_machine, pin)
+		self._next_level = True
+		self._time_us = None
+		self.tx_end_us = None
+	def restart(self):
+		if self._state == "sending":
+			raise RuntimeError("restart while sending is not modelled")
+		self._state = "start"
+		self._rx = None
+	def _arm(self, time_us):
+		super()._arm(time_us)
+		self._rx._buffer.append(0)
+	def write(self, words, cycle_us):
+		state_machine = self._state_machine
+		driver = state_machine._driver
+		for word in words:
+			word &= 0xFFFF
+			if self._state == "recording":
+				raise RuntimeError("write while recording is not modelled")
+			if self._state == "start":
+				if word == 0:
+					# Only recording: starts straight away, like `PulseIn.resume`.
+					self._arm(self._simulator().current_clock.now_us)
+					break
+				self._time_us = state_machine._start_us()
+				self._next_level = True
+			if word == 0:
+				driver.set(self._time_us, None)
+				self.tx_end_us = self._time_us
+				# pull, out, jmp, set pindirs
+				self._arm(self._time_us + 4 * cycle_us)
+				break
+			self._state = "sending"
+			driver.set(self._time_us, self._next_level)
+			self._next_level = not self._next_level
+			self._time_us += word
+		clock = self._simulator().current_clock
+		if self._time_us is not None:
+			clock.advance_to(self._time_us)
+		if self._state == "recording":
+			clock.advance_to(self.rx_armed_us)
+
+class _BytesRXModel:
+	"""See `_bytes_RX_ASM`: after restart, pushes bytes decoded from the times that pulses start, to a small FIFO.
+
+	Each bit is 0 if a pulse starts in a window of 0.9 ticks, which starts 0.55 ticks after the last pulse started,
+	or 1 tick after the last window started if that had no pulse.
+	"""
+	sync = False  #: True to skip to a gap of 2.5 ticks first, like `iC_RX_ASM`.
+	def __init__(self, state_machine, pin):
+		self._state_machine = state_machine
+		connection = state_machine._simulator.connection(pin)
+		self._net = connection.net
+		self._inverted = connection.inverted
+		self._fifo = _Fifo(4)
+		self._armed = False
+	def restart(self):
+		now_us = self._state_machine._simulator.current_clock.now_us
+		self._tick_us = 40_000_000 / self._state_machine.frequency
+		self._scan_from_us = now_us
+		self._level = self._level_at(now_us)
+		self._synced = not self.sync
+		self._last_rise_us = None if self._level else now_us
+		self._starts = collections.deque()
+		self._bit = None
+		self._done_us = now_us
+		self._fifo.clear()
+		self._armed = True
+	def write(self, words, cycle_us):
+		raise RuntimeError("no output for this PIO program")
+	def _level_at(self, time_us):
+		return self._net.level_at(time_us) != self._inverted
+	def _update(self):
+		if not self._armed:
+			return
+		now_us = self._state_machine._simulator.current_clock.now_us
+		tick_us = self._tick_us
+		for time_us in self._net.events_between(self._scan_from_us, now_us):
+			level = self._level_at(time_us)
+			if level == self._level:
+				continue
+			self._level = level
+			if level:
+				self._last_rise_us = time_us
+			elif self._synced:
+				self._starts.append(time_us)
+			elif self._last_rise_us is not None and time_us - self._last_rise_us >= 2.5 * tick_us:
+				self._synced = True
+				self._starts.append(time_us)
+		self._scan_from_us = now_us
+		starts = self._starts
+		while True:
+			if self._bit is None:
+				while starts and starts[0] <= self._done_us:
+					starts.popleft()
+				if not starts:
+					return
+				self._window_us = starts.popleft() + 0.55 * tick_us
+				self._bit = 0
+				self._byte = 0
+				continue
+			end_us = self._window_us + 0.9 * tick_us
+			while starts and starts[0] < self._window_us:
+				starts.popleft()
+			if starts and starts[0] <= end_us:
+				time_us = starts.popleft()
+				self._window_us = time_us + 0.55 * tick_us
+			elif now_us > end_us:
+				time_us = end_us
+				self._byte |= 1 << self._bit
+				self._window_us += tick_us
+			else:
+				return
+			self._bit += 1
+			if self._bit == 8:
+				self._fifo.append(self._byte)
+				self._bit = None
+				self._done_us = time_us
+	def clear_rxfifo(self):
+		self._fifo.clear()
+	@property
+	def in_waiting(self):
+		self._update()
+		return len(self._fifo)
+	def readinto(self, buffer, start=0, end=None):
+		if end is None:
+			end = len(buffer)
+		for i in range(start, end):
+			buffer[i] = self._fifo.popleft()
+
+class _iC_RXModel(_BytesRXModel):
+	sync = True
+
+class _ClassicRXModel:
+	"""See `classic_RX_idle_high_ASM`: after restart and the two thresholds, pushes 3 items for a V/X/Y packet.
+
+	`classify_us` is the simulated time the bits were pushed, for the last packet.
+	"""
+	idle_state = True
+	def __init__(self, state_machine, pin):
+		self._state_machine = state_machine
+		connection = state_machine._simulator.connection(pin)
+		self._net = connection.net
+		self._inverted = connection.inverted
+		self._fifo = _Fifo(4)
+		self._thresholds = []
+		self._program = None
+		self.classify_us = None
+	def restart(self):
+		self._thresholds = []
+		self._program = None
+	def write(self, words, cycle_us):
+		self._thresholds.extend(words)
+		if len(self._thresholds) == 2 and self._program is None:
+			now_us = self._state_machine._simulator.current_clock.now_us
+			self._scan_from_us = now_us
+			self._level = self._level_at(now_us)
+			self._program = self._run(*self._thresholds)
+			next(self._program)
+	def _level_at(self, time_us):
+		return self._net.level_at(time_us) != self._inverted
+	def _run(self, pre_active_min, bit_idle_threshold):
+		"Generator which is sent the time of each edge, and pushes like the program."
+		idle = self.idle_state
+		while True:
+			if self._level != idle:
+				yield
+			start_us = yield
+			end_us = yield
+			if end_us - start_us > pre_active_min:
+				break
+		self._fifo.append(pre_active_min)
+		yield
+		idle_start_us = yield
+		word = 0
+		for i in range(16):
+			active_start_us = yield
+			if active_start_us - idle_start_us > bit_idle_threshold:
+				word |= 1 << (16 + i)
+			if i == 15:
+				self._fifo.append(word)
+				self.classify_us = active_start_us
+			idle_start_us = yield
+		self._fifo.append(0)
+		while True:
+			yield
+	def _update(self):
+		if self._program is None:
+			return
+		now_us = self._state_machine._simulator.current_clock.now_us
+		for time_us in self._net.events_between(self._scan_from_us, now_us):
+			level = self._level_at(time_us)
+			if level != self._level:
+				self._level = level
+				self._program.send(time_us)
+		self._scan_from_us = now_us
+	def clear_rxfifo(self):
+		self._fifo.clear()
+	@property
+	def in_waiting(self):
+		self._update()
+		return len(self._fifo)
+	def readinto(self, buffer, start=0, end=None):
+		if end is None:
+			end = len(buffer)
+		for i in range(start, end):
+			buffer[i] = self._fifo.popleft()
+
+class _ClassicRXIdleLowModel(_ClassicRXModel):
+	idle_state = False
+
+def _program_models():
+	from dmcomm.hardware import pio_programs
+	return [
+		(pio_programs.prong_TX, _prong_TX_model),
+		(pio_programs.iC_TX, _iC_TX_model),
+		(pio_programs.xloader_TX, _xloader_TX_model),
+		(pio_programs.talis_half_duplex, _HalfDuplexModel),
+		(pio_programs.pulse_RX, _PulseRXModel),
+		(pio_programs.iC_RX, _iC_RXModel),
+		(pio_programs.xloader_RX, _BytesRXModel),
+		(pio_programs.classic_RX_idle_high, _ClassicRXModel),
+		(pio_programs.classic_RX_idle_low, _ClassicRXIdleLowModel),
+	]
+
+class StateMachine(_Output):
+	"""Runs a behavioural model of one of the programs in `pio_programs`, chosen by comparing the program."""
+	def __init__(self, program, frequency, *, first_out_pin=None, first_set_pin=None, **kwargs):
+		super().__init__(first_set_pin or first_out_pin or kwargs["first_in_pin"])
+		self._model = None
+		for (known_program, model) in _program_models():
+			if list(program) == list(known_program):
+				self._model = model
+		if self._model is None:
+			raise NotImplementedError("no model for this PIO program")
+		self.frequency = frequency
+		self._background_ends_us = []
+		# Models which record input, rather than generating output from what is written.
+		self.recorder = None
+		if self._model in (_PulseRXModel, _HalfDuplexModel, _iC_RXModel, _BytesRXModel,
+				_ClassicRXModel, _ClassicRXIdleLowModel):
+			self.recorder = self._model(self, kwargs["first_in_pin"])
+	def _schedule(self, buffer):
+		"Puts the output for `buffer` on the net after anything already sent. Returns the end time."
+		start_us = max([self._start_us()] + self._background_ends_us)
+		steps = self._model(buffer, 1_000_000 / self.frequency)
+		try:
+			while True:
+				(time_us, level) = next(steps)
+				self._driver.set(start_us + time_us, level)
+		except StopIteration as e:
+			return start_us + e.value
+	def write(self, buffer, *, start=0, end=None, swap=False):
+		if end is None:
+			end = len(buffer)
+		if self.recorder is not None:
+			self.recorder.write(buffer[start:end], 1_000_000 / self.frequency)
+			return
+		self._finish(self._schedule(buffer[start:end]))
+	def restart(self):
+		if self.recorder is not None:
+			self.recorder.restart()
+	def clear_rxfifo(self):
+		if self.recorder is not None:
+			self.recorder.clear_rxfifo()
+	@property
+	def in_waiting(self):
+		return 0 if self.recorder is None else self.recorder.in_waiting
+	def readinto(self, buffer, *, start=0, end=None, swap=False):
+		if self.recorder is None:
+			raise NotImplementedError("no input for this PIO program")
+		self.recorder.readinto(buffer, start, end)
+	def background_write(self, once=None, *, loop=None, swap=False):
+		"""Sends `once` after anything already sent, without waiting. `loop` is not supported.
+
+		Like on the device, waits while another buffer is queued.
+		"""
+		if loop is not None:
+			raise NotImplementedError("loop")
+		if self.pending_write != 0:
+			self._simulator.current_clock.advance_to(self._background_ends_us[-2])
+		self._background_ends_us.append(self._schedule(once))
+	def _unfinished(self):
+		now_us = self._simulator.current_clock.now_us
+		self._background_ends_us = [end_us for end_us in self._background_ends_us if end_us > now_us]
+		return len(self._background_ends_us)
+	@property
+	def pending_write(self):
+		return max(0, self._unfinished() - 1)
+	@property
+	def writing(self):
+		return self._unfinished() != 0
+
+# Fake `digitalio`
+
+class Direction:
+	INPUT = "INPUT"
+	OUTPUT = "OUTPUT"
+
+class Pull:
+	UP = "UP"
+	DOWN = "DOWN"
+
+class DigitalInOut:
+	"""Reads the level of the net. As an output on a pull pin, sets the pull level of the net."""
+	def __init__(self, pin):
+		self._simulator = _simulator()
+		self._connection = self._simulator.connection(pin)
+		self.direction = Direction.INPUT
+	def switch_to_output(self, value=False, drive_mode=None):
+		self.direction = Direction.OUTPUT
+		self.value = value
+	def switch_to_input(self, pull=None):
+		self.direction = Direction.INPUT
+	@property
+	def value(self):
+		connection = self._connection
+		return connection.net.level_at(self._simulator.current_clock.now_us) != connection.inverted
+	@value.setter
+	def value(self, value):
+		if self._connection.pull_pin:
+			self._connection.net.pull = value
+	def deinit(self):
+		pass
+
+def _make_module(name, **members):
+	module = types.ModuleType(name)
+	for (key, value) in members.items():
+		setattr(module, key, value)
+	return module
+
+supervisor_module = _make_module("supervisor", ticks_ms=ticks_ms)
+time_module = _make_module("time", monotonic=monotonic, monotonic_ns=monotonic_ns, sleep=sleep)
+pulseio_module = _make_module("pulseio", PulseIn=PulseIn, PulseOut=PulseOut)
+rp2pio_module = _make_module("rp2pio", StateMachine=StateMachine)
+digitalio_module = _make_module("digitalio", DigitalInOut=DigitalInOut, Direction=Direction, Pull=Pull)
+
+_FAKE_MODULES = {
+	"supervisor": supervisor_module,
+	"pulseio": pulseio_module,
+	"rp2pio": rp2pio_module,
+	"digitalio": digitalio_module,
+}
+
+_COMMS_MODULES = ["barcode", "classic", "color", "ic", "modulated", "talis", "witches", "xloader"]
+
+def install(simulator):
+	"""Makes `simulator` the current simulator, and makes `dmcomm.hardware` use the fake modules.
+
+	Can be called again with a new simulator.
+	"""
+	global _current_simulator
+	_current_simulator = simulator
+	sys.modules.update(_FAKE_MODULES)
+	import importlib
+	importlib.import_module("dmcomm.hardware")
+	for name in _COMMS_MODULES:
+		importlib.import_module("dmcomm.hardware.comms." + name)
+	importlib.import_module("dmcomm.hardware.sniffer")
+	# In case any were imported before this
+	fakes = dict(_FAKE_MODULES)
+	fakes["time"] = time_module
+	for (module_name, module) in list(sys.modules.items()):
+		if module_name.startswith("dmcomm.hardware"):
+			for (name, fake) in fakes.items():
+				if isinstance(getattr(module, name, None), types.ModuleType):
+					setattr(module, name, fake)
+
+class Device:
+	"""A simulated board, with a `Controller` which has all the types of pins registered.
+
+	:param simulator: The `Simulator` to use.
+	:param name: Prefix for the pin names.
+	"""
+	def __init__(self, simulator, name):
+		from dmcomm.hardware import Controller, pins
+		def pin(suffix):
+			return Pin(name + "." + suffix)
+		self.simulator = simulator
+		self.clock = simulator.new_clock()
+		self.prong_output = pins.ProngOutput(pin("prong_drive"), pin("prong_pull"))
+		self.prong_input = pins.ProngInput(pin("prong_in"))
+		self.ir_output = pins.InfraredOutput(pin("ir_out"))
+		self.ir_input_modulated = pins.InfraredInputModulated(pin("ir_in_modulated"))
+		self.ir_input_raw = pins.InfraredInputRaw(pin("ir_in_raw"))
+		self.talis_input_output = pins.TalisInputOutput(pin("talis"))
+		self.controller = Controller()
+		for item in [self.prong_output, self.prong_input, self.ir_output,
+				self.ir_input_modulated, self.ir_input_raw, self.talis_input_output]:
+			self.controller.register(item)
+	def execute_async(self, digirom):
+		"""Returns the coroutine for executing `digirom`, for `Simulator.run`."""
+		return self.controller.execute_async(digirom, 0)
+	def execute(self, digirom):
+		"""Executes `digirom` with no other devices running. Returns None or the exception raised."""
+		return self.simulator.run((self, self.execute_async(digirom)))[0]
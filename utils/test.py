@@ -67,3 +67,129 @@ dm20cmd.pattern = 5
 assert dm20cmd[0].data == 0x0F02
 assert dm20cmd[1].data == 0x0002
 assert dm20cmd[2].data == 0x961E
+
+# iC encoding matches the original bit-by-bit implementation.
+from dmcomm.protocol import ic_encoding
+
+def redundancy_bits_loop(x):
+	result = 0x79B4
+	mask = 0x19D8
+	for i in range(16):
+		if x & 1:
+			result ^= mask
+		x >>= 1
+		mask <<= 1
+		if mask >= 0x10000:
+			mask ^= 0x10811
+	return result
+
+def encode_loop(x):
+	r = redundancy_bits_loop(x)
+	result = ic_encoding.START_SEQUENCE[:]
+	for byte_ in [x & 0xFF, (x & 0xFF00) >> 8, r & 0xFF, (r & 0xFF00) >> 8]:
+		if byte_ in [0xC0, 0xC1, 0x7D]:
+			result.append(0x7D)
+			result.append({0xC0: 0xE0, 0xC1: 0xE1, 0x7D: 0x5D}[byte_])
+		else:
+			result.append(byte_)
+	result.append(0xC1)
+	return result
+
+all_values = range(0x10000)
+for x in all_values:
+	assert ic_encoding.redundancy_bits(x) == redundancy_bits_loop(x)
+	assert ic_encoding.encode(x) == encode_loop(x)
+for x in [0x10000, 0x1ABCD, 0xFFFFFFFF]:
+	assert ic_encoding.redundancy_bits(x) == redundancy_bits_loop(x)
+	assert ic_encoding.encode(x) == encode_loop(x & 0xFFFF)
+encoded = ic_encoding.encode_many(all_values)
+assert ic_encoding.decode_many(encoded) == list(all_values)
+assert ic_encoding.decode([0xC0] * 6 + ic_encoding.encode(0x7DC1)[10:] + [0xFF]) == (0x7DC1, 18)
+
+# iC frames can be decoded one byte at a time, stopping at the C1 terminator.
+def decode_by_byte(bytes_):
+	frame_decoder = ic_encoding.FrameDecoder()
+	for i in range(len(bytes_)):
+		if frame_decoder.feed(bytes_[i]):
+			return (frame_decoder.value, i + 1)
+	return None
+
+for x in [0x0000, 0x7DC1, 0xC0C0, 0xFFFF, 0x1234]:
+	assert decode_by_byte(ic_encoding.encode(x) + [0xFF]) == (x, ic_encoding.decode(ic_encoding.encode(x))[1])
+assert decode_by_byte(ic_encoding.encode(0x1234)[:-1]) is None
+for bad in [[0xC0] * 4 + [0xFF], [0xC0] * 11, [0xC0] * 6 + [0xFF, 0x13, 0x71], ic_encoding.encode(0x1234)[:-2] + [0xC1]]:
+	try:
+		decode_by_byte(bad)
+		assert False
+	except ValueError:
+		pass
+
+# Segments are stored in arrays, and indexing gives read-only views with the same fields as before.
+digirom = dmcomm.protocol.parse_command("DL1-AA++BB^^-CC+?__>>11")
+assert len(digirom) == 2
+assert digirom[0].data == (0xAA, "++", 0xBB, "^^")
+assert digirom[-1].data == (0xCC, "+?", "__", ">>", 0x11)
+digirom = dmcomm.protocol.parse_command("V1-0C8E-^0^F8E-@C^0FE")
+assert [digirom[i].data for i in range(len(digirom))] == [0x0C8E, 0x008E, 0x00FE]
+assert digirom[1].copy_mask == 0xF000 and digirom[1].invert_mask == 0x0F00
+assert digirom[2].checksum_target == 0xC and digirom[2].check_digit_LSB_pos == 12
+assert digirom[0].checksum_target is None
+assert digirom[-1].data == 0x00FE
+for (segment, name, value) in [(digirom[1], "copy_mask", 0), (digirom[2], "checksum_target", None)]:
+	try:
+		setattr(segment, name, value)
+		assert False, name
+	except AttributeError:
+		pass
+digirom = dmcomm.protocol.parse_command("DL1-AA++BB^^")
+try:
+	digirom[0].data[0] = 0xBB
+	assert False
+except TypeError:
+	pass
+try:
+	digirom[1]
+	assert False
+except IndexError:
+	pass
+
+# Checksum instructions, and adding a new one.
+from dmcomm.protocol import digirom as digirom_module
+
+def crc8_step(crc, item):
+	crc ^= item
+	for i in range(8):
+		crc = ((crc << 1) ^ 0x07) & 0xFF if crc & 0x80 else (crc << 1) & 0xFF
+	return crc
+
+class TestCRC8Operator(digirom_module.Operator):
+	accumulates = True
+	def reset(self):
+		self._crc = 0
+	def update(self, item):
+		self._crc = crc8_step(self._crc, item)
+	def value(self, index, data_received):
+		return self._crc
+
+digirom_module.BYTE_OPERATORS["%%"] = TestCRC8Operator
+digirom = dmcomm.protocol.parse_command("DL1-AA++BB^^CC+?%%")
+digirom.prepare()
+expected = [0xAA, 0xAA, 0xBB, 0xBB, 0xCC]
+expected.append(digirom_module.checksum_datalink(expected))
+crc = 0
+for item in expected:
+	crc = crc8_step(crc, item)
+expected.append(crc)
+assert digirom.next() == expected
+del digirom_module.BYTE_OPERATORS["%%"]
+digirom = dmcomm.protocol.parse_command("C1-FFFF0002++++")
+digirom.prepare()
+assert digirom.next() == [0xFFFF, 0x0002, 0x0001]
+
+command = dmcomm.protocol.parse_command("R-V-2000")
+assert command.signal_type is None
+assert command.op == "R"
+assert command.args == ["V", "2000"]
+assert dmcomm.protocol.parse_command("I").args == []
+command = dmcomm.protocol.parse_command("L-ic")
+assert (command.signal_type, command.op, command.args) == (None, "L", ["IC"])
@@ -0,0 +1,115 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Checks that utils/analyze.py decodes captures the same as the decoders on the device.
+# Needs numpy. Run from the repository root: PYTHONPATH=lib python utils/test_analyze.py
+
+import collections
+import io
+import random
+
+import simulator
+
+simulator.install(simulator.Simulator())
+
+import analyze
+import replay
+from dmcomm.hardware.capture import Capture, CapturedPulses, read_records
+from dmcomm.hardware.comms.classic import ClassicParams
+from dmcomm.hardware.comms.modulated import ModulatedParams
+
+rng = random.Random(1)
+
+def jitter(t, spread):
+	return max(0, t + rng.randint(-spread, spread))
+
+def classic_durations(params, spread):
+	durations = [params.pre_active_send, params.start_idle_send, params.start_active_send]
+	for i in range(16):
+		if rng.getrandbits(1):
+			durations.extend([params.bit1_idle_send, params.bit1_active_send])
+		else:
+			durations.extend([params.bit0_idle_send, params.bit0_active_send])
+	durations = [jitter(t, spread) for t in durations]
+	# Some cut short or with extra durations.
+	if rng.random() < 0.1:
+		durations = durations[:rng.randint(0, len(durations))]
+	elif rng.random() < 0.1:
+		durations.append(jitter(500, 100))
+	return durations
+
+def modulated_durations(params, spread):
+	durations = [params.start_pulse_send, params.start_gap_send]
+	for i in range(8 * rng.randint(0, 4)):
+		durations.append(params.bit_pulse_send)
+		durations.append(params.bit_gap_send_long if rng.getrandbits(1) else params.bit_gap_send_short)
+	durations.append(params.stop_pulse_send)
+	durations = [jitter(t, spread) for t in durations]
+	if rng.random() < 0.1:
+		durations = durations[:rng.randint(0, len(durations))]
+	return durations
+
+def error_name(error):
+	"The field which the message of a `ReceiveError` from the decoders is about, as in `Analysis.error_names`."
+	message = str(error)
+	if message.startswith("incomplete") or message.startswith("bit_count") or message.lstrip("-").isdigit():
+		return "incomplete"
+	if message.startswith("last pulse"):
+		return "stop_pulse"
+	if message.startswith("start pulse"):
+		return "start"
+	if message.startswith("bit ") and "pulse=" in message:
+		return "bit"
+	return message.split(" ")[0]
+
+stream = io.BytesIO()
+capture = Capture(stream)
+for signal_type in analyze.SIGNAL_TYPES:
+	if signal_type in ["V", "X", "Y"]:
+		(params, make) = (ClassicParams(signal_type), classic_durations)
+	else:
+		(params, make) = (ModulatedParams(signal_type), modulated_durations)
+	for i in range(300):
+		pulses = CapturedPulses(collections.deque(make(params, 300 if i % 2 else 50)), capture)
+		capture.start(pulses)
+		capture.end(signal_type)
+		capture.write_pending()
+	# X from some iC toys stops partway through the last bit.
+	if signal_type == "X":
+		pulses = CapturedPulses(collections.deque(classic_durations(params, 0)[:34]), capture)
+		capture.start(pulses)
+		capture.end(signal_type)
+		capture.write_pending()
+data = stream.getvalue()
+records = list(read_records(data))
+replayer = replay.Replayer()
+for signal_type in analyze.SIGNAL_TYPES:
+	analysis = analyze.analyze(data, signal_type)
+	expected = [replayer.decode(record) for record in records if record.signal_type == signal_type]
+	assert len(analysis.errors) == len(expected)
+	decoded = 0
+	for (i, (data_expected, error)) in enumerate(expected):
+		if error is not None:
+			assert analysis.error_names[analysis.errors[i]] == error_name(error), (signal_type, i, error)
+			continue
+		assert analysis.errors[i] == -1, (signal_type, i, analysis.error_names[analysis.errors[i]])
+		if signal_type in ["V", "X", "Y"]:
+			assert analysis.words[i] == data_expected, (signal_type, i)
+		else:
+			assert list(analysis.words[i, :analysis.byte_counts[i]]) == data_expected, (signal_type, i)
+		decoded += 1
+	# Both outcomes are covered.
+	assert 20 < decoded < len(expected) - 20, (signal_type, decoded)
+	result = analyze.report(analysis, 50)
+	assert result["decoded"] == decoded
+	assert sum(result["errors"].values()) == len(expected) - decoded
+	for (name, field) in result["fields"].items():
+		assert sum(field["histogram"]["counts"]) == field["count"], name
+		assert (field["min_margin"] < 0) == (field["out_of_tolerance"] > 0), (name, field)
+		# Each packet which failed on a field has a duration out of tolerance there.
+		assert result["errors"][name] <= field["out_of_tolerance"], (name, field)
+	# Every bit is timed, including in packets which failed later on.
+	if signal_type in ["V", "X", "Y"]:
+		bit_idle_count = sum(len(record.durations[3:35:2]) for record in records if record.signal_type == signal_type)
+		assert result["fields"]["bit_idle"]["count"] == bit_idle_count
+
+print("ok")
@@ -0,0 +1,468 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# We can test hardware modules from CPython using the simulator.
+# Run from the repository root: PYTHONPATH=lib python utils/test_hardware.py
+
+import simulator
+
+sim = simulator.Simulator()
+simulator.install(sim)
+
+import dmcomm.protocol
+from dmcomm import ReceiveError
+
+a = simulator.Device(sim, "A")
+b = simulator.Device(sim, "B")
+sim.connect(a, b)
+
+def exchange(command_a, command_b):
+	digirom_a = dmcomm.protocol.parse_command(command_a)
+	digirom_b = dmcomm.protocol.parse_command(command_b)
+	errors = sim.run((a, a.execute_async(digirom_a)), (b, b.execute_async(digirom_b)))
+	assert errors == [None, None], errors
+	return (str(digirom_a.result), str(digirom_b.result))
+
+for (command_a, command_b, result_a, result_b) in [
+	("V1-FC03-FD02", "V2-FC03-FD02", "s:FC03 r:FC03 s:FD02 r:FD02", "r:FC03 s:FC03 r:FD02 s:FD02"),
+	("X1-0001-0002", "X2-0003-0004", "s:0001 r:0003 s:0002 r:0004", "r:0001 s:0003 r:0002 s:0004"),
+	("Y1-8001-0002", "Y2-0003-F004", "s:8001 r:0003 s:0002 r:F004", "r:8001 s:0003 r:0002 s:F004"),
+	("C1-0001000200030004000500060007000F", "C2-1111222233334444555566667777888F",
+		"s:0001000200030004000500060007000F r:1111222233334444555566667777888F",
+		"r:0001000200030004000500060007000F s:1111222233334444555566667777888F"),
+	("IC1-0007-0101", "IC2-0007-0303", "s:0007 r:0007 s:0101 r:0303", "r:0007 s:0007 r:0101 s:0303"),
+	("DL1-0123456789ABCDEF", "DL2-FEDCBA9876543210",
+		"s:0123456789ABCDEF r:FEDCBA9876543210", "r:0123456789ABCDEF s:FEDCBA9876543210"),
+	("FL1-0123", "FL2-4567", "s:0123 r:4567", "r:0123 s:4567"),
+	("LT1-0123456789ABCDEF", "LT2-FEDCBA9876543210",
+		"s:0123456789ABCDEF r:FEDCBA9876543210", "r:0123456789ABCDEF s:FEDCBA9876543210"),
+	("MW1-0102-0304", "MW2-A1A2-B3B4", "s:0102 r:A1A2 s:0304 r:B3B4", "r:0102 s:A1A2 r:0304 s:B3B4"),
+	("!XL1-0102030405", "!XL2-0A0B", "s:0102030405 r:0A0B", "r:0102030405 s:0A0B"),
+]:
+	(actual_a, actual_b) = exchange(command_a, command_b)
+	assert actual_a.startswith(result_a), (command_a, actual_a)
+	assert actual_b.startswith(result_b), (command_b, actual_b)
+
+# Timings recorded while the devices talk to each other.
+from dmcomm.hardware import Stats, stats
+stats_a = Stats(4)
+stats_b = Stats(4)
+a.controller.stats = stats_a
+b.controller.stats = stats_b
+exchange("V1-FC03-FD02-FE01-FF00-FC03", "V2-FC03-FD02-FE01-FF00-FC03")
+a.controller.stats = None
+b.controller.stats = None
+assert len(stats_a.durations(stats.SEND)) == 4
+assert stats_a.summary(stats.SEND)[0] == 5
+assert stats_a.summary(stats.REPLY_GAP)[0] == 5
+assert stats_a.summary(stats.WAIT) is None
+assert stats_b.summary(stats.WAIT)[0] == 1
+assert stats_b.summary(stats.REPLY_GAP)[0] == 4
+(count, min_us, average_us, max_us, histogram) = stats_a.summary(stats.PACKET)
+assert count == 5 and sum(histogram) == 4
+# V packet is about 59ms pre-active + 16 bits
+assert 70000 < min_us <= average_us <= max_us < 140000, (min_us, max_us)
+assert stats_a.report()[0].startswith("phase n min avg max")
+assert len(stats_a.report()) == 1 + 7
+assert stats_a.summary(stats.SWITCH)[0] == 1
+
+# Communicators and the hardware they use are kept when switching signal types.
+resources = a.controller._resources
+prong_output = resources[a.prong_output.pin_drive_signal]._object
+raw_input = resources[a.ir_input_raw.pin_input]._object
+exchange("X1-0001", "X2-0002")
+exchange("DL1-0123456789ABCDEF", "DL2-FEDCBA9876543210")
+assert resources[a.prong_output.pin_drive_signal]._object is prong_output
+assert resources[a.ir_input_raw.pin_input]._object is raw_input
+exchange("IC1-0007", "IC2-0007")
+assert resources[a.ir_input_raw.pin_input]._object is raw_input
+ic_output = resources[a.ir_output.pin_output]._object
+exchange("!XL1-01", "!XL2-02")
+assert resources[a.ir_output.pin_output]._object is not ic_output
+assert resources[a.ir_input_raw.pin_input]._object is raw_input
+exchange("MW1-01", "MW2-02")
+exchange("Y1-0001", "Y2-0002")
+assert resources[a.prong_output.pin_drive_signal]._object is prong_output
+assert sorted(a.controller._communicators) == ["!XL", "C", "IC", "MW", "classic", "modulated", "talis"]
+
+# Xros Loader capturing the whole transmission before decoding.
+xloader_b = b.controller._communicators["!XL"]
+xloader_b.capture_maxlen = 2000
+payload = "".join("%02X" % (i * 37 % 256) for i in range(64))
+(actual_a, actual_b) = exchange("!XL1-" + payload, "!XL2-0A0B")
+assert actual_a.startswith("s:%s r:0A0B" % payload), actual_a
+assert actual_b.startswith("r:%s s:0A0B" % payload), actual_b
+# 1743 PIO cycles per byte at 583430Hz is about 335 bytes per second.
+assert 300 < xloader_b.bytes_per_second < 360, xloader_b.bytes_per_second
+def xloader_error_b(command_a, command_b):
+	digirom_a = dmcomm.protocol.parse_command(command_a)
+	digirom_b = dmcomm.protocol.parse_command(command_b)
+	(error_a, error_b) = sim.run((a, a.execute_async(digirom_a)), (b, b.execute_async(digirom_b)))
+	return error_b
+# The PulseIn from before is bigger than needed, so it isn't full.
+xloader_b.capture_maxlen = 100
+assert xloader_error_b("!XL1-" + payload, "!XL2-0A0B") is None
+b.controller._resources[b.ir_input_raw.pin_input].release()
+error_b = xloader_error_b("!XL1-" + payload, "!XL2-0A0B")
+assert isinstance(error_b, ReceiveError) and str(error_b).startswith("capture full"), error_b
+# A capture which is still going at the time limit is an error, rather than decoding part of a byte.
+xloader_b.capture_maxlen = 2000
+xloader_b.capture_timeout_ms = 100
+error_b = xloader_error_b("!XL1-" + payload, "!XL2-0A0B")
+assert isinstance(error_b, ReceiveError) and str(error_b).startswith("capture too long"), error_b
+xloader_b.capture_timeout_ms = None
+xloader_b.capture_maxlen = None
+assert exchange("!XL1-01", "!XL2-02")[1].startswith("r:01 s:02")
+
+# Raw durations of each receive, replayed through the decoders.
+import io
+import replay
+from dmcomm.hardware import Capture, capture
+class PartialStream(io.BytesIO):
+	"Takes at most 100 bytes at a time, like a serial port with write_timeout 0, and never during a DigiROM."
+	def write(self, data):
+		assert b.controller._digirom is None
+		return super().write(bytes(data[:100]))
+stream = PartialStream()
+capture_b = Capture(stream)
+b.controller.capture = capture_b
+received = []
+for (command_a, command_b) in [
+	("V1-FC03-FD02", "V2-1234-5678"),
+	("X1-0001", "X2-0002"),
+	("C1-0001000200030004000500060007000F", "C2-1111222233334444555566667777888F"),
+	("IC1-0007-0101", "IC2-0007-0303"),
+	("DL1-0123456789ABCDEF", "DL2-FEDCBA9876543210"),
+	("FL1-0123", "FL2-4567"),
+	("LT1-0123456789ABCDEF", "LT2-FEDCBA9876543210"),
+	("!XL1-0102030405", "!XL2-0A0B"),
+]:
+	signal_type = dmcomm.protocol.parse_command(command_b).signal_type
+	(actual_a, actual_b) = exchange(command_a, command_b)
+	received.extend((signal_type, segment) for segment in actual_b.split() if segment.startswith("r:"))
+# A broken packet is recorded with the error.
+digirom_b = dmcomm.protocol.parse_command("V2-0000")
+sim.connection(b.prong_input.pin_input).net.inject(sim.horizon_us + 1000,
+	[60000, 2000, 300] + [1000, 2600] * 16 + [400], first_level=False)
+(error_b,) = sim.run((b, b.execute_async(digirom_b)))
+assert isinstance(error_b, ReceiveError), error_b
+b.controller.capture = None
+while capture_b._pending_bytes != 0:
+	capture_b.write_pending()
+assert capture_b.records_dropped == 0
+records = list(capture.read_records(b"junk" + stream.getvalue()))
+assert len(records) == len(received) + 1, len(records)
+assert [record.flags for record in records] == [0] * len(received) + [capture.FLAG_ERROR]
+assert all(records[i].time_ms <= records[i + 1].time_ms for i in range(len(records) - 1))
+replayer = replay.Replayer()
+replayed = []
+for record in records[:-1]:
+	(data, error) = replayer.decode(record)
+	assert error is None, (record.signal_type, error)
+	replayed.append((record.signal_type, replay.format_data(record.signal_type, data)))
+assert replayed == received, replayed
+assert str(replayer.decode(records[-1])[1]) == str(error_b)
+# The inputs are created again without recording.
+exchange("V1-0001", "V2-0002")
+assert len(records) == len(list(capture.read_records(stream.getvalue())))
+assert capture_b.records_written == len(records)
+# Records which don't fit in the buffer are dropped.
+capture_b = Capture(io.BytesIO(), buffer_size=100)
+b.controller.capture = capture_b
+exchange("V1-FC03-FD02", "V2-1234-5678")
+b.controller.capture = None
+assert (capture_b.records_written, capture_b.records_dropped) == (1, 1)
+# A write error doesn't replace the error from the receive, and the records wait for the next write.
+class BrokenStream(io.BytesIO):
+	def write(self, data):
+		raise OSError("broken")
+capture_b = Capture(BrokenStream())
+b.controller.capture = capture_b
+sim.connection(b.prong_input.pin_input).net.inject(sim.horizon_us + 1000,
+	[60000, 2000, 300] + [1000, 2600] * 16 + [400], first_level=False)
+(error_b,) = sim.run((b, b.execute_async(dmcomm.protocol.parse_command("V2-0000"))))
+assert isinstance(error_b, ReceiveError), error_b
+assert len(capture_b._pending) == 1
+# Otherwise the write error is raised.
+digirom_a = dmcomm.protocol.parse_command("V1-0001")
+digirom_b = dmcomm.protocol.parse_command("V2-0002")
+(error_a, error_b) = sim.run((a, a.execute_async(digirom_a)), (b, b.execute_async(digirom_b)))
+assert error_a is None and isinstance(error_b, OSError), (error_a, error_b)
+assert len(capture_b._pending) == 2
+b.controller.capture = None
+
+# Streaming a payload in chunks, each one sent while the next arrives.
+import binascii
+from dmcomm import CommandError
+from dmcomm.hardware.misc import run_steps, run_steps_async
+payload = bytes(i * 91 % 256 for i in range(300))
+async def upload(chunk_size):
+	transfer = a.controller.transfer("!XL", len(payload))
+	for (index, start) in enumerate(range(0, len(payload), chunk_size)):
+		chunk = payload[start:start + chunk_size]
+		checksum = binascii.crc32(chunk)
+		assert await run_steps_async(transfer.add_chunk_steps(index, chunk, checksum), 0) == checksum
+	await run_steps_async(transfer.finish_steps(), 0)
+	return transfer
+b.controller.set_options("!XL", capture_maxlen=6000)
+assert xloader_b.capture_maxlen == 6000
+digirom_b = dmcomm.protocol.parse_command("!XL0")
+(transfer, error_b) = sim.run((a, upload(64)), (b, b.execute_async(digirom_b)))
+b.controller.set_options("!XL", capture_maxlen=None)
+assert error_b is None, error_b
+assert str(digirom_b.result).startswith("r:" + payload.hex().upper()), digirom_b.result
+assert transfer.limit_bytes_per_second == 334
+# The options are given to communicators created later.
+from dmcomm.hardware import Controller
+controller = Controller()
+controller.register(b.ir_output)
+controller.register(b.ir_input_raw)
+controller.set_options("!XL", capture_maxlen=6000, capture_idle_ms=10)
+xloader = controller._get_communicator("!XL")
+assert (xloader.capture_maxlen, xloader.capture_idle_ms) == (6000, 10)
+try:
+	controller.set_options("!XL", nonsense=1)
+	assert False
+except TypeError:
+	pass
+assert 320 < transfer.bytes_per_second <= 334, transfer.bytes_per_second
+transfer = a.controller.transfer("!XL", 4)
+for (index, chunk, checksum, message) in [
+	(1, b"ab", binascii.crc32(b"ab"), "chunk 1: expected 0"),
+	(0, b"ab", 0, "chunk 0: checksum"),
+	(0, b"abcde", binascii.crc32(b"abcde"), "chunk 0: past length 4"),
+]:
+	try:
+		run_steps(transfer.add_chunk_steps(index, chunk, checksum))
+		assert False, message
+	except CommandError as e:
+		assert str(e).startswith(message), e
+
+# DL/FL/LT durations come from a table into a buffer kept between packets.
+from dmcomm.hardware.comms import modulated, modulated_shared
+send_buffer = modulated_shared.SendBuffer(modulated.ModulatedParams("FL"), 1)
+assert list(send_buffer.fill([0x80, 0x01])) == ([5880, 3872] + [480, 1450] + [480, 480] * 14
+	+ [480, 1450] + [950, 1500])
+assert send_buffer.max_bytes == 2
+assert list(send_buffer.fill([0xFF])) == [5880, 3872] + [480, 1450] * 8 + [950, 1500]
+
+# C sends from a table of 4-bit values and decodes a word at a time.
+import collections
+from dmcomm.hardware.comms import color
+params = color.ColorParams("C")
+assert list(color.nibble_table(params)[5 * 16:6 * 16]) == [1, 500, 0, 1500, 1, 500, 0, 500] * 2
+durations = [150000] + [500, 500] * 16 + [500, 1500] * 16 + [500, 1500] * 6 * 16
+assert color.decode(collections.deque(durations), params) == [0x0000] + [0xFFFF] * 7
+durations[1 + 2 * 17 + 1] = 1800
+try:
+	color.decode(collections.deque(durations), params)
+	assert False
+except ReceiveError as e:
+	assert str(e) == "bit_active 18 = 1800", e
+
+# DL receive finishes soon after the stop pulse, instead of waiting for packet_continue_timeout_ms.
+params = modulated.ModulatedParams("DL")
+durations = modulated_shared.SendBuffer(params).fill(list(bytes.fromhex("FEDCBA9876543210")))
+stats_a = Stats(4)
+a.controller.stats = stats_a
+exchange("DL1-0123456789ABCDEF", "DL2-FEDCBA9876543210")
+a.controller.stats = None
+# From the end of the start pulse to the end of the stop pulse, then idle for longer than a bit.
+packet_us = sum(durations[1:-1])
+(_, packet_min_us, _, packet_max_us, _) = stats_a.summary(stats.PACKET)
+assert packet_us < packet_min_us and packet_max_us < packet_us + 5000, (packet_us, packet_min_us)
+
+# Talis keeps one state machine for both directions. Sending returns when the packet has gone,
+# and the state machine is recording by then.
+import array
+talis_resource = a.controller._resources[a.talis_input_output.pin]
+half_duplex = talis_resource._object
+exchange("LT1-0123456789ABCDEF", "LT2-FEDCBA9876543210")
+assert talis_resource._object is half_duplex
+async def send_talis():
+	start_us = a.clock.now_us
+	half_duplex.send(array.array("H", [500, 300, 400, 300]))
+	return (start_us, a.clock.now_us, half_duplex.paused, len(half_duplex))
+((start_us, return_us, paused, length),) = sim.run((a, send_talis()))
+model = half_duplex._state_machine.recorder
+assert return_us - start_us >= 1500, (start_us, return_us)
+assert model.tx_end_us < model.rx_armed_us <= return_us, (model.tx_end_us, model.rx_armed_us, return_us)
+assert return_us - model.tx_end_us < 5, (model.tx_end_us, return_us)
+# The 0 pushed when recording starts isn't one of the durations.
+assert not paused and length == 0
+
+# iC receive ends soon after the input stops, even without the C1 terminator.
+from dmcomm.protocol import ic_encoding
+ic_a = a.controller._get_communicator("IC")
+ic_b = b.controller._get_communicator("IC")
+ic_a.enable("IC")
+ic_b.enable("IC")
+async def send_unterminated():
+	ic_a.send_bytes(ic_encoding.encode(0x0007)[:-1])
+async def receive_unterminated():
+	bytes_received = await run_steps_async(ic_b.receive_bytes_steps(1000), 0)
+	return (bytes_received, b.clock.now_us)
+(_, (bytes_received, receive_end_us)) = sim.run((a, send_unterminated()), (b, receive_unterminated()))
+last_edge_us = list(sim.connection(a.ir_output.pin_output).net.events_between(0, receive_end_us))[-1]
+# The first bytes are skipped while finding the gap between bytes.
+assert bytes_received[-8:] == ic_encoding.encode(0x0007)[-9:-1], bytes_received
+# 12 ticks of 100us after the last pulse, plus polling.
+assert 1200 < receive_end_us - last_edge_us < 1600, receive_end_us - last_edge_us
+
+# iC and Xros Loader can receive whole bytes from PIO programs.
+from dmcomm.hardware.resources import PioByteIn
+b.controller.set_options("IC", pio_receive=True)
+b.controller.set_options("!XL", pio_receive=True)
+(actual_a, actual_b) = exchange("IC1-0007-0101-C1C0", "IC2-0007-7D7D-0000")
+assert actual_a.startswith("s:0007 r:0007 s:0101 r:7D7D s:C1C0 r:0000"), actual_a
+assert actual_b.startswith("r:0007 s:0007 r:0101 s:7D7D r:C1C0 s:0000"), actual_b
+assert isinstance(b.controller._resources[b.ir_input_raw.pin_input]._object, PioByteIn)
+(_, (bytes_received, _)) = sim.run((a, send_unterminated()), (b, receive_unterminated()))
+assert bytes_received[-8:] == ic_encoding.encode(0x0007)[-9:-1], bytes_received
+payload = "".join("%02X" % (i * 37 % 256) for i in range(64)) + "00FF807F01FE"
+(actual_a, actual_b) = exchange("!XL1-" + payload, "!XL2-0A0B")
+assert actual_a.startswith("s:%s r:0A0B" % payload), actual_a
+assert actual_b.startswith("r:%s s:0A0B" % payload), actual_b
+b.controller.set_options("IC", pio_receive=False)
+b.controller.set_options("!XL", pio_receive=False)
+exchange("IC1-0007", "IC2-0007")
+assert not isinstance(b.controller._resources[b.ir_input_raw.pin_input]._object, PioByteIn)
+
+# V/X/Y can have the bits classified by a PIO program, so the result is ready when the packet ends.
+from dmcomm.hardware.resources import PioClassicIn
+b.controller.set_options("X", pio_receive=True)
+classic_b = b.controller._get_communicator("V")
+assert classic_b.pio_receive
+for (command_a, command_b, result_a, result_b) in [
+	("V1-FC03-FD02", "V2-1234-8001", "s:FC03 r:1234 s:FD02 r:8001", "r:FC03 s:1234 r:FD02 s:8001"),
+	("X1-0001-FFFF", "X2-0003-0004", "s:0001 r:0003 s:FFFF r:0004", "r:0001 s:0003 r:FFFF s:0004"),
+	("Y1-8001-0002", "Y2-0003-F004", "s:8001 r:0003 s:0002 r:F004", "r:8001 s:0003 r:0002 s:F004"),
+]:
+	(actual_a, actual_b) = exchange(command_a, command_b)
+	assert actual_a.startswith(result_a), (command_a, actual_a)
+	assert actual_b.startswith(result_b), (command_b, actual_b)
+assert isinstance(b.controller._resources[b.prong_input.pin_input]._object, PioClassicIn)
+classic_a = a.controller._get_communicator("V")
+classic_a.enable("V")
+classic_b.enable("V")
+classifier = b.controller._resources[b.prong_input.pin_input]._object
+async def send_classic():
+	classic_a.send(0xA55A)
+async def receive_classic():
+	result = await run_steps_async(classic_b.receive_steps(1000), 0)
+	return (result, b.clock.now_us)
+(_, (result, receive_end_us)) = sim.run((a, send_classic()), (b, receive_classic()))
+assert result == 0xA55A, result
+# Finished straight after the last active period, before the sender releases the prongs.
+last_edge_us = list(sim.connection(a.prong_output.pin_drive_signal).net.events_between(0, receive_end_us))[-1]
+assert 0 <= receive_end_us - last_edge_us < 100, receive_end_us - last_edge_us
+assert classifier._state_machine.recorder.classify_us < last_edge_us
+b.controller.set_options("V", pio_receive=False)
+exchange("V1-FC03", "V2-FC03")
+assert not isinstance(b.controller._resources[b.prong_input.pin_input]._object, PioClassicIn)
+
+# Witches records with a PIO state machine, which times the long runs of 0 or 1 that PulseIn can't.
+from dmcomm.hardware.resources import PioPulseIn
+(actual_a, actual_b) = exchange("MW1-00FF80-FF7F01", "MW2-FF01-0080")
+assert actual_a.startswith("s:00FF80 r:FF01 s:FF7F01 r:0080"), actual_a
+assert actual_b.startswith("r:00FF80 s:FF01 r:FF7F01 s:0080"), actual_b
+assert isinstance(resources[a.prong_input.pin_input]._object, PioPulseIn)
+
+# Scheduling repeats.
+from dmcomm.hardware import scheduler
+digirom = dmcomm.protocol.parse_command("V1-FC03")
+digirom.prepare()
+assert scheduler.outcome(digirom.result) == scheduler.TIMEOUT
+assert scheduler.outcome(digirom.result, ReceiveError("x")) == scheduler.ERROR
+digirom_listen = dmcomm.protocol.parse_command("V2-FC03")
+assert sim.run((a, a.execute_async(digirom)), (b, b.execute_async(digirom_listen))) == [None, None]
+assert scheduler.outcome(digirom.result) == scheduler.COMPLETE
+assert scheduler.outcome(digirom_listen.result) == scheduler.COMPLETE
+s = scheduler.Scheduler(default_cadence_ms=1000, backoff_min_ms=100, backoff_max_ms=350)
+s.set_cadence("X", 3000)
+assert s.cadence_ms("V") == 1000 and s.cadence_ms("X") == 3000
+assert s.cadences() == [("X", 3000)]
+assert s.delay_ms(digirom, scheduler.COMPLETE, 300) == 700
+assert s.delay_ms(digirom, scheduler.COMPLETE, 1300) == 0
+assert s.delay_ms(digirom_listen, scheduler.COMPLETE, 300) == 0
+assert [s.delay_ms(digirom_listen, scheduler.TIMEOUT, 5000) for i in range(4)] == [100, 200, 350, 350]
+assert s.delay_ms(digirom, scheduler.COMPLETE, 0) == 1000
+# Turn 1 doesn't repeat any sooner than the cadence after an error, and backs off beyond it.
+assert s.delay_ms(digirom, scheduler.ERROR, 0) == 1000
+assert s.delay_ms(digirom, scheduler.TIMEOUT, 900) == 200
+s.reset()
+assert s.delay_ms(digirom, scheduler.ERROR, 950) == 100
+
+# Turn 0 with nothing sending times out without error.
+digirom = dmcomm.protocol.parse_command("V0")
+assert a.execute(digirom) is None
+assert str(digirom.result) == "t"
+
+# Pulses played into the input by hand: V packet with the start pulse too short.
+durations = [60000, 2000, 300] + [1000, 2600] * 16 + [400]
+net = sim.connection(a.prong_input.pin_input).net
+net.inject(sim.horizon_us + 1000, durations, first_level=False)
+digirom = dmcomm.protocol.parse_command("V2-0000")
+error = a.execute(digirom)
+assert isinstance(error, ReceiveError), error
+assert str(error) == "start_active = 300", error
+
+# Sniffing records every packet from a third device, including the replies, with the times they started.
+c = simulator.Device(sim, "C")
+prongs = sim.connection(a.prong_input.pin_input).net
+sim.attach(c.prong_input.pin_input, prongs)
+light_a = sim.connection(b.ir_input_raw.pin_input).net
+sim.attach(c.ir_input_raw.pin_input, light_a, inverted=True)
+sim.attach(c.ir_input_modulated.pin_input, light_a, inverted=True)
+
+class StopSniffing(Exception):
+	pass
+
+def sniff(command_a, command_b, signal_type, count):
+	packets = []
+	def callback(time_us, data, error):
+		packets.append((time_us, data, error))
+		if len(packets) == count:
+			raise StopSniffing()
+	digirom_a = dmcomm.protocol.parse_command(command_a)
+	digirom_b = dmcomm.protocol.parse_command(command_b)
+	# C starts listening first.
+	results = sim.run((c, c.controller.sniff_async(signal_type, callback, 0)),
+		(a, a.execute_async(digirom_a)), (b, b.execute_async(digirom_b)))
+	assert isinstance(results[0], StopSniffing) and results[1:] == [None, None], results
+	return packets
+
+start_us = sim.horizon_us
+packets = sniff("V1-FC03-FD02", "V2-1234-5678", "V", 4)
+assert [(data, error) for (time_us, data, error) in packets] == [
+	(0xFC03, None), (0x1234, None), (0xFD02, None), (0x5678, None)], packets
+# Each time is when the pre-active period started.
+events = prongs.events_between(start_us, sim.horizon_us)
+pre_active_us = [events[i] for i in range(len(events) - 1)
+	if not prongs.level_at(events[i]) and events[i + 1] - events[i] > 40000]
+assert len(pre_active_us) == 4, pre_active_us
+for ((time_us, data, error), expected_us) in zip(packets, pre_active_us):
+	assert abs(time_us - expected_us) < 100, (time_us, expected_us)
+assert [data for (time_us, data, error) in sniff("IC1-0007-0101", "IC2-0007-0303", "IC", 2)] == [0x0007, 0x0101]
+assert [data for (time_us, data, error) in sniff("DL1-AB-CD", "DL2-12-34", "DL", 2)] == [[0xAB], [0xCD]]
+# C has a pre-active period longer than PulseIn can time, which doesn't end the packet.
+packets = sniff("C1-0001000200030004000500060007000F", "C2-1111222233334444555566667777888F", "C", 2)
+assert [data for (time_us, data, error) in packets] == [
+	[1, 2, 3, 4, 5, 6, 7, 15], [0x1111, 0x2222, 0x3333, 0x4444, 0x5555, 0x6666, 0x7777, 0x888F]], packets
+# Broken packets are reported and sniffing carries on.
+net = sim.connection(c.prong_input.pin_input).net
+net.inject(sim.horizon_us + 1000, durations, first_level=False)
+net.inject(sim.horizon_us + 200_000, [60000, 2000, 900] + [1000, 2600] * 16 + [400], first_level=False)
+packets = []
+def callback(time_us, data, error):
+	packets.append((data, str(error)))
+	if len(packets) == 2:
+		raise StopSniffing()
+assert isinstance(sim.run((c, c.controller.sniff_async("V", callback, 0)))[0], StopSniffing)
+assert packets == [(None, "start_active = 300"), (0x0000, "None")], packets
+try:
+	c.controller.sniff("MW", callback)
+	assert False
+except CommandError as e:
+	assert str(e) == "sniffing not supported for MW", e
+
+print("ok")
@@ -0,0 +1,148 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# We can test the PIO programs from CPython using the emulator,
+# and check that the models in the simulator match them.
+# Run from the repository root: python utils/test_pio.py
+
+import pio_emulator
+import simulator
+
+pio_programs = pio_emulator.load_programs()
+
+def model_edges(model, buffer, frequency):
+	"Output of a TX model in the simulator as (time_us, level), with the pin low when released."
+	steps = model(buffer, 1_000_000 / frequency)
+	result = []
+	try:
+		while True:
+			(time_us, level) = next(steps)
+			result.append((time_us, bool(level)))
+	except StopIteration as e:
+		return (result, e.value)
+
+def bytes_TX(program, frequency, data):
+	state_machine = pio_emulator.StateMachine(program, frequency, first_out_pin=0, first_set_pin=0)
+	state_machine.write(data)
+	state_machine.run_until_idle()
+	return state_machine
+
+def bytes_RX(program, frequency, edges, end_us):
+	"Plays the IR output from `edges` into the raw input, which is active low."
+	state_machine = pio_emulator.StateMachine(program, frequency, first_in_pin=0, jmp_pin=0)
+	state_machine.drive_input(0, [(time_us, not level) for (time_us, level) in edges], initial=True)
+	state_machine.run_until(end_us)
+	return [word for (time_us, word) in state_machine.pushed]
+
+def classic_buffer(bits):
+	"prong_TX words for a V packet, as made by `ClassicCommunicator`."
+	buffer = [1, 3000, 0, 59000, 1, 2083, 0, 917]
+	for i in range(16):
+		if (bits >> i) & 1:
+			buffer.extend([1, 2667, 0, 1667])
+		else:
+			buffer.extend([1, 1000, 0, 3167])
+	buffer.extend([1, 400, 2])
+	return buffer
+
+# iC and Xros Loader output matches the models to the cycle, and the FIFO keeps up with the program.
+for (program, model, frequency, data) in [
+	(pio_programs.iC_TX, simulator._iC_TX_model, 100_000, b"\xFF\x12\x7D\xC0"),
+	(pio_programs.xloader_TX, simulator._xloader_TX_model, 583430, bytes(range(0, 256, 17))),
+]:
+	state_machine = bytes_TX(program, frequency, data)
+	(expected_edges, expected_end_us) = model_edges(model, data, frequency)
+	edges = state_machine.edges(0, pull=False)
+	assert [level for (time_us, level) in edges] == [False] + [level for (time_us, level) in expected_edges]
+	for ((time_us, level), (expected_us, expected_level)) in zip(edges[1:], expected_edges):
+		assert abs(time_us - expected_us) < 0.001, (time_us, expected_us)
+	assert abs(state_machine.time_us - expected_end_us) < 0.001, (state_machine.time_us, expected_end_us)
+	assert state_machine.stalled_cycles == 0, state_machine.stalled_cycles
+# 1743 cycles per byte at 583430Hz is about 335 bytes per second.
+state_machine = bytes_TX(pio_programs.xloader_TX, 583430, bytes(70))
+assert 334 < 70 / (state_machine.time_us / 1_000_000) < 335
+
+# Each delay word for prong_TX takes a few cycles longer than its value, and the drive words are instant.
+buffer = classic_buffer(0xFFC2)
+state_machine = pio_emulator.StateMachine(pio_programs.prong_TX, 1_000_000,
+	first_set_pin=0, set_pin_count=2, initial_set_pin_direction=0)
+state_machine.write(buffer)
+state_machine.run_until_idle()
+assert state_machine.stalled_cycles == 0
+edges = state_machine.edges(0)
+end_us = state_machine.time_us - 1
+assert edges[0] == (0, None) and edges[-1] == (end_us, None)
+pulses = [edges[i + 1][0] - edges[i][0] for i in range(1, len(edges) - 1)]
+assert len(pulses) == 37, len(pulses)
+for (pulse, sent) in zip(pulses, buffer[1::2]):
+	assert sent + 10 <= pulse <= sent + 13, (pulse, sent)
+# Pin 1 only drives low, and both pins are released together.
+assert state_machine.edges(1) == [(0, None), (edges[1][0], False), (end_us, None)]
+prong_edges = state_machine.edges(0, pull=True)
+
+# The RX programs decode what the TX programs send.
+state_machine = bytes_TX(pio_programs.xloader_TX, 583430, b"\x12\x34\x00\xFF")
+assert bytes_RX(pio_programs.xloader_RX, 4 * 583430, state_machine.edges(0, pull=False),
+	state_machine.time_us) == [0x12, 0x34, 0x00, 0xFF]
+# iC skips the first byte while finding the gap between bytes.
+state_machine = bytes_TX(pio_programs.iC_TX, 100_000, b"\xFF\xFF\x12\x7D\xC0")
+assert bytes_RX(pio_programs.iC_RX, 400_000, state_machine.edges(0, pull=False),
+	state_machine.time_us) == [0xFF, 0x12, 0x7D, 0xC0]
+# V/X/Y: pushes when the pre-active period ends, then the bits in the top 16 bits, then the end.
+for (program, idle_state) in [
+	(pio_programs.classic_RX_idle_high, True),
+	(pio_programs.classic_RX_idle_low, False),
+]:
+	state_machine = pio_emulator.StateMachine(program, 2_000_000, first_in_pin=0, jmp_pin=0)
+	state_machine.drive_input(0, [(time_us, level == idle_state) for (time_us, level) in prong_edges],
+		initial=idle_state)
+	state_machine.write([40000, 1800])
+	state_machine.run_until(prong_edges[-1][0] + 10)
+	pushed = state_machine.pushed
+	assert len(pushed) == 3, pushed
+	assert pushed[1][1] >> 16 == 0xFFC2, hex(pushed[1][1])
+	# Each push is within a few cycles of the edge it waits for.
+	for ((time_us, word), edge_index) in zip(pushed, [2, -2, -1]):
+		assert 0 <= time_us - prong_edges[edge_index][0] < 5, (time_us, prong_edges[edge_index])
+
+def check_pushed(pushed, input_edges):
+	"Each pushed duration matches the driven input, and is pushed within a few cycles of the edge which ends it."
+	expected = [input_edges[i + 1][0] - input_edges[i][0] for i in range(len(input_edges) - 1)]
+	assert len(pushed) == len(expected), pushed
+	for ((time_us, word), duration, (edge_us, level)) in zip(pushed, expected, input_edges[1:]):
+		assert -3 <= word - duration <= 0, (word, duration)
+		assert 0 <= time_us - edge_us < 3, (time_us, edge_us)
+
+# pulse_RX waits for the input to go high, then pushes each duration, including those over 0xFFFF.
+state_machine = pio_emulator.StateMachine(pio_programs.pulse_RX, 2_000_000, first_in_pin=0, jmp_pin=0)
+input_edges = [(1000, True), (1600, False), (1900, True), (72000, False), (72100, True), (72500, False)]
+state_machine.drive_input(0, input_edges)
+state_machine.run_until(73000)
+check_pushed(state_machine.pushed, input_edges)
+
+# talis_half_duplex sends each duration a few cycles long, then lets go of the pin, pushes a 0,
+# and records the reply.
+sent = [500, 300, 1000, 250]
+state_machine = pio_emulator.StateMachine(pio_programs.talis_half_duplex, 2_000_000,
+	first_set_pin=0, first_in_pin=0, jmp_pin=0, initial_set_pin_direction=0)
+state_machine.write(sent + [0])
+while len(state_machine.edges(0)) < 7:
+	state_machine.run(1)
+edges = state_machine.edges(0)
+assert [level for (time_us, level) in edges] == [None, False, True, False, True, False, None], edges
+pulses = [edges[i + 1][0] - edges[i][0] for i in range(2, len(edges) - 2)]
+for (pulse, duration) in zip(pulses, sent):
+	assert duration + 1 <= pulse <= duration + 3, (pulse, duration)
+# From when the last low period is due to end, it takes 3us to switch to input.
+(release_us, level) = edges[-1]
+assert 0 < release_us - (edges[-2][0] + sent[-1]) <= 3, edges
+# A reply starting straight away is measured in full.
+input_edges = [(time_us + release_us + 3, level) for (time_us, level) in
+	[(0, True), (600, False), (900, True), (1300, False), (2900, True), (3000, False)]]
+state_machine.drive_input(0, input_edges)
+state_machine.run_until(input_edges[-1][0] + 100)
+(marker_us, marker) = state_machine.pushed[0]
+assert marker == 0 and 0 < marker_us - release_us < 1, (marker_us, release_us)
+check_pushed(state_machine.pushed[1:], input_edges)
+assert state_machine.edges(0)[-1] == (release_us, None)
+
+print("ok")
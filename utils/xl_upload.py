@@ -0,0 +1,55 @@
+# This file is part of the DMComm project by BladeSabre. License: MIT.
+
+# Streams a file to a Xros Loader through dmcomm-python's "U" command.
+# Needs pyserial. Usage: python utils/xl_upload.py <serial port> <file> [chunk size]
+
+import binascii
+import sys
+
+import serial
+
+def chunk_commands(payload, chunk_size=64):
+	"""Returns the lines to send for `payload`, starting with the "U-<length>" command."""
+	commands = ["U-%d" % len(payload)]
+	for (index, start) in enumerate(range(0, len(payload), chunk_size)):
+		chunk = payload[start:start + chunk_size]
+		commands.append("U-%d-%s-%08X" % (index, chunk.hex().upper(), binascii.crc32(chunk)))
+	return commands
+
+def read_reply(port):
+	"""Returns the next line which is a reply to a command, skipping anything else."""
+	while True:
+		line = port.readline().decode("utf-8", "replace").strip()
+		if line == "":
+			raise TimeoutError("no reply")
+		if " -> " in line:
+			return line.split(" -> ", 1)[1]
+		print(line)
+
+def upload(port, payload, chunk_size=64, retries=3):
+	for command in chunk_commands(payload, chunk_size):
+		for attempt in range(retries):
+			port.write((command + "\r\n").encode("ascii"))
+			reply = read_reply(port)
+			if reply.startswith("[upload"):
+				print(reply)
+				break
+			print("retrying:", reply)
+		else:
+			raise RuntimeError("chunk failed: " + reply)
+	line = ""
+	while not line.startswith("[upload done"):
+		line = port.readline().decode("utf-8", "replace").strip()
+		if line == "":
+			raise TimeoutError("upload not finished")
+	print(line)
+
+if __name__ == "__main__":
+	if len(sys.argv) not in [3, 4]:
+		print("usage: python xl_upload.py <serial port> <file> [chunk size]")
+		sys.exit(1)
+	with open(sys.argv[2], "rb") as f:
+		payload = f.read()
+	chunk_size = int(sys.argv[3]) if len(sys.argv) == 4 else 64
+	with serial.Serial(sys.argv[1], timeout=5) as port:
+		upload(port, payload, chunk_size)